@@ -0,0 +1,117 @@
+import asyncio
+import math
+import time
+
+
+class AdmissionController:
+    """
+    Admission control based on the estimated drain time of the task queue
+
+    The queue depth is refreshed in the background, so admission decisions
+    never touch the broker. The drain rate is derived from consecutive depth
+    samples plus the number of jobs this process published in between:
+
+        drained = previous_depth + published - depth
+
+    held_backlog() counts jobs accepted but not yet published (e.g. waiting
+    in the fair scheduler), which are part of the backlog all the same.
+    """
+
+    def __init__(self, limits, refresh_interval=1.0, smoothing=0.3,
+                 initial_drain_rate=1.0, max_retry_after=300, held_backlog=None):
+        # priority -> maximum acceptable drain time in seconds
+        self.limits = limits
+        self.refresh_interval = refresh_interval
+        self.smoothing = smoothing
+        self.max_retry_after = max_retry_after
+        self.held_backlog = held_backlog or (lambda: 0)
+
+        self.depth = 0
+        self.drain_rate = initial_drain_rate
+        self.updated_at = None
+        self.published_since_update = 0
+        self.rejected = {priority: 0 for priority in limits}
+
+    def record_published(self, count=1):
+        """Count jobs published since the last depth sample"""
+        self.published_since_update += count
+
+    def update_depth(self, depth, timestamp=None):
+        """Record a new depth sample and refresh the drain rate estimate"""
+        timestamp = timestamp or time.time()
+
+        if self.updated_at is not None:
+            elapsed = timestamp - self.updated_at
+            drained = self.depth + self.published_since_update - depth
+            # Only a non-empty queue tells us how fast workers can drain it
+            if elapsed > 0 and drained >= 0 and (self.depth > 0 or depth > 0):
+                rate = drained / elapsed
+                self.drain_rate = self.smoothing * rate + (1 - self.smoothing) * self.drain_rate
+
+        self.depth = depth
+        self.updated_at = timestamp
+        self.published_since_update = 0
+
+    def drain_time(self):
+        """Estimated seconds until the current backlog is processed"""
+        backlog = self.depth + self.published_since_update + self.held_backlog()
+        if backlog == 0:
+            return 0.0
+        if self.drain_rate <= 0:
+            return math.inf
+        return backlog / self.drain_rate
+
+    def estimated_depth(self, now=None):
+        """Task queue depth now: the last sample plus publishes since, minus the expected drain"""
+        if self.updated_at is None:
+            return self.depth + self.published_since_update
+        elapsed = max((now or time.time()) - self.updated_at, 0)
+        return max(self.depth + self.published_since_update - self.drain_rate * elapsed, 0)
+
+    def check(self, priority):
+        """
+        Decide whether a job of this priority may be admitted
+
+        Returns (admitted, retry_after_seconds, drain_time_seconds).
+        Retry-After is the time until the backlog falls back under the
+        priority's limit at the current drain rate.
+        """
+        limit = self.limits[priority]
+        drain_time = self.drain_time()
+
+        if drain_time <= limit:
+            return True, None, drain_time
+
+        self.rejected[priority] += 1
+
+        if math.isinf(drain_time):
+            retry_after = self.max_retry_after
+        else:
+            retry_after = min(max(math.ceil(drain_time - limit), 1), self.max_retry_after)
+
+        return False, retry_after, drain_time
+
+    def stats(self):
+        drain_time = self.drain_time()
+
+        return {
+            "depth": self.depth,
+            "drain_rate": self.drain_rate,
+            "drain_time": None if math.isinf(drain_time) else drain_time,
+            "limits": self.limits,
+            "rejected": self.rejected,
+            "updated_at": self.updated_at
+        }
+
+    async def run(self, fetch_depth):
+        """Refresh loop; fetch_depth is a blocking callable run in a thread"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            try:
+                depth = await loop.run_in_executor(None, fetch_depth)
+                self.update_depth(depth)
+            except Exception as e:
+                print(f"Admission control: error refreshing queue depth: {e}")
+
+            await asyncio.sleep(self.refresh_interval)
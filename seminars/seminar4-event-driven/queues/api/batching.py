@@ -0,0 +1,73 @@
+import asyncio
+
+
+class EnvelopePublisher:
+    """
+    Fill job envelopes from concurrent requests within a linger window
+
+    The first job to arrive starts a timer; when it fires (or max_jobs are
+    waiting) everything collected so far is handed to publish() in a thread.
+    Every submit() returns only after the broker has its jobs, so a request
+    still answers "queued" only for jobs that are durable. Waiting up to
+    linger seconds is what lets several small requests share one message.
+    """
+
+    def __init__(self, publish, linger=0.01, max_jobs=50):
+        # publish(jobs) is blocking and splits jobs into envelopes itself
+        self.publish = publish
+        self.linger = linger
+        self.max_jobs = max_jobs
+
+        self.pending = []  # (jobs, future)
+        self.pending_jobs = 0
+        self.timer = None
+
+        self.flushes = 0
+        self.jobs = 0
+
+    async def submit(self, jobs):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((jobs, future))
+        self.pending_jobs += len(jobs)
+
+        if self.pending_jobs >= self.max_jobs or self.linger <= 0:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.linger, self._flush)
+
+        await future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        batch, self.pending, self.pending_jobs = self.pending, [], 0
+        if batch:
+            asyncio.ensure_future(self._publish(batch))
+
+    async def _publish(self, batch):
+        jobs = [job for jobs, _ in batch for job in jobs]
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.publish, jobs)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.flushes += 1
+        self.jobs += len(jobs)
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    def stats(self):
+        return {
+            "linger_ms": self.linger * 1000,
+            "max_jobs": self.max_jobs,
+            "flushes": self.flushes,
+            "jobs": self.jobs,
+            "jobs_per_flush": self.jobs / self.flushes if self.flushes else None
+        }
@@ -17,12 +17,83 @@ class Settings(BaseSettings):
     
     # Queues
     task_queue: str = "image_processing"
+    
+    # Task queue shards: jobs are routed by consistent hashing of SHARD_KEY
+    # ("job_id" or "digest", the SHA-256 of the image) onto N queues
+    task_queue_shards: int = int(os.getenv("TASK_QUEUE_SHARDS", "1"))
+    shard_key: str = os.getenv("SHARD_KEY", "job_id")
     notification_queue: str = "notifications"
     dlq_queue: str = "dead_letter_queue"
     
+    # Fanout exchange for job completion events; the notification queue and
+    # any number of observers (load tests, dashboards) bind to it
+    job_events_exchange: str = "job_events"
+    
+    # Streaming job events (GET /events): one shared consumer per API process
+    job_events_enabled: bool = os.getenv("JOB_EVENTS_ENABLED", "true").lower() == "true"
+    events_max_jobs: int = int(os.getenv("EVENTS_MAX_JOBS", "1000"))
+    events_keepalive: float = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+    
+    # Job envelopes: /upload/batch publishes several jobs per AMQP message,
+    # collecting concurrent requests for up to envelope_linger_ms
+    envelope_max_jobs: int = int(os.getenv("ENVELOPE_MAX_JOBS", "50"))
+    envelope_linger_ms: float = float(os.getenv("ENVELOPE_LINGER_MS", "10"))
+    batch_max_files: int = int(os.getenv("BATCH_MAX_FILES", "100"))
+    
     # Buckets
     upload_bucket: str = "images"
     processed_bucket: str = "processed"
+    # Cancellation tombstones (DELETE /jobs/{job_id}), read by every worker
+    control_bucket: str = "control"
+    
+    # Direct uploads: clients PUT straight to MinIO with a presigned URL,
+    # so it must name an endpoint they can reach (not the compose hostname)
+    minio_public_endpoint: str = os.getenv("MINIO_PUBLIC_ENDPOINT", "localhost:9000")
+    minio_public_secure: bool = os.getenv("MINIO_PUBLIC_SECURE", os.getenv("MINIO_SECURE", "false")).lower() == "true"
+    minio_region: str = os.getenv("MINIO_REGION", "us-east-1")
+    direct_upload_expiry: int = int(os.getenv("DIRECT_UPLOAD_EXPIRY", "900"))
+    direct_upload_max_bytes: int = int(os.getenv("DIRECT_UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+    
+    # Result delivery: "redirect" to a short-lived presigned GET or "stream"
+    # the object through the API; processed outputs never change
+    result_delivery: str = os.getenv("RESULT_DELIVERY", "redirect")
+    result_url_expiry: int = int(os.getenv("RESULT_URL_EXPIRY", "300"))
+    result_max_age: int = int(os.getenv("RESULT_MAX_AGE", str(365 * 24 * 3600)))
+
+    # Admission control: maximum estimated drain time (seconds) of the task
+    # queue at which uploads of each priority are still accepted
+    admission_enabled: bool = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    admission_refresh_interval: float = float(os.getenv("ADMISSION_REFRESH_INTERVAL", "1.0"))
+    admission_initial_drain_rate: float = float(os.getenv("ADMISSION_INITIAL_DRAIN_RATE", "1.0"))
+    admission_max_drain_low: float = float(os.getenv("ADMISSION_MAX_DRAIN_LOW", "120"))
+    admission_max_drain_normal: float = float(os.getenv("ADMISSION_MAX_DRAIN_NORMAL", "600"))
+    admission_max_drain_high: float = float(os.getenv("ADMISSION_MAX_DRAIN_HIGH", "1800"))
+    
+    # Per-client fair scheduling: uploads are tagged with X-Client-ID (else
+    # the caller's address), wait in per-client sub-queues in the API and are
+    # dispatched by deficit round robin while the task queue holds fewer
+    # than fair_dispatch_depth jobs (keep it above the workers' total prefetch).
+    # Off by default: held jobs are not in the broker's queue depth the
+    # autoscaler and the drain-ETA monitors read (only fair_scheduling.queued_jobs
+    # in /metrics shows them), batch uploads skip the envelope publisher's
+    # linger, and jobs still held when the API restarts are lost
+    fair_scheduling: bool = os.getenv("FAIR_SCHEDULING", "false").lower() == "true"
+    fair_dispatch_depth: int = int(os.getenv("FAIR_DISPATCH_DEPTH", "32"))
+    fair_quantum_bytes: int = int(os.getenv("FAIR_QUANTUM_BYTES", str(1024 * 1024)))
+    # "client=weight,..." multiplies a client's quantum (default weight 1)
+    client_weights: str = os.getenv("CLIENT_WEIGHTS", "")
+    
+    # Job deadlines: deadline_seconds at upload (else this default; 0 = none)
+    # becomes an absolute "deadline" in the job message. Expired jobs are
+    # dropped before dispatch and by workers before they download anything
+    default_deadline_seconds: float = float(os.getenv("DEFAULT_DEADLINE_SECONDS", "0"))
+    
+    # Per-client quotas at /upload: waiting jobs, and jobs/s with a burst (0 = no rate limit).
+    # Without fair scheduling a job waits until its terminal job event, so
+    # client_max_queued is only enforced there with job_events_enabled
+    client_max_queued: int = int(os.getenv("CLIENT_MAX_QUEUED", "1000"))
+    client_rate: float = float(os.getenv("CLIENT_RATE", "0"))
+    client_burst: float = float(os.getenv("CLIENT_BURST", "50"))
 
 
 settings = Settings()
@@ -0,0 +1,113 @@
+"""
+Job envelopes: several jobs in one AMQP message
+
+A single persistent message costs the broker an fsync, a delivery and an
+ack no matter how small it is, so batch uploads carry up to N jobs per
+message in a compact binary encoding. Layout (little-endian), version 1:
+
+    header  magic b"JENV" | version u8 | job count u16
+    job     job_id 16 bytes (UUID) | enqueued_at f8 | priority u8 |
+            operation count u8 | operation codes u8 * count |
+            file_name, original_name, bucket, timestamp: u16 length + UTF-8 |
+            extra: u32 length + JSON object with any other fields
+
+Messages with content_type CONTENT_TYPE are envelopes; plain JSON
+single-job messages stay valid. This file is kept identical in api/ and
+worker/ (separate build contexts).
+"""
+import json
+import struct
+import uuid
+
+
+CONTENT_TYPE = "application/vnd.image-jobs.envelope"
+MAGIC = b"JENV"
+VERSION = 1
+
+# Code tables are append-only: a code must never change meaning
+OPERATIONS = ["resize", "watermark", "filter"]
+PRIORITIES = ["low", "normal", "high"]
+
+HEADER = struct.Struct("<4sBH")
+JOB = struct.Struct("<16sdBB")
+LENGTH = struct.Struct("<H")
+EXTRA_LENGTH = struct.Struct("<I")
+
+STRING_FIELDS = ("file_name", "original_name", "bucket", "timestamp")
+SLOT_FIELDS = {"job_id", "enqueued_at", "priority", "operations", *STRING_FIELDS}
+
+
+def is_envelope(properties) -> bool:
+    return properties is not None and properties.content_type == CONTENT_TYPE
+
+
+def encode(jobs: list) -> bytes:
+    """Encode job messages (dicts as published to the task queue)"""
+    if not 0 < len(jobs) <= 0xFFFF:
+        raise ValueError(f"An envelope holds 1..65535 jobs, got {len(jobs)}")
+
+    parts = [HEADER.pack(MAGIC, VERSION, len(jobs))]
+    for job in jobs:
+        operations = job["operations"]
+        parts.append(JOB.pack(
+            uuid.UUID(job["job_id"]).bytes,
+            job.get("enqueued_at") or 0.0,
+            PRIORITIES.index(job.get("priority", "normal")),
+            len(operations)
+        ))
+        parts.append(bytes(OPERATIONS.index(op) for op in operations))
+
+        for field in STRING_FIELDS:
+            value = (job.get(field) or "").encode("utf-8")
+            parts.append(LENGTH.pack(len(value)))
+            parts.append(value)
+
+        extra = {k: v for k, v in job.items() if k not in SLOT_FIELDS}
+        extra = json.dumps(extra, separators=(",", ":")).encode("utf-8") if extra else b""
+        parts.append(EXTRA_LENGTH.pack(len(extra)))
+        parts.append(extra)
+
+    return b"".join(parts)
+
+
+def decode(body: bytes) -> list:
+    """Envelope bytes -> list of job messages; ValueError if malformed"""
+    view = memoryview(body)
+    try:
+        magic, version, count = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a job envelope")
+        if version != VERSION:
+            raise ValueError(f"Unsupported envelope version {version}")
+
+        offset = HEADER.size
+        jobs = []
+        for _ in range(count):
+            job_id, enqueued_at, priority, op_count = JOB.unpack_from(view, offset)
+            offset += JOB.size
+            job = {
+                "job_id": str(uuid.UUID(bytes=job_id)),
+                "enqueued_at": enqueued_at or None,
+                "priority": PRIORITIES[priority],
+                "operations": [OPERATIONS[code] for code in view[offset:offset + op_count]],
+            }
+            offset += op_count
+
+            for field in STRING_FIELDS:
+                (length,) = LENGTH.unpack_from(view, offset)
+                offset += LENGTH.size
+                job[field] = bytes(view[offset:offset + length]).decode("utf-8")
+                offset += length
+
+            (length,) = EXTRA_LENGTH.unpack_from(view, offset)
+            offset += EXTRA_LENGTH.size
+            if length:
+                job.update(json.loads(bytes(view[offset:offset + length])))
+                offset += length
+            jobs.append(job)
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed job envelope: {e}")
+
+    if offset != len(body):
+        raise ValueError("Trailing bytes after job envelope")
+    return jobs
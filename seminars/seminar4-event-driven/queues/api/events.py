@@ -0,0 +1,128 @@
+import asyncio
+import json
+import threading
+import time
+
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled", "expired")
+
+
+class Subscription:
+    """Job events for one streaming client"""
+
+    def __init__(self, job_ids, max_pending=1000):
+        self.job_ids = set(job_ids)
+        self.pending = set(job_ids)
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.dropped = 0
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client that stopped reading must not grow the API's memory
+            self.dropped += 1
+
+
+class JobEventHub:
+    """
+    Fan job events out to streaming clients from one shared consumer
+
+    A background thread holds the process's only subscription to the job
+    events fanout exchange (an exclusive queue, so the notification
+    service's queue is left alone) and hands every event to the event loop.
+    There the job's stored status is updated and the event is delivered to
+    the clients subscribed to that job, so no client has to poll /status.
+    """
+
+    def __init__(self, connect, exchange, on_event=None, reconnect_delay=2.0):
+        self.connect = connect
+        self.exchange = exchange
+        self.on_event = on_event
+        self.reconnect_delay = reconnect_delay
+
+        self.loop = None
+        self.subscribers = {}  # job_id -> set of Subscription
+        self.connected = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+        self.received = 0
+        self.delivered = 0
+        self.reconnects = 0
+
+    def start(self, loop):
+        self.loop = loop
+        self.thread = threading.Thread(target=self._run, name="job-events", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def subscribe(self, job_ids):
+        """Register a client; must be called on the event loop"""
+        subscription = Subscription(job_ids)
+        for job_id in subscription.job_ids:
+            self.subscribers.setdefault(job_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        for job_id in subscription.job_ids:
+            subscribers = self.subscribers.get(job_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[job_id]
+
+    def _dispatch(self, event):
+        """Runs on the event loop"""
+        self.received += 1
+        if self.on_event is not None:
+            self.on_event(event)
+
+        for subscription in list(self.subscribers.get(event.get("job_id"), ())):
+            subscription.deliver(event)
+            self.delivered += 1
+
+    def _on_message(self, ch, method, properties, body):
+        try:
+            event = json.loads(body)
+        except ValueError:
+            return
+        event["received_at"] = time.time()
+        self.loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _run(self):
+        while not self.stopping.is_set():
+            try:
+                connection = self.connect()
+                try:
+                    channel = connection.channel()
+                    channel.exchange_declare(exchange=self.exchange, exchange_type='fanout', durable=True)
+                    result = channel.queue_declare(queue='', exclusive=True, auto_delete=True)
+                    channel.queue_bind(queue=result.method.queue, exchange=self.exchange)
+                    channel.basic_consume(queue=result.method.queue, on_message_callback=self._on_message,
+                                          auto_ack=True)
+                    self.connected.set()
+
+                    while not self.stopping.is_set():
+                        connection.process_data_events(time_limit=0.5)
+                finally:
+                    self.connected.clear()
+                    if connection.is_open:
+                        connection.close()
+            except Exception as e:
+                if self.stopping.is_set():
+                    break
+                self.reconnects += 1
+                print(f"Job events consumer error, reconnecting: {e}")
+                time.sleep(self.reconnect_delay)
+
+    def stats(self):
+        return {
+            "connected": self.connected.is_set(),
+            "subscribed_jobs": len(self.subscribers),
+            "received": self.received,
+            "delivered": self.delivered,
+            "reconnects": self.reconnects
+        }
@@ -0,0 +1,349 @@
+import asyncio
+import math
+import re
+import time
+from collections import deque
+
+
+# X-Client-ID values; anything else is rejected rather than used as a key
+CLIENT_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:@-]{1,64}$")
+
+
+def parse_weights(spec):
+    """"premium=4,batch=0.5" -> {"premium": 4.0, "batch": 0.5}"""
+    weights = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        client, _, weight = item.partition("=")
+        weights[client.strip()] = float(weight)
+    return weights
+
+
+class LatencyWindow:
+    """The last `size` latency samples, summarized on demand"""
+
+    def __init__(self, size=1024):
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def summary(self):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+
+        def percentile(p):
+            return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+        return {
+            "count": len(ordered),
+            "p50": percentile(50),
+            "p95": percentile(95),
+            "p99": percentile(99),
+            "max": ordered[-1]
+        }
+
+
+class ClientQueue:
+    """One client's sub-queue, quota state and counters"""
+
+    def __init__(self, client, weight, burst):
+        self.client = client
+        self.weight = weight
+        self.units = deque()  # (unit, jobs, cost, submitted_at)
+        self.jobs = 0
+        self.outstanding = 0  # published directly and not ended yet
+        self.deficit = 0.0
+        self.tokens = burst
+        self.refilled_at = time.monotonic()
+        self.last_active = time.monotonic()
+
+        self.submitted = 0
+        self.dispatched = 0
+        self.rejected = 0
+        self.withdrawn = 0
+        self.dispatch_wait = LatencyWindow()
+        self.completion = LatencyWindow()
+
+
+class FairScheduler:
+    """
+    Per-client sub-queues drained into the task queue by deficit round robin
+
+    Uploads wait in their client's sub-queue in the API instead of going
+    straight to the broker. The dispatcher keeps only about target_depth
+    jobs in the task queue and picks what goes next by DRR: each client
+    with waiting work earns quantum * weight bytes of credit per round and
+    sends units (one upload or one batch) while its credit covers their
+    size. A client with 10000 queued images then gets its share of the
+    workers, not all of them, and a newcomer's job waits behind at most
+    target_depth jobs rather than the whole backlog.
+
+    Quotas are checked before a request does any work: at most max_queued
+    waiting jobs per client, and optionally `rate` jobs/s with `burst`
+    (token bucket). With dispatching off, uploads are published directly
+    and record_published() counts them against max_queued until
+    record_ended() sees them finish. Jobs held here are lost if the API
+    restarts before dispatching them; target_depth bounds what is held in
+    the broker.
+    """
+
+    def __init__(self, publish, on_dispatch=None, target_depth=32, quantum=1024 * 1024, max_queued=1000,
+                 rate=0.0, burst=50, weights=None, idle_ttl=3600):
+        # publish(units) is blocking and runs in a thread; on_dispatch(units,
+        # result) runs on the event loop with what publish returned once they
+        # are published. Units are opaque here
+        self.publish = publish
+        self.on_dispatch = on_dispatch
+        self.target_depth = target_depth
+        self.quantum = quantum
+        self.max_queued = max_queued
+        self.rate = rate
+        self.burst = burst
+        self.weights = weights or {}
+        self.idle_ttl = idle_ttl
+
+        self.clients = {}
+        self.active = deque()  # clients with waiting units, in round-robin order
+        self.in_turn = None  # client whose round was cut short by a full task queue
+        self.queued_jobs = 0
+        self.outstanding = {}  # job_id -> client, for jobs published directly
+        self.wakeup = None
+        self.pruned_at = time.monotonic()
+
+        self.dispatched = 0
+        self.publish_errors = 0
+
+    def _client(self, client):
+        queue = self.clients.get(client)
+        if queue is None:
+            queue = self.clients[client] = ClientQueue(client, self.weights.get(client, 1.0), self.burst)
+        queue.last_active = time.monotonic()
+        return queue
+
+    def check(self, client, jobs=1, drain_rate=None):
+        """
+        Decide whether `client` may submit `jobs` more jobs
+
+        Returns (admitted, retry_after_seconds, reason). Tokens are taken
+        only when the request is admitted.
+        """
+        # Every address that calls gets an entry, so forget idle ones here
+        # too: the dispatch loop only runs with fair scheduling on
+        if time.monotonic() - self.pruned_at > 60:
+            self.prune()
+        queue = self._client(client)
+        waiting = queue.jobs + queue.outstanding
+
+        if waiting + jobs > self.max_queued:
+            queue.rejected += jobs
+            # Time for this client's share of the drain to make room
+            share = (drain_rate or 1.0) / max(1, len(self.active))
+            excess = waiting + jobs - self.max_queued
+            retry_after = min(max(math.ceil(excess / max(share, 0.01)), 1), 300)
+            return False, retry_after, f"{waiting} jobs already waiting (quota {self.max_queued})"
+
+        if self.rate > 0:
+            now = time.monotonic()
+            queue.tokens = min(self.burst, queue.tokens + (now - queue.refilled_at) * self.rate)
+            queue.refilled_at = now
+            if queue.tokens < jobs:
+                queue.rejected += jobs
+                retry_after = max(1, math.ceil((jobs - queue.tokens) / self.rate))
+                return False, retry_after, f"rate quota of {self.rate:g} jobs/s exceeded"
+            queue.tokens -= jobs
+
+        return True, None, None
+
+    def submit(self, client, unit, jobs, cost):
+        """Queue a unit (one upload or batch) of `jobs` jobs and `cost` bytes for dispatch"""
+        queue = self._client(client)
+        if not queue.units:
+            self.active.append(client)
+        queue.units.append((unit, jobs, max(1, cost), time.monotonic()))
+        queue.jobs += jobs
+        queue.submitted += jobs
+        self.queued_jobs += jobs
+        if self.wakeup:
+            self.wakeup.set()
+
+    def record_published(self, client, job_ids):
+        """Count jobs published straight to the broker against the client's quota"""
+        queue = self._client(client)
+        for job_id in job_ids:
+            self.outstanding[job_id] = client
+        queue.outstanding += len(job_ids)
+        queue.submitted += len(job_ids)
+
+    def record_ended(self, job_id):
+        """A job reached a terminal status; returns it to its client's quota if it was counted"""
+        queue = self.clients.get(self.outstanding.pop(job_id, None))
+        if queue is not None:
+            queue.outstanding -= 1
+
+    def next_units(self, room):
+        """Pick units worth about `room` jobs by DRR; returns [(client, unit, jobs, cost, submitted_at)]"""
+        picked = []
+        count = 0
+
+        while self.active and count < room:
+            client = self.active[0]
+            queue = self.clients[client]
+            if self.in_turn != client:
+                # A new turn: earn this round's credit
+                queue.deficit += self.quantum * queue.weight
+                self.in_turn = client
+
+            while queue.units and queue.units[0][2] <= queue.deficit and count < room:
+                unit, jobs, cost, submitted_at = queue.units.popleft()
+                queue.deficit -= cost
+                queue.jobs -= jobs
+                self.queued_jobs -= jobs
+                picked.append((client, unit, jobs, cost, submitted_at))
+                count += jobs
+
+            if not queue.units:
+                # No credit is kept while idle, as DRR prescribes
+                queue.deficit = 0.0
+                self.active.popleft()
+                self.in_turn = None
+            elif count < room:
+                # Credit used up: next client
+                self.active.rotate(-1)
+                self.in_turn = None
+            # else: the task queue is full; this client's turn resumes next time
+
+        return picked
+
+    def requeue(self, picked):
+        """Put units back at the front of their sub-queues after a failed publish"""
+        for client, unit, jobs, cost, submitted_at in reversed(picked):
+            queue = self._client(client)
+            if not queue.units and client not in self.active:
+                self.active.appendleft(client)
+            queue.units.appendleft((unit, jobs, cost, submitted_at))
+            queue.deficit += cost
+            queue.jobs += jobs
+            self.queued_jobs += jobs
+        self.in_turn = None
+
+    def withdraw(self, client, take):
+        """
+        Remove waiting jobs from a client's sub-queue, e.g. cancelled ones
+
+        take(unit) removes what it wants from a unit and returns how many
+        jobs that was; a partly emptied unit keeps its place and a share of
+        its cost. Returns the number of jobs withdrawn.
+        """
+        queue = self.clients.get(client)
+        if queue is None:
+            return 0
+
+        withdrawn = 0
+        kept = deque()
+        for unit, jobs, cost, submitted_at in queue.units:
+            taken = take(unit)
+            if taken:
+                withdrawn += taken
+                if taken >= jobs:
+                    continue
+                cost = max(1, cost * (jobs - taken) // jobs)
+                jobs -= taken
+            kept.append((unit, jobs, cost, submitted_at))
+
+        queue.units = kept
+        queue.jobs -= withdrawn
+        queue.withdrawn += withdrawn
+        self.queued_jobs -= withdrawn
+        if not kept and client in self.active:
+            self.active.remove(client)
+            queue.deficit = 0.0
+            if self.in_turn == client:
+                self.in_turn = None
+        return withdrawn
+
+    def record_completion(self, client, seconds):
+        """Submit -> completed/failed latency of one of the client's jobs"""
+        queue = self.clients.get(client)
+        if queue is not None:
+            queue.completion.record(seconds)
+
+    def prune(self):
+        """Forget clients with nothing waiting that have been idle for idle_ttl"""
+        self.pruned_at = time.monotonic()
+        cutoff = self.pruned_at - self.idle_ttl
+        for client in [c for c, q in self.clients.items()
+                       if not q.units and not q.outstanding and q.last_active < cutoff]:
+            del self.clients[client]
+
+    async def run(self, task_queue_depth, interval=0.05):
+        """
+        Dispatch loop; task_queue_depth() estimates the jobs in the task queue
+
+        Publishing runs in a thread; on failure the units go back to their
+        sub-queues with their credit and are retried a second later.
+        """
+        loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+
+        while True:
+            room = self.target_depth - math.ceil(task_queue_depth())
+            picked = self.next_units(room) if room > 0 else []
+
+            if not picked:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), interval if self.active else 1.0)
+                except asyncio.TimeoutError:
+                    pass
+                if time.monotonic() - self.pruned_at > 60:
+                    self.prune()
+                continue
+
+            units = [unit for _, unit, _, _, _ in picked]
+            try:
+                result = await loop.run_in_executor(None, self.publish, units)
+            except Exception as e:
+                print(f"Fair scheduler: publish failed, retrying: {e}")
+                self.publish_errors += 1
+                self.requeue(picked)
+                await asyncio.sleep(1.0)
+                continue
+
+            now = time.monotonic()
+            for client, _, jobs, _, submitted_at in picked:
+                queue = self.clients.get(client)
+                if queue is not None:
+                    queue.dispatched += jobs
+                    queue.dispatch_wait.record(now - submitted_at)
+                self.dispatched += jobs
+            if self.on_dispatch:
+                self.on_dispatch(units, result)
+
+    def stats(self):
+        return {
+            "target_depth": self.target_depth,
+            "quantum_bytes": self.quantum,
+            "max_queued_per_client": self.max_queued,
+            "rate_per_client": self.rate or None,
+            "queued_jobs": self.queued_jobs,
+            "outstanding_jobs": len(self.outstanding),
+            "dispatched": self.dispatched,
+            "publish_errors": self.publish_errors,
+            "clients": {
+                client: {
+                    "weight": queue.weight,
+                    "queued_jobs": queue.jobs,
+                    "queued_units": len(queue.units),
+                    "outstanding_jobs": queue.outstanding,
+                    "submitted": queue.submitted,
+                    "dispatched": queue.dispatched,
+                    "rejected": queue.rejected,
+                    "withdrawn": queue.withdrawn,
+                    "deficit_bytes": queue.deficit,
+                    "dispatch_wait": queue.dispatch_wait.summary(),
+                    "completion_latency": queue.completion.summary()
+                }
+                for client, queue in self.clients.items()
+            }
+        }
@@ -1,23 +1,63 @@
+import asyncio
+import hashlib
 import json
 import time
 import uuid
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from typing import List, Optional
 from io import BytesIO
 
 import pika
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header, Query, Request
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 from minio import Minio
 from minio.error import S3Error
+from pydantic import BaseModel
 
+import envelope
+from admission import AdmissionController
+from batching import EnvelopePublisher
 from config import settings
+from events import JobEventHub, TERMINAL_STATUSES
+from fairness import CLIENT_ID_PATTERN, FairScheduler, parse_weights
+from sharding import HashRing, task_queue_names
+from tombstones import tombstone_key
 
 app = FastAPI(title="Image Processing API")
 
 # Job status storage (in production, use Redis or database)
 job_storage = {}
 
+# Direct uploads waiting for their finalize call, oldest first
+pending_uploads = OrderedDict()
+
+# DELETE /jobs/{job_id} outcomes; "skipped" counts workers' cancelled events by stage
+cancellation_stats = {"requested": 0, "withdrawn": 0, "tombstoned": 0, "skipped": {}}
+
+# Jobs submitted with a deadline, and the expired ones dropped before dispatch
+# or (by stage) in workers
+deadline_stats = {"with_deadline": 0, "expired_before_dispatch": 0, "skipped": {}}
+
+PRIORITIES = ["low", "normal", "high"]
+VALID_OPERATIONS = ["resize", "watermark", "filter"]
+
+# Task queue shards and the ring that routes jobs onto them
+task_queues = task_queue_names(settings.task_queue, settings.task_queue_shards)
+shard_ring = HashRing(len(task_queues))
+
+admission = AdmissionController(
+    limits={
+        "low": settings.admission_max_drain_low,
+        "normal": settings.admission_max_drain_normal,
+        "high": settings.admission_max_drain_high
+    },
+    refresh_interval=settings.admission_refresh_interval,
+    initial_drain_rate=settings.admission_initial_drain_rate,
+    # Jobs waiting in the fair scheduler are backlog the broker does not see
+    held_backlog=lambda: fair_scheduler.queued_jobs
+)
+
 # RabbitMQ connection
 def get_rabbitmq_connection():
     credentials = pika.PlainCredentials(settings.rabbitmq_user, settings.rabbitmq_pass)
@@ -30,6 +70,56 @@ def get_rabbitmq_connection():
     )
     return pika.BlockingConnection(parameters)
 
+# Long-lived connection for depth polling, so admission checks stay cheap
+_depth_connection = None
+
+
+def get_task_queue_depth():
+    """Current depth of all task queue shards over a reused connection"""
+    global _depth_connection
+    try:
+        if _depth_connection is None or _depth_connection.is_closed:
+            _depth_connection = get_rabbitmq_connection()
+        channel = _depth_connection.channel()
+        depth = sum(channel.queue_declare(queue=name, passive=True).method.message_count
+                    for name in task_queues)
+        channel.close()
+        return depth
+    except Exception:
+        _depth_connection = None
+        raise
+
+def record_job_event(event: dict):
+    """Keep job_storage current from the job events stream"""
+    if event.get("status") in TERMINAL_STATUSES:
+        fair_scheduler.record_ended(event.get("job_id"))
+    job = job_storage.get(event.get("job_id"))
+    if job is None:
+        return
+    if event.get("status") in TERMINAL_STATUSES:
+        dispatched_jobs.discard(event["job_id"])
+        # Events of jobs that ended in the API (ended_event(), no worker_id)
+        # may arrive before or after the drop; it was counted there
+        if job["status"] not in TERMINAL_STATUSES and event.get("worker_id") is not None:
+            if event["status"] in ("cancelled", "expired"):
+                skipped = (cancellation_stats if event["status"] == "cancelled" else deadline_stats)["skipped"]
+                skipped[event.get("stage")] = skipped.get(event.get("stage"), 0) + 1
+            elif "submitted_at" in job:
+                fair_scheduler.record_completion(job["client_id"], time.time() - job["submitted_at"])
+    job["status"] = event.get("status", job["status"])
+    job["updated_at"] = datetime.now().isoformat()
+    if event.get("processed_file"):
+        job["processed_file"] = event["processed_file"]
+    job["result"] = event
+
+
+# The lambda looks get_rabbitmq_connection up on every (re)connect
+event_hub = JobEventHub(
+    lambda: get_rabbitmq_connection(),
+    settings.job_events_exchange,
+    on_event=record_job_event
+)
+
 # MinIO client
 minio_client = Minio(
     settings.minio_endpoint,
@@ -38,6 +128,297 @@ minio_client = Minio(
     secure=settings.minio_secure
 )
 
+# Signs direct-upload URLs for the public endpoint; with the region fixed
+# presigning is computed locally and never contacts MinIO
+presign_client = Minio(
+    settings.minio_public_endpoint,
+    access_key=settings.minio_access_key,
+    secret_key=settings.minio_secret_key,
+    secure=settings.minio_public_secure,
+    region=settings.minio_region
+)
+
+
+class DirectUploadRequest(BaseModel):
+    filename: str
+    content_type: str = "image/jpeg"
+    operations: str = "resize"
+    priority: str = "normal"
+    deadline_seconds: Optional[float] = None
+
+
+def parse_operations(operations: str) -> list:
+    """Comma-separated operations -> list of valid ones (400 if none)"""
+    ops_list = [op.strip() for op in operations.split(",")]
+    ops_list = [op for op in ops_list if op in VALID_OPERATIONS]
+    
+    if not ops_list:
+        raise HTTPException(status_code=400, detail=f"Invalid operations. Valid: {VALID_OPERATIONS}")
+    return ops_list
+
+
+def job_deadline(deadline_seconds: Optional[float]) -> Optional[float]:
+    """Absolute deadline (epoch seconds) of a job submitted now, None for none"""
+    if deadline_seconds is None:
+        deadline_seconds = settings.default_deadline_seconds
+        if not deadline_seconds:
+            return None
+    elif deadline_seconds <= 0:
+        raise HTTPException(status_code=400, detail="deadline_seconds must be positive")
+    deadline_stats["with_deadline"] += 1
+    return time.time() + deadline_seconds
+
+
+def past_deadline(job_message: dict, now: float) -> bool:
+    return bool(job_message.get("deadline")) and job_message["deadline"] <= now
+
+
+def client_identity(request: Request, client_id: Optional[str]) -> str:
+    """X-Client-ID header, else the caller's address"""
+    if client_id is None:
+        return request.client.host if request.client else "unknown"
+    if not CLIENT_ID_PATTERN.match(client_id):
+        raise HTTPException(status_code=400, detail="Invalid X-Client-ID (1-64 of A-Z a-z 0-9 . _ : @ -)")
+    return client_id
+
+
+def check_client_quota(client: str, jobs: int = 1):
+    """Raise 429 with Retry-After when the client is over its waiting-jobs or rate quota"""
+    admitted, retry_after, reason = fair_scheduler.check(client, jobs, admission.drain_rate)
+    if not admitted:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Client quota exceeded for {client}: {reason}",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+
+def check_admission(priority: str):
+    """Raise 429 with Retry-After when the backlog is too deep for this priority"""
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Invalid priority. Valid: {PRIORITIES}")
+    
+    if settings.admission_enabled:
+        admitted, retry_after, drain_time = admission.check(priority)
+        if not admitted:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Task queue backlog too deep (estimated drain time {drain_time:.0f}s)",
+                headers={"Retry-After": str(retry_after)}
+            )
+
+
+def task_queue_for(job_message: dict) -> str:
+    """Shard of a job: its content digest or job ID on the hash ring"""
+    key = job_message["job_id"]
+    if settings.shard_key == "digest":
+        key = job_message.get("content_digest") or key
+    return task_queues[shard_ring.lookup(key)]
+
+
+def publish_job(job_message: dict):
+    """Publish a job to its task queue shard"""
+    connection = get_rabbitmq_connection()
+    channel = connection.channel()
+    publish_task(channel, job_message)
+    connection.close()
+
+
+def publish_task(channel, job_message: dict):
+    channel.basic_publish(
+        exchange='',
+        routing_key=task_queue_for(job_message),
+        body=json.dumps(job_message),
+        properties=pika.BasicProperties(
+            delivery_mode=2,  # Persistent
+            content_type='application/json'
+        )
+    )
+    admission.record_published()
+
+
+def ended_event(job_id: str, status: str, stage: str) -> dict:
+    """Job event for a job that ends in the API, before any worker saw it"""
+    return {
+        "job_id": job_id,
+        "status": status,
+        "stage": stage,
+        "worker_id": None,
+        "timestamp": datetime.now().isoformat(),
+        "completed_at": time.time()
+    }
+
+
+def publish_ended_events(events: list, channel=None):
+    """
+    Publish events of jobs that ended in the API to the job events exchange,
+    so observers (GET /events, notifications, load tests) hear of them as
+    they would from a worker. Best effort: the job status is already set.
+    """
+    connection = None
+    try:
+        if channel is None:
+            connection = get_rabbitmq_connection()
+            channel = connection.channel()
+        for event in events:
+            channel.basic_publish(
+                exchange=settings.job_events_exchange,
+                routing_key='',
+                body=json.dumps(event),
+                properties=pika.BasicProperties(delivery_mode=2, content_type='application/json')
+            )
+    except Exception as e:
+        print(f"Could not publish {len(events)} job events: {e}")
+    finally:
+        if connection is not None and connection.is_open:
+            connection.close()
+
+
+def publish_envelopes(jobs: list, channel=None):
+    """Publish jobs as envelopes of at most envelope_max_jobs per shard (blocking)"""
+    if channel is None:
+        connection = get_rabbitmq_connection()
+        try:
+            publish_envelopes(jobs, connection.channel())
+        finally:
+            connection.close()
+        return
+    
+    by_queue = {}
+    for job in jobs:
+        by_queue.setdefault(task_queue_for(job), []).append(job)
+    
+    size = settings.envelope_max_jobs
+    for queue, queue_jobs in by_queue.items():
+        for start in range(0, len(queue_jobs), size):
+            publish_envelope(channel, queue, queue_jobs[start:start + size])
+
+
+def publish_envelope(channel, queue: str, jobs: list):
+    channel.basic_publish(
+        exchange='',
+        routing_key=queue,
+        body=envelope.encode(jobs),
+        properties=pika.BasicProperties(
+            delivery_mode=2,  # Persistent
+            content_type=envelope.CONTENT_TYPE,
+            headers={"x-envelope-version": envelope.VERSION, "x-jobs": len(jobs)}
+        )
+    )
+    # Admission control compares queue depth in messages
+    admission.record_published()
+
+
+envelope_publisher = EnvelopePublisher(
+    publish_envelopes,
+    linger=settings.envelope_linger_ms / 1000,
+    max_jobs=settings.envelope_max_jobs
+)
+
+
+def dispatch_units(units: list) -> list:
+    """
+    Publish what the fair scheduler picked over one connection (blocking)
+    
+    Units are {"jobs": [...], "envelope": bool}: single uploads go out as
+    single-job messages, and the jobs of batch uploads dispatched together
+    share envelopes. Jobs past their deadline are not published; they are
+    returned instead.
+    """
+    now = time.time()
+    expired = [job for unit in units for job in unit["jobs"] if past_deadline(job, now)]
+    
+    connection = get_rabbitmq_connection()
+    try:
+        channel = connection.channel()
+        for unit in units:
+            if not unit["envelope"] and not past_deadline(unit["jobs"][0], now):
+                publish_task(channel, unit["jobs"][0])
+        batched = [job for unit in units if unit["envelope"] for job in unit["jobs"]
+                   if not past_deadline(job, now)]
+        if batched:
+            publish_envelopes(batched, channel)
+        if expired:
+            publish_ended_events([ended_event(job["job_id"], "expired", "before_dispatch") for job in expired],
+                                 channel)
+    finally:
+        connection.close()
+    return expired
+
+
+def mark_dispatched(units: list, expired: list):
+    expired_ids = {job_message["job_id"] for job_message in expired}
+    for unit in units:
+        for job_message in unit["jobs"]:
+            job = job_storage.get(job_message["job_id"])
+            if job_message["job_id"] in expired_ids:
+                # Its client has stopped waiting: no worker time for it
+                deadline_stats["expired_before_dispatch"] += 1
+                if job is not None and job["status"] == "scheduled":
+                    job["status"] = "expired"
+                    job["updated_at"] = datetime.now().isoformat()
+                continue
+            dispatched_jobs.add(job_message["job_id"])
+            if job is not None and job["status"] == "scheduled":
+                job["status"] = "queued"
+
+
+# Dispatched jobs without a completed/failed event yet (queued or being processed)
+dispatched_jobs = set()
+
+
+def dispatch_depth() -> float:
+    """
+    Jobs the dispatcher counts against fair_dispatch_depth
+    
+    Depth samples are up to admission_refresh_interval old; completion
+    events tell within milliseconds that a job left the pipeline, so the
+    lower of the two keeps workers fed without waiting for the next sample.
+    """
+    estimate = admission.estimated_depth()
+    if settings.job_events_enabled:
+        return min(estimate, len(dispatched_jobs))
+    return estimate
+
+
+fair_scheduler = FairScheduler(
+    dispatch_units,
+    on_dispatch=mark_dispatched,
+    target_depth=settings.fair_dispatch_depth,
+    quantum=settings.fair_quantum_bytes,
+    max_queued=settings.client_max_queued,
+    rate=settings.client_rate,
+    burst=settings.client_burst,
+    weights=parse_weights(settings.client_weights)
+)
+
+
+async def enqueue_jobs(client: str, jobs: list, cost: int, as_envelope: bool = False) -> str:
+    """
+    Hand jobs to the fair scheduler ("scheduled"), or publish them right
+    away when fair scheduling is off ("queued")
+    
+    Published jobs count against the client's CLIENT_MAX_QUEUED until their
+    terminal event; they are counted first, as the event may beat the return.
+    """
+    if settings.fair_scheduling:
+        fair_scheduler.submit(client, {"jobs": jobs, "envelope": as_envelope}, len(jobs), cost)
+        return "scheduled"
+    
+    job_ids = [job["job_id"] for job in jobs]
+    if settings.job_events_enabled:
+        fair_scheduler.record_published(client, job_ids)
+    try:
+        if as_envelope:
+            await envelope_publisher.submit(jobs)
+        else:
+            publish_job(jobs[0])
+    except Exception:
+        for job_id in job_ids:
+            fair_scheduler.record_ended(job_id)
+        raise
+    return "queued"
+
 
 @app.on_event("startup")
 async def startup_event():
@@ -48,6 +429,8 @@ async def startup_event():
             minio_client.make_bucket(settings.upload_bucket)
         if not minio_client.bucket_exists(settings.processed_bucket):
             minio_client.make_bucket(settings.processed_bucket)
+        if not minio_client.bucket_exists(settings.control_bucket):
+            minio_client.make_bucket(settings.control_bucket)
     except S3Error as e:
         print(f"MinIO error: {e}")
     
@@ -56,21 +439,48 @@ async def startup_event():
         connection = get_rabbitmq_connection()
         channel = connection.channel()
         
-        # Declare main queue with DLQ
+        # Declare every task queue shard with the shared DLQ
         channel.queue_declare(queue=settings.dlq_queue, durable=True)
-        channel.queue_declare(
-            queue=settings.task_queue,
-            durable=True,
-            arguments={
-                'x-dead-letter-exchange': '',
-                'x-dead-letter-routing-key': settings.dlq_queue
-            }
-        )
+        for name in task_queues:
+            channel.queue_declare(
+                queue=name,
+                durable=True,
+                arguments={
+                    'x-dead-letter-exchange': '',
+                    'x-dead-letter-routing-key': settings.dlq_queue
+                }
+            )
         channel.queue_declare(queue=settings.notification_queue, durable=True)
+        channel.exchange_declare(
+            exchange=settings.job_events_exchange,
+            exchange_type='fanout',
+            durable=True
+        )
+        channel.queue_bind(
+            queue=settings.notification_queue,
+            exchange=settings.job_events_exchange
+        )
         
         connection.close()
     except Exception as e:
         print(f"RabbitMQ error: {e}")
+    
+    # The fair scheduler dispatches against the same depth samples
+    if settings.admission_enabled or settings.fair_scheduling:
+        asyncio.create_task(admission.run(get_task_queue_depth))
+    
+    if settings.fair_scheduling:
+        asyncio.create_task(fair_scheduler.run(dispatch_depth))
+    
+    if settings.job_events_enabled:
+        event_hub.start(asyncio.get_running_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    event_hub.stop()
+    if fair_scheduler.queued_jobs:
+        print(f"Fair scheduler: {fair_scheduler.queued_jobs} jobs were not dispatched")
 
 
 @app.get("/")
@@ -80,7 +490,13 @@ async def root():
         "version": "1.0",
         "endpoints": {
             "upload": "/upload",
+            "upload_batch": "/upload/batch",
+            "upload_initiate": "/uploads/initiate",
+            "upload_finalize": "/uploads/{job_id}/finalize",
             "status": "/status/{job_id}",
+            "cancel": "DELETE /jobs/{job_id}",
+            "result": "/result/{job_id}",
+            "events": "/events?job_ids={job_id},...",
             "metrics": "/metrics",
             "dlq": "/dlq/stats"
         }
@@ -89,29 +505,39 @@ async def root():
 
 @app.post("/upload")
 async def upload_image(
+    request: Request,
     file: UploadFile = File(...),
-    operations: str = Form(default="resize")
+    operations: str = Form(default="resize"),
+    priority: str = Form(default="normal"),
+    deadline_seconds: Optional[float] = Form(default=None),
+    x_client_id: Optional[str] = Header(default=None)
 ):
     """
     Upload an image and queue it for processing
     
     operations: comma-separated list (resize, watermark, filter)
+    priority: low, normal or high; selects the admission control limit
+    deadline_seconds: drop the job ("expired") if it has not started
+    processing this many seconds from now
+    X-Client-ID: the client's identity for quotas and fair scheduling
+    (default: the caller's address)
     """
     # Validate file
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
     
+    # Reject before reading the body or touching storage
+    client = client_identity(request, x_client_id)
+    check_admission(priority)
+    check_client_quota(client)
+    
     # Generate job ID
     job_id = str(uuid.uuid4())
     timestamp = datetime.now().isoformat()
     
     # Parse operations
-    ops_list = [op.strip() for op in operations.split(",")]
-    valid_ops = ["resize", "watermark", "filter"]
-    ops_list = [op for op in ops_list if op in valid_ops]
-    
-    if not ops_list:
-        raise HTTPException(status_code=400, detail=f"Invalid operations. Valid: {valid_ops}")
+    ops_list = parse_operations(operations)
+    deadline = job_deadline(deadline_seconds)
     
     try:
         # Upload to MinIO
@@ -133,36 +559,34 @@ async def upload_image(
             "original_name": file.filename,
             "operations": ops_list,
             "timestamp": timestamp,
-            "bucket": settings.upload_bucket
+            "enqueued_at": time.time(),
+            "bucket": settings.upload_bucket,
+            "priority": priority,
+            "client_id": client
         }
+        if deadline:
+            job_message["deadline"] = deadline
+        if settings.shard_key == "digest":
+            job_message["content_digest"] = hashlib.sha256(file_content).hexdigest()
         
-        # Publish to RabbitMQ
-        connection = get_rabbitmq_connection()
-        channel = connection.channel()
-        
-        channel.basic_publish(
-            exchange='',
-            routing_key=settings.task_queue,
-            body=json.dumps(job_message),
-            properties=pika.BasicProperties(
-                delivery_mode=2,  # Persistent
-                content_type='application/json'
-            )
-        )
-        
-        connection.close()
+        # Publish to RabbitMQ (through the client's sub-queue)
+        status = await enqueue_jobs(client, [job_message], len(file_content))
         
         # Store job status
         job_storage[job_id] = {
-            "status": "queued",
+            "status": status,
+            "priority": priority,
             "operations": ops_list,
             "timestamp": timestamp,
-            "file_name": file_name
+            "file_name": file_name,
+            "client_id": client,
+            "deadline": deadline,
+            "submitted_at": time.time()
         }
         
         return {
             "job_id": job_id,
-            "status": "queued",
+            "status": status,
             "operations": ops_list,
             "message": "Image uploaded and queued for processing"
         }
@@ -173,6 +597,229 @@ async def upload_image(
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
+@app.post("/upload/batch")
+async def upload_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    operations: str = Form(default="resize"),
+    priority: str = Form(default="normal"),
+    deadline_seconds: Optional[float] = Form(default=None),
+    x_client_id: Optional[str] = Header(default=None)
+):
+    """
+    Upload several images with the same operations and queue them together
+    
+    The jobs travel as envelopes (several jobs per message); concurrent
+    batch requests arriving within ENVELOPE_LINGER_MS share envelopes.
+    """
+    if len(files) > settings.batch_max_files:
+        raise HTTPException(status_code=400, detail=f"At most {settings.batch_max_files} files per batch")
+    if not all(file.content_type.startswith("image/") for file in files):
+        raise HTTPException(status_code=400, detail="All files must be images")
+    
+    client = client_identity(request, x_client_id)
+    check_admission(priority)
+    check_client_quota(client, len(files))
+    ops_list = parse_operations(operations)
+    deadline = job_deadline(deadline_seconds)
+    timestamp = datetime.now().isoformat()
+    
+    job_messages = []
+    total_bytes = 0
+    try:
+        for file in files:
+            job_id = str(uuid.uuid4())
+            file_content = await file.read()
+            file_name = f"{job_id}_{file.filename}"
+            total_bytes += len(file_content)
+            
+            minio_client.put_object(
+                settings.upload_bucket,
+                file_name,
+                BytesIO(file_content),
+                length=len(file_content),
+                content_type=file.content_type
+            )
+            
+            job_message = {
+                "job_id": job_id,
+                "file_name": file_name,
+                "original_name": file.filename,
+                "operations": ops_list,
+                "timestamp": timestamp,
+                "enqueued_at": time.time(),
+                "bucket": settings.upload_bucket,
+                "priority": priority,
+                "client_id": client
+            }
+            if deadline:
+                job_message["deadline"] = deadline
+            if settings.shard_key == "digest":
+                job_message["content_digest"] = hashlib.sha256(file_content).hexdigest()
+            job_messages.append(job_message)
+        
+        status = await enqueue_jobs(client, job_messages, total_bytes, as_envelope=True)
+        
+    except S3Error as e:
+        raise HTTPException(status_code=500, detail=f"Storage error: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    for job in job_messages:
+        job_storage[job["job_id"]] = {
+            "status": status,
+            "priority": priority,
+            "operations": ops_list,
+            "timestamp": timestamp,
+            "file_name": job["file_name"],
+            "client_id": client,
+            "deadline": deadline,
+            "submitted_at": time.time()
+        }
+    
+    return {
+        "jobs": [{"job_id": job["job_id"], "original_name": job["original_name"]} for job in job_messages],
+        "status": status,
+        "operations": ops_list,
+        "message": f"{len(job_messages)} images uploaded and queued for processing"
+    }
+
+
+def expire_pending_uploads():
+    """Forget direct uploads whose URL expired without a finalize call"""
+    now = time.time()
+    while pending_uploads:
+        job_id, upload = next(iter(pending_uploads.items()))
+        if upload["expires_at"] > now:
+            break
+        pending_uploads.popitem(last=False)
+        job_storage.pop(job_id, None)
+
+
+@app.post("/uploads/initiate")
+async def initiate_upload(
+    request: DirectUploadRequest,
+    http_request: Request,
+    x_client_id: Optional[str] = Header(default=None)
+):
+    """
+    Start a direct upload: the client PUTs the image to the returned URL
+    (straight into MinIO) and then calls finalize_url to queue the job.
+    The API only handles these two small control requests.
+    """
+    if not request.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    
+    client = client_identity(http_request, x_client_id)
+    check_admission(request.priority)
+    check_client_quota(client)
+    ops_list = parse_operations(request.operations)
+    # Counted from now: the client's wait starts with this request
+    deadline = job_deadline(request.deadline_seconds)
+    expire_pending_uploads()
+    
+    job_id = str(uuid.uuid4())
+    timestamp = datetime.now().isoformat()
+    file_name = f"{job_id}_{request.filename}"
+    expiry = settings.direct_upload_expiry
+    
+    try:
+        upload_url = presign_client.presigned_put_object(
+            settings.upload_bucket, file_name, expires=timedelta(seconds=expiry)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    pending_uploads[job_id] = {
+        "file_name": file_name,
+        "original_name": request.filename,
+        "operations": ops_list,
+        "priority": request.priority,
+        "client_id": client,
+        "deadline": deadline,
+        "timestamp": timestamp,
+        "expires_at": time.time() + expiry
+    }
+    job_storage[job_id] = {
+        "status": "awaiting_upload",
+        "priority": request.priority,
+        "operations": ops_list,
+        "timestamp": timestamp,
+        "file_name": file_name,
+        "client_id": client,
+        "deadline": deadline
+    }
+    
+    return {
+        "job_id": job_id,
+        "status": "awaiting_upload",
+        "upload_url": upload_url,
+        "method": "PUT",
+        "headers": {"Content-Type": request.content_type},
+        "expires_in": expiry,
+        "finalize_url": f"/uploads/{job_id}/finalize"
+    }
+
+
+@app.post("/uploads/{job_id}/finalize")
+async def finalize_upload(job_id: str):
+    """Queue a direct upload once its object exists; repeated calls are harmless"""
+    upload = pending_uploads.get(job_id)
+    if upload is None:
+        job = job_storage.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Upload not found or expired")
+        # Already finalized, e.g. a client retry
+        return {"job_id": job_id, "status": job["status"], "operations": job["operations"]}
+    
+    try:
+        stat = minio_client.stat_object(settings.upload_bucket, upload["file_name"])
+    except S3Error as e:
+        if e.code in ("NoSuchKey", "NoSuchObject"):
+            raise HTTPException(status_code=409, detail="Object has not been uploaded yet")
+        raise HTTPException(status_code=500, detail=f"Storage error: {str(e)}")
+    
+    if stat.size > settings.direct_upload_max_bytes:
+        pending_uploads.pop(job_id, None)
+        job_storage.pop(job_id, None)
+        minio_client.remove_object(settings.upload_bucket, upload["file_name"])
+        raise HTTPException(status_code=413,
+                            detail=f"Image exceeds {settings.direct_upload_max_bytes} bytes")
+    
+    job_message = {
+        "job_id": job_id,
+        "file_name": upload["file_name"],
+        "original_name": upload["original_name"],
+        "operations": upload["operations"],
+        "timestamp": upload["timestamp"],
+        "enqueued_at": time.time(),
+        "bucket": settings.upload_bucket,
+        "priority": upload["priority"],
+        "client_id": upload["client_id"]
+    }
+    if upload["deadline"]:
+        job_message["deadline"] = upload["deadline"]
+    if settings.shard_key == "digest":
+        # The object was never in the API's hands; MinIO's ETag is its content hash
+        job_message["content_digest"] = stat.etag.strip('"')
+    
+    try:
+        status = await enqueue_jobs(upload["client_id"], [job_message], stat.size)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    pending_uploads.pop(job_id, None)
+    job_storage[job_id]["status"] = status
+    job_storage[job_id]["submitted_at"] = time.time()
+    
+    return {
+        "job_id": job_id,
+        "status": status,
+        "operations": upload["operations"],
+        "message": "Image uploaded and queued for processing"
+    }
+
+
 @app.get("/status/{job_id}")
 async def get_job_status(job_id: str):
     """Get the status of a processing job"""
@@ -182,6 +829,204 @@ async def get_job_status(job_id: str):
     return job_storage[job_id]
 
 
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Cancel a job that has not finished
+    
+    Jobs still in the API (awaiting their direct upload, or waiting in
+    their client's sub-queue) are dropped here and are "cancelled" at once.
+    For jobs already in the task queue a tombstone is written to the
+    control bucket: workers skip and ack the job before downloading it, or
+    before uploading the result if it was already being processed, and
+    report it with a "cancelled" event. Until then the job is "cancelling"
+    (202); a job that completes first stays completed.
+    """
+    job = job_storage.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] in ("cancelled", "cancelling"):
+        return JSONResponse(status_code=200 if job["status"] == "cancelled" else 202,
+                            content={"job_id": job_id, "status": job["status"]})
+    if job["status"] in TERMINAL_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job already {job['status']}")
+    
+    cancellation_stats["requested"] += 1
+    
+    def take(unit):
+        before = len(unit["jobs"])
+        unit["jobs"] = [job_message for job_message in unit["jobs"] if job_message["job_id"] != job_id]
+        return before - len(unit["jobs"])
+    
+    if pending_uploads.pop(job_id, None) is not None or (
+            job["status"] == "scheduled" and fair_scheduler.withdraw(job["client_id"], take)):
+        cancellation_stats["withdrawn"] += 1
+        status = "cancelled"
+        publish_ended_events([ended_event(job_id, status, "before_dispatch")])
+    else:
+        # Published, or being published right now
+        try:
+            minio_client.put_object(settings.control_bucket, tombstone_key(job_id), BytesIO(b""), length=0)
+        except S3Error as e:
+            raise HTTPException(status_code=500, detail=f"Storage error: {str(e)}")
+        cancellation_stats["tombstoned"] += 1
+        status = "cancelling"
+    
+    job["status"] = status
+    job["updated_at"] = datetime.now().isoformat()
+    return JSONResponse(status_code=200 if status == "cancelled" else 202,
+                        content={"job_id": job_id, "status": status})
+
+
+def result_object(job_id: str) -> dict:
+    """
+    Processed object of a job: {"object_name", "etag", "size", "content_type"}
+    
+    Outputs are immutable, so the stat is done once and kept with the job;
+    later requests (and every 304) are answered without touching MinIO.
+    """
+    job = job_storage.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if "result_object" not in job:
+        object_name = job.get("processed_file") or f"processed_{job['file_name']}"
+        try:
+            stat = minio_client.stat_object(settings.processed_bucket, object_name)
+        except S3Error as e:
+            if e.code in ("NoSuchKey", "NoSuchObject"):
+                raise HTTPException(status_code=404, detail=f"Result not ready (job is {job['status']})")
+            raise HTTPException(status_code=500, detail=f"Storage error: {str(e)}")
+        
+        # Strong validator: MinIO's ETag is the content hash of the object
+        etag = stat.etag.strip('"')
+        job["result_object"] = {
+            "object_name": object_name,
+            "etag": f'"{etag}"',
+            "size": stat.size,
+            "content_type": stat.content_type or "image/jpeg"
+        }
+    return job["result_object"]
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as RFC 9110 prescribes for If-None-Match
+    return "*" in candidates or etag in [tag.removeprefix("W/") for tag in candidates]
+
+
+def stream_object(response):
+    try:
+        yield from response.stream(64 * 1024)
+    finally:
+        response.close()
+        response.release_conn()
+
+
+@app.get("/result/{job_id}")
+async def get_result(
+    job_id: str,
+    mode: Optional[str] = Query(default=None, pattern="^(redirect|stream)$"),
+    if_none_match: Optional[str] = Header(default=None)
+):
+    """
+    Processed image of a job
+    
+    mode=redirect (default: RESULT_DELIVERY) answers 307 to a short-lived
+    presigned MinIO URL; mode=stream sends the body through the API.
+    Responses carry a strong ETag; If-None-Match answers 304 from memory.
+    """
+    result = result_object(job_id)
+    mode = mode or settings.result_delivery
+    
+    if mode == "redirect":
+        # The redirect is only as reusable as the URL it points to
+        cache_control = f"private, max-age={settings.result_url_expiry // 2}"
+    else:
+        cache_control = f"private, max-age={settings.result_max_age}, immutable"
+    headers = {"ETag": result["etag"], "Cache-Control": cache_control}
+    
+    if etag_matches(if_none_match, result["etag"]):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        if mode == "redirect":
+            url = presign_client.presigned_get_object(
+                settings.processed_bucket, result["object_name"],
+                expires=timedelta(seconds=settings.result_url_expiry)
+            )
+            return RedirectResponse(url, status_code=307, headers=headers)
+        
+        response = minio_client.get_object(settings.processed_bucket, result["object_name"])
+    except S3Error as e:
+        raise HTTPException(status_code=500, detail=f"Storage error: {str(e)}")
+    
+    headers["Content-Length"] = str(result["size"])
+    return StreamingResponse(stream_object(response), media_type=result["content_type"], headers=headers)
+
+
+def sse_message(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.get("/events")
+async def stream_job_events(job_ids: str = Query(..., description="Comma-separated job IDs")):
+    """
+    Server-Sent Events stream of the given jobs' completion events
+    
+    Jobs that already finished are sent right away; the stream ends with
+    an "end" event once every job has completed or failed. Events come
+    from the API's single shared job events consumer, so clients do not
+    poll /status and hear about completions within milliseconds.
+    """
+    ids = list(dict.fromkeys(j.strip() for j in job_ids.split(",") if j.strip()))
+    if not ids:
+        raise HTTPException(status_code=400, detail="No job IDs given")
+    if len(ids) > settings.events_max_jobs:
+        raise HTTPException(status_code=400, detail=f"At most {settings.events_max_jobs} jobs per stream")
+    
+    unknown = [job_id for job_id in ids if job_id not in job_storage]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Jobs not found: {', '.join(unknown[:10])}")
+    
+    if not settings.job_events_enabled:
+        raise HTTPException(status_code=503, detail="Job events are disabled")
+    
+    # Subscribe before looking at the stored status: both happen on the
+    # event loop, so no event can slip in between
+    subscription = event_hub.subscribe(ids)
+    
+    async def stream():
+        try:
+            yield "retry: 2000\n\n"
+            
+            for job_id in ids:
+                job = job_storage[job_id]
+                if job["status"] in TERMINAL_STATUSES:
+                    subscription.pending.discard(job_id)
+                    yield sse_message("job", job.get("result") or {"job_id": job_id, "status": job["status"]})
+            
+            while subscription.pending:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), settings.events_keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                
+                if event.get("status") in TERMINAL_STATUSES:
+                    subscription.pending.discard(event.get("job_id"))
+                yield sse_message("job", event)
+            
+            yield sse_message("end", {"jobs": len(ids), "dropped": subscription.dropped})
+        finally:
+            event_hub.unsubscribe(subscription)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.get("/metrics")
 async def get_metrics():
     """Get queue metrics"""
@@ -190,7 +1035,8 @@ async def get_metrics():
         channel = connection.channel()
         
         # Get queue stats
-        task_queue = channel.queue_declare(queue=settings.task_queue, passive=True)
+        shards = {name: channel.queue_declare(queue=name, passive=True).method.message_count
+                  for name in task_queues}
         notification_queue = channel.queue_declare(queue=settings.notification_queue, passive=True)
         dlq_queue = channel.queue_declare(queue=settings.dlq_queue, passive=True)
         
@@ -207,7 +1053,8 @@ async def get_metrics():
             "queues": {
                 "task_queue": {
                     "name": settings.task_queue,
-                    "messages": task_queue.method.message_count
+                    "messages": sum(shards.values()),
+                    "shards": shards
                 },
                 "notification_queue": {
                     "name": settings.notification_queue,
@@ -221,7 +1068,13 @@ async def get_metrics():
             "jobs": {
                 "total": len(job_storage),
                 "by_status": status_counts
-            }
+            },
+            "admission": admission.stats(),
+            "fair_scheduling": dict(fair_scheduler.stats(), enabled=settings.fair_scheduling),
+            "cancellations": cancellation_stats,
+            "deadlines": deadline_stats,
+            "envelopes": envelope_publisher.stats(),
+            "job_events": event_hub.stats()
         }
         
     except Exception as e:
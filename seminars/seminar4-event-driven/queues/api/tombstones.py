@@ -0,0 +1,182 @@
+"""
+Job cancellation tombstones
+
+DELETE /jobs/{job_id} writes one empty object per cancelled job to the
+control bucket, named cancellations/<time_ns>-<job_id>. Keys sort by the
+time they were written, so a reader lists only what is new since its last
+refresh (start_after) and never has to GET an object: the job ID is in the
+name.
+
+Workers keep the cancelled IDs in a TombstoneSet: 64-bit hashes in a sorted
+array.array, 8 bytes per ID (a million tombstones take 8 MB, a Python set
+of the ID strings about 150 MB). Two different job IDs share a hash with
+probability ~n / 2**64 per lookup, which cancels nothing in practice.
+
+This module is shared by the API and the workers: keep both copies identical.
+"""
+import hashlib
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from minio.error import S3Error
+
+
+CONTROL_BUCKET = "control"
+PREFIX = "cancellations/"
+
+
+def tombstone_key(job_id: str, now_ns: int = None) -> str:
+    """Object name of a job's tombstone; sorts by time of writing"""
+    return f"{PREFIX}{time.time_ns() if now_ns is None else now_ns:019d}-{job_id}"
+
+
+def parse_key(object_name: str) -> tuple:
+    """cancellations/<time_ns>-<job_id> -> (time_ns, job_id)"""
+    written, _, job_id = object_name[len(PREFIX):].partition("-")
+    return int(written), job_id
+
+
+def id_hash(job_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(job_id.encode(), digest_size=8).digest(), "big")
+
+
+class TombstoneSet:
+    """
+    Compact set of job IDs: a sorted array of hashes plus a small set of
+    recent ones, merged into the array once it holds merge_at entries or
+    an eighth of the array, so loading n IDs costs O(n log n), not O(n²)
+
+    Lookups from any thread need no lock: the array and the recent set are
+    only replaced, never edited in place, apart from set.add (atomic).
+    """
+
+    def __init__(self, merge_at: int = 4096):
+        self.merge_at = merge_at
+        self.hashes = array("Q")
+        self.recent = set()
+
+    def __contains__(self, job_id) -> bool:
+        if not job_id:
+            return False
+        value = id_hash(job_id)
+        if value in self.recent:
+            return True
+        hashes = self.hashes
+        i = bisect_left(hashes, value)
+        return i < len(hashes) and hashes[i] == value
+
+    def add(self, job_id: str) -> bool:
+        """Returns False if the ID was already there; only one thread may add"""
+        if job_id in self:
+            return False
+        self.recent.add(id_hash(job_id))
+        if len(self.recent) >= max(self.merge_at, len(self.hashes) // 8):
+            self.merge()
+        return True
+
+    def merge(self):
+        if self.recent:
+            self.hashes = array("Q", heapq.merge(self.hashes, sorted(self.recent)))
+            self.recent = set()
+
+    def __len__(self) -> int:
+        return len(self.hashes) + len(self.recent)
+
+    def memory_bytes(self) -> int:
+        return self.hashes.itemsize * len(self.hashes) + self.recent.__sizeof__()
+
+
+class TombstoneCache:
+    """
+    The control bucket's tombstones, refreshed every `interval` seconds
+
+    Each refresh lists from `lag` seconds before the newest tombstone seen,
+    so tombstones written late (clock skew between API replicas, a slow
+    PUT) are still picked up; the ones listed twice are skipped. Between
+    refreshes, and while MinIO is unreachable, lookups use what was loaded
+    last. The first refresh loads everything, which for millions of
+    tombstones is one list request per thousand.
+    """
+
+    def __init__(self, client, bucket: str = CONTROL_BUCKET, interval: float = 2.0, lag: float = 30.0):
+        # client() returns the MinIO client, looked up on every refresh
+        self.client = client
+        self.bucket = bucket
+        self.interval = interval
+        self.lag_ns = int(lag * 1e9)
+        self.tombstones = TombstoneSet()
+        self.cursor = None
+        self.lock = threading.Lock()
+        self.skip_lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.refreshed_at = None
+        self.last_refresh_ms = None
+        self.skipped = {}  # stage -> jobs skipped because they were cancelled
+
+    def __contains__(self, job_id) -> bool:
+        return job_id in self.tombstones
+
+    def refresh(self) -> int:
+        """List tombstones written since the last refresh; returns how many were new"""
+        with self.lock:
+            started = time.perf_counter()
+            added = 0
+            newest = None
+            try:
+                for obj in self.client().list_objects(self.bucket, prefix=PREFIX, start_after=self.cursor):
+                    written, job_id = parse_key(obj.object_name)
+                    added += self.tombstones.add(job_id)
+                    newest = written if newest is None else max(newest, written)
+            except S3Error as e:
+                # Nothing has been cancelled before the API created the bucket
+                if e.code != "NoSuchBucket":
+                    raise
+            if newest is not None:
+                self.cursor = f"{PREFIX}{max(newest - self.lag_ns, 0):019d}"
+            self.refreshes += 1
+            self.refreshed_at = time.time()
+            self.last_refresh_ms = (time.perf_counter() - started) * 1000
+            return added
+
+    def start(self):
+        """Load the tombstones once, then keep refreshing them in a daemon thread"""
+        if self.thread is not None:
+            return
+        self.refresh()
+        self.thread = threading.Thread(target=self._run, name="tombstones", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                self.refresh_errors += 1
+                print(f"Tombstone refresh failed, using the last {len(self.tombstones)}: {e}")
+
+    def stop(self):
+        self.stopping.set()
+
+    def record_skip(self, stage: str):
+        with self.skip_lock:
+            self.skipped[stage] = self.skipped.get(stage, 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            "tombstones": len(self.tombstones),
+            "memory_kb": self.tombstones.memory_bytes() / 1024,
+            "refresh_interval": self.interval,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "last_refresh_ms": self.last_refresh_ms,
+            "age_seconds": None if self.refreshed_at is None else time.time() - self.refreshed_at,
+            "skipped": dict(self.skipped),
+            "skipped_total": sum(self.skipped.values())
+        }
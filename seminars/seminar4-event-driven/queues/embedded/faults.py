@@ -0,0 +1,56 @@
+"""
+Latency and failure models for the in-memory stand-ins
+"""
+import random
+import threading
+import time
+
+
+class FaultModel:
+    """
+    Injected delay and failures of one remote operation
+
+    Every call sleeps for `latency` seconds plus an exponentially distributed
+    `jitter` (mean, seconds) plus `size / bandwidth` for payload-carrying
+    calls, then fails with probability `failure_rate`.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, bandwidth=None, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth  # bytes per second, None = unlimited
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.delayed = 0.0
+
+    def delay(self, size=0):
+        """Seconds the next call should take"""
+        with self.lock:
+            jitter = self.rng.expovariate(1.0 / self.jitter) if self.jitter > 0 else 0.0
+        transfer = size / self.bandwidth if self.bandwidth else 0.0
+        return self.latency + jitter + transfer
+
+    def apply(self, size=0):
+        """Sleep for the modelled delay; returns True if the call should fail"""
+        delay = self.delay(size)
+        if delay > 0:
+            time.sleep(delay)
+
+        with self.lock:
+            self.calls += 1
+            self.delayed += delay
+            failed = self.failure_rate > 0 and self.rng.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+        return failed
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "injected_delay": self.delayed,
+            }
@@ -0,0 +1,534 @@
+"""
+In-memory stand-in for RabbitMQ
+
+Implements the subset of pika's BlockingConnection / BlockingChannel API the
+services use (declare, bind, publish, consume, ack/nack, qos, dead-lettering,
+add_callback_threadsafe), so a service runs unchanged once its
+get_rabbitmq_connection() returns broker.connection() instead of a real
+pika.BlockingConnection.
+
+All connections share one MemoryBroker. Every connection is driven by the
+thread that calls start_consuming() / process_data_events() on it, exactly
+like a BlockingConnection. Publish latency and failures and delivery
+latency come from FaultModels.
+"""
+import itertools
+import threading
+import time
+import uuid
+from collections import deque
+
+import pika
+from pika import spec
+from pika.frame import Method
+
+from faults import FaultModel
+
+
+class Message:
+    __slots__ = ("exchange", "routing_key", "body", "properties", "redelivered", "deliverable_at")
+
+    def __init__(self, exchange, routing_key, body, properties, deliverable_at):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.body = body
+        self.properties = properties
+        self.redelivered = False
+        self.deliverable_at = deliverable_at
+
+
+class MemoryQueue:
+    def __init__(self, name, arguments=None, exclusive_to=None):
+        self.name = name
+        self.arguments = arguments or {}
+        self.exclusive_to = exclusive_to
+        self.ready = deque()
+        self.unacked = 0
+        self.consumers = 0
+        self.published = 0
+        self.delivered = 0
+        self.acked = 0
+
+    def head_due(self):
+        """Time the first ready message becomes deliverable, None if empty"""
+        return self.ready[0].deliverable_at if self.ready else None
+
+
+class MemoryBroker:
+    """Queues, exchanges and bindings shared by all in-memory connections"""
+
+    def __init__(self, publish=None, delivery=None, connect=None):
+        self.publish_faults = publish or FaultModel()
+        self.delivery_faults = delivery or FaultModel()
+        self.connect_faults = connect or FaultModel()
+        self.cond = threading.Condition()
+        self.queues = {}
+        # name -> {"type": ..., "bindings": [(queue, routing_key), ...]}
+        self.exchanges = {"": {"type": "direct", "bindings": []}}
+        self.closed = False
+        self.consumer_tags = itertools.count(1)
+
+    def connection(self, *args, **kwargs):
+        """Drop-in replacement for get_rabbitmq_connection()"""
+        if self.closed or self.connect_faults.apply():
+            raise pika.exceptions.AMQPConnectionError("In-memory broker unavailable")
+        return MemoryConnection(self)
+
+    def close(self):
+        """Refuse new connections and wake every consumer so it can exit"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    # The methods below expect self.cond to be held
+
+    def _route(self, exchange, routing_key):
+        if exchange == "":
+            return [routing_key] if routing_key in self.queues else []
+        if exchange not in self.exchanges:
+            raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no exchange '{exchange}'")
+
+        ex = self.exchanges[exchange]
+        if ex["type"] == "fanout":
+            return [queue for queue, _ in ex["bindings"]]
+        return [queue for queue, key in ex["bindings"] if key == routing_key]
+
+    def _publish(self, exchange, routing_key, body, properties):
+        now = time.monotonic()
+        for queue_name in dict.fromkeys(self._route(exchange, routing_key)):
+            queue = self.queues.get(queue_name)
+            if queue is None:
+                continue
+            deliverable_at = now + self.delivery_faults.delay()
+            queue.ready.append(Message(exchange, routing_key, body, properties, deliverable_at))
+            queue.published += 1
+        self.cond.notify_all()
+
+    def _dead_letter(self, queue, message):
+        exchange = queue.arguments.get("x-dead-letter-exchange")
+        if exchange is None:
+            return
+
+        routing_key = queue.arguments.get("x-dead-letter-routing-key", message.routing_key)
+        headers = dict(message.properties.headers or {})
+        deaths = [dict(death) for death in headers.get("x-death", [])]
+        previous = next((d for d in deaths if d.get("queue") == queue.name), None)
+        if previous:
+            previous["count"] += 1
+        else:
+            deaths.insert(0, {
+                "queue": queue.name,
+                "reason": "rejected",
+                "count": 1,
+                "exchange": message.exchange,
+                "routing-keys": [message.routing_key],
+                "time": int(time.time()),
+            })
+        headers["x-death"] = deaths
+
+        properties = pika.BasicProperties(**{
+            name: getattr(message.properties, name)
+            for name in ("content_type", "content_encoding", "delivery_mode", "priority",
+                         "correlation_id", "reply_to", "expiration", "message_id",
+                         "timestamp", "type", "user_id", "app_id", "cluster_id")
+        }, headers=headers)
+        self._publish(exchange, routing_key, message.body, properties)
+
+    def queue_counters(self, name):
+        """Same shape as monitoring.broker_stats.ManagementClient.queue_counters"""
+        with self.cond:
+            queue = self.queues[name]
+            return {
+                "timestamp": time.time(),
+                "messages": len(queue.ready) + queue.unacked,
+                "messages_ready": len(queue.ready),
+                "messages_unacknowledged": queue.unacked,
+                "consumers": queue.consumers,
+                "published": queue.published,
+                "delivered": queue.delivered,
+                "acked": queue.acked,
+            }
+
+    def stats(self):
+        return {
+            "queues": {name: self.queue_counters(name) for name in list(self.queues)},
+            "publish": self.publish_faults.stats(),
+            "connect": self.connect_faults.stats(),
+        }
+
+
+class MemoryConnection:
+    """pika.BlockingConnection look-alike bound to a MemoryBroker"""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.channels = []
+        self.channel_numbers = itertools.count(1)
+        self.callbacks = deque()
+        self.is_open = True
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def channel(self, channel_number=None):
+        self._check_open()
+        channel = MemoryChannel(self, channel_number or next(self.channel_numbers))
+        self.channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback):
+        """Run callback on the thread that drives this connection"""
+        with self.broker.cond:
+            self.callbacks.append(callback)
+            self.broker.cond.notify_all()
+
+    def process_data_events(self, time_limit=0):
+        """
+        Dispatch deliveries and queued callbacks
+
+        time_limit=None blocks until at least one event was dispatched,
+        otherwise events are dispatched for up to time_limit seconds.
+        """
+        deadline = None if time_limit is None else time.monotonic() + time_limit
+
+        while self.is_open:
+            dispatched = self._dispatch()
+            if time_limit is None and dispatched:
+                return
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                return
+            if not dispatched:
+                self._wait(timeout)
+                if self.broker.closed:
+                    return
+
+    def sleep(self, duration):
+        self.process_data_events(time_limit=duration)
+
+    def close(self):
+        if not self.is_open:
+            return
+        for channel in list(self.channels):
+            channel.close()
+        with self.broker.cond:
+            for name, queue in list(self.broker.queues.items()):
+                if queue.exclusive_to is self:
+                    del self.broker.queues[name]
+            self.is_open = False
+            self.broker.cond.notify_all()
+
+    def _check_open(self):
+        if not self.is_open:
+            raise pika.exceptions.ConnectionWrongStateError("Connection is closed")
+
+    def _dispatch(self):
+        """Run pending callbacks and one delivery per consumer; True if anything ran"""
+        dispatched = False
+
+        while True:
+            with self.broker.cond:
+                if not self.callbacks:
+                    break
+                callback = self.callbacks.popleft()
+            callback()
+            dispatched = True
+
+        for channel in list(self.channels):
+            for delivery in channel._take_deliveries():
+                channel._deliver(*delivery)
+                dispatched = True
+
+        return dispatched
+
+    def _wait(self, timeout):
+        """Sleep until something may be dispatchable, the next due message or timeout"""
+        with self.broker.cond:
+            if self.callbacks or self.broker.closed:
+                return
+            now = time.monotonic()
+            due = None
+            for channel in self.channels:
+                for queue in channel._consumed_queues():
+                    head = queue.head_due()
+                    if head is not None:
+                        due = head if due is None else min(due, head)
+            if due is not None:
+                if due <= now:
+                    return
+                timeout = due - now if timeout is None else min(timeout, due - now)
+            self.broker.cond.wait(timeout)
+
+
+class MemoryChannel:
+    """pika BlockingChannel look-alike"""
+
+    def __init__(self, connection, channel_number):
+        self.connection = connection
+        self.broker = connection.broker
+        self.channel_number = channel_number
+        self.prefetch_count = 0
+        self.consumers = {}  # tag -> (queue name, callback, auto_ack)
+        self.unacked = {}    # delivery tag -> (queue name, message)
+        self.delivery_tags = itertools.count(1)
+        self.is_open = True
+        self._consuming = False
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def _check_open(self):
+        if not self.is_open or not self.connection.is_open:
+            raise pika.exceptions.ChannelWrongStateError("Channel is closed")
+
+    def _fail(self, code, text):
+        """Broker-side channel error: close the channel like RabbitMQ does"""
+        self.close()
+        raise pika.exceptions.ChannelClosedByBroker(code, text)
+
+    # Topology
+
+    def queue_declare(self, queue="", passive=False, durable=False, exclusive=False,
+                      auto_delete=False, arguments=None):
+        self._check_open()
+        with self.broker.cond:
+            missing = passive and queue not in self.broker.queues
+            if not missing:
+                if not queue:
+                    queue = f"amq.gen-{uuid.uuid4().hex}"
+                if queue not in self.broker.queues:
+                    self.broker.queues[queue] = MemoryQueue(
+                        queue, arguments, self.connection if exclusive else None
+                    )
+                q = self.broker.queues[queue]
+                declare_ok = spec.Queue.DeclareOk(
+                    queue=queue, message_count=len(q.ready), consumer_count=q.consumers
+                )
+
+        if missing:
+            self._fail(404, f"NOT_FOUND - no queue '{queue}'")
+        return Method(self.channel_number, declare_ok)
+
+    def queue_delete(self, queue, if_unused=False, if_empty=False):
+        self._check_open()
+        with self.broker.cond:
+            q = self.broker.queues.pop(queue, None)
+            for ex in self.broker.exchanges.values():
+                ex["bindings"] = [(name, key) for name, key in ex["bindings"] if name != queue]
+        return Method(self.channel_number, spec.Queue.DeleteOk(len(q.ready) if q else 0))
+
+    def queue_purge(self, queue):
+        self._check_open()
+        with self.broker.cond:
+            q = self.broker.queues[queue]
+            count = len(q.ready)
+            q.ready.clear()
+        return Method(self.channel_number, spec.Queue.PurgeOk(count))
+
+    def exchange_declare(self, exchange, exchange_type="direct", passive=False, durable=False,
+                         auto_delete=False, internal=False, arguments=None):
+        self._check_open()
+        exchange_type = getattr(exchange_type, "value", exchange_type)
+        with self.broker.cond:
+            missing = exchange not in self.broker.exchanges
+            if missing and not passive:
+                self.broker.exchanges[exchange] = {"type": exchange_type, "bindings": []}
+
+        if missing and passive:
+            self._fail(404, f"NOT_FOUND - no exchange '{exchange}'")
+        return Method(self.channel_number, spec.Exchange.DeclareOk())
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None):
+        self._check_open()
+        routing_key = queue if routing_key is None else routing_key
+        with self.broker.cond:
+            bindings = self.broker.exchanges[exchange]["bindings"]
+            if (queue, routing_key) not in bindings:
+                bindings.append((queue, routing_key))
+        return Method(self.channel_number, spec.Queue.BindOk())
+
+    def queue_unbind(self, queue, exchange=None, routing_key=None, arguments=None):
+        self._check_open()
+        routing_key = queue if routing_key is None else routing_key
+        with self.broker.cond:
+            bindings = self.broker.exchanges[exchange]["bindings"]
+            if (queue, routing_key) in bindings:
+                bindings.remove((queue, routing_key))
+        return Method(self.channel_number, spec.Queue.UnbindOk())
+
+    # Publishing
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self._check_open()
+        if self.broker.publish_faults.apply(len(body)):
+            # A failed publish takes the connection down, as a lost socket would
+            self.connection.close()
+            raise pika.exceptions.StreamLostError("Injected publish failure")
+
+        with self.broker.cond:
+            self.broker._publish(exchange, routing_key, body, properties or pika.BasicProperties())
+
+    # Consuming
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, global_qos=False):
+        self._check_open()
+        with self.broker.cond:
+            self.prefetch_count = prefetch_count
+            self.broker.cond.notify_all()
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, exclusive=False,
+                      consumer_tag=None, arguments=None):
+        self._check_open()
+        with self.broker.cond:
+            missing = queue not in self.broker.queues
+        if missing:
+            self._fail(404, f"NOT_FOUND - no queue '{queue}'")
+
+        with self.broker.cond:
+            consumer_tag = consumer_tag or f"ctag{self.channel_number}.{next(self.broker.consumer_tags)}"
+            self.consumers[consumer_tag] = (queue, on_message_callback, auto_ack)
+            self.broker.queues[queue].consumers += 1
+            self.broker.cond.notify_all()
+        return consumer_tag
+
+    def basic_cancel(self, consumer_tag=""):
+        with self.broker.cond:
+            consumer = self.consumers.pop(consumer_tag, None)
+            if consumer and consumer[0] in self.broker.queues:
+                self.broker.queues[consumer[0]].consumers -= 1
+        return []
+
+    def basic_get(self, queue, auto_ack=False):
+        self._check_open()
+        with self.broker.cond:
+            q = self.broker.queues[queue]
+            if not q.ready or q.head_due() > time.monotonic():
+                return None, None, None
+            message = q.ready.popleft()
+            q.delivered += 1
+            delivery_tag = next(self.delivery_tags)
+            if auto_ack:
+                q.acked += 1
+            else:
+                q.unacked += 1
+                self.unacked[delivery_tag] = (queue, message)
+            method = spec.Basic.GetOk(delivery_tag, message.redelivered, message.exchange,
+                                      message.routing_key, len(q.ready))
+            return method, message.properties, message.body
+
+    def start_consuming(self):
+        self._check_open()
+        self._consuming = True
+        # Returns once the broker shuts down, so service threads can finish
+        while (self._consuming and self.consumers and self.is_open
+               and self.connection.is_open and not self.broker.closed):
+            self.connection.process_data_events(time_limit=0.5)
+
+    def stop_consuming(self, consumer_tag=None):
+        for tag in [consumer_tag] if consumer_tag else list(self.consumers):
+            self.basic_cancel(tag)
+        self._consuming = False
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._settle(delivery_tag, multiple, "ack")
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._settle(delivery_tag, multiple, "requeue" if requeue else "reject")
+
+    def basic_reject(self, delivery_tag=0, requeue=True):
+        self._settle(delivery_tag, False, "requeue" if requeue else "reject")
+
+    def close(self, reply_code=0, reply_text="Normal shutdown"):
+        if not self.is_open:
+            return
+        # Unacknowledged deliveries go back to their queues, as on a real broker
+        with self.broker.cond:
+            for tag in list(self.consumers):
+                consumer = self.consumers.pop(tag)
+                if consumer[0] in self.broker.queues:
+                    self.broker.queues[consumer[0]].consumers -= 1
+            self._requeue(sorted(self.unacked))
+            self.is_open = False
+            if self in self.connection.channels:
+                self.connection.channels.remove(self)
+            self.broker.cond.notify_all()
+
+    # Internals
+
+    def _settle(self, delivery_tag, multiple, outcome):
+        self._check_open()
+        with self.broker.cond:
+            if multiple:
+                tags = [tag for tag in self.unacked if delivery_tag == 0 or tag <= delivery_tag]
+            elif delivery_tag in self.unacked:
+                tags = [delivery_tag]
+            else:
+                tags = None
+
+            if not tags:
+                pass
+            elif outcome == "requeue":
+                self._requeue(tags)
+            else:
+                for tag in tags:
+                    queue_name, message = self.unacked.pop(tag)
+                    queue = self.broker.queues.get(queue_name)
+                    if queue is None:
+                        continue
+                    queue.unacked -= 1
+                    if outcome == "ack":
+                        queue.acked += 1
+                    else:
+                        self.broker._dead_letter(queue, message)
+            self.broker.cond.notify_all()
+
+        if not tags:
+            self._fail(406, f"PRECONDITION_FAILED - unknown delivery tag {delivery_tag}")
+
+    def _requeue(self, tags):
+        """Put deliveries back at the head of their queues (cond held)"""
+        for tag in reversed(tags):
+            queue_name, message = self.unacked.pop(tag)
+            queue = self.broker.queues.get(queue_name)
+            if queue is None:
+                continue
+            queue.unacked -= 1
+            message.redelivered = True
+            message.deliverable_at = 0
+            queue.ready.appendleft(message)
+
+    def _consumed_queues(self):
+        if not self.is_open or (self.prefetch_count and len(self.unacked) >= self.prefetch_count):
+            return []
+        return [self.broker.queues[name] for name, _, _ in self.consumers.values()
+                if name in self.broker.queues]
+
+    def _take_deliveries(self):
+        """Pop at most one due message per consumer within the prefetch window"""
+        deliveries = []
+        now = time.monotonic()
+        with self.broker.cond:
+            for tag, (queue_name, callback, auto_ack) in list(self.consumers.items()):
+                if self.prefetch_count and len(self.unacked) >= self.prefetch_count and not auto_ack:
+                    break
+                queue = self.broker.queues.get(queue_name)
+                if queue is None or not queue.ready or queue.head_due() > now:
+                    continue
+
+                message = queue.ready.popleft()
+                queue.delivered += 1
+                delivery_tag = next(self.delivery_tags)
+                if auto_ack:
+                    queue.acked += 1
+                else:
+                    queue.unacked += 1
+                    self.unacked[delivery_tag] = (queue_name, message)
+                method = spec.Basic.Deliver(tag, delivery_tag, message.redelivered,
+                                            message.exchange, message.routing_key)
+                deliveries.append((callback, method, message))
+        return deliveries
+
+    def _deliver(self, callback, method, message):
+        callback(self, method, message.properties, message.body)
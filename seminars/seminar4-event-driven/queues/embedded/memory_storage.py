@@ -0,0 +1,173 @@
+"""
+In-memory stand-in for MinIO
+
+Implements the subset of the minio.Minio client the services use
+(bucket_exists, make_bucket, put_object, get_object, stat_object,
+list_objects, remove_object, presigned_put_object, presigned_get_object),
+raising the same S3Error codes, so it can be assigned to a service's
+module-level minio_client. Presigned URLs point at public_url, where the
+embedded runner serves them. Each call is delayed
+and may fail according to its FaultModel; payload size counts against the
+modelled bandwidth.
+"""
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+from minio.datatypes import Object
+from minio.error import S3Error
+
+from faults import FaultModel
+
+
+class MemoryObjectResponse:
+    """Minimal urllib3 HTTPResponse look-alike returned by get_object()"""
+
+    def __init__(self, data, content_type, etag):
+        self.data = data
+        self.status = 200
+        self.headers = {
+            "Content-Type": content_type,
+            "Content-Length": str(len(data)),
+            "ETag": f'"{etag}"',
+        }
+        self._position = 0
+
+    def read(self, amt=None):
+        end = len(self.data) if amt is None else min(self._position + amt, len(self.data))
+        chunk = self.data[self._position:end]
+        self._position = end
+        return chunk
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        while True:
+            chunk = self.read(amt)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class MemoryStorage:
+    """minio.Minio look-alike keeping objects in a dict"""
+
+    def __init__(self, put=None, get=None, meta=None, public_url=None):
+        self.put_faults = put or FaultModel()
+        self.get_faults = get or FaultModel()
+        self.meta_faults = meta or FaultModel()
+        self.public_url = public_url
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def _error(self, code, message, bucket_name, object_name=None):
+        resource = f"/{bucket_name}" + (f"/{object_name}" if object_name else "")
+        return S3Error(code=code, message=message, resource=resource, request_id="memory",
+                       host_id="memory", response=None, bucket_name=bucket_name,
+                       object_name=object_name)
+
+    def _bucket(self, bucket_name):
+        bucket = self.buckets.get(bucket_name)
+        if bucket is None:
+            raise self._error("NoSuchBucket", "The specified bucket does not exist", bucket_name)
+        return bucket
+
+    def _object(self, bucket_name, object_name):
+        obj = self._bucket(bucket_name).get(object_name)
+        if obj is None:
+            raise self._error("NoSuchKey", "Object does not exist", bucket_name, object_name)
+        return obj
+
+    def _describe(self, bucket_name, object_name, obj):
+        return Object(bucket_name, object_name, last_modified=obj["last_modified"],
+                      etag=obj["etag"], size=len(obj["data"]), metadata=obj["metadata"],
+                      content_type=obj["content_type"])
+
+    def bucket_exists(self, bucket_name):
+        if self.meta_faults.apply():
+            raise self._error("InternalError", "Injected failure", bucket_name)
+        with self.lock:
+            return bucket_name in self.buckets
+
+    def make_bucket(self, bucket_name, location=None, object_lock=False):
+        if self.meta_faults.apply():
+            raise self._error("InternalError", "Injected failure", bucket_name)
+        with self.lock:
+            if bucket_name in self.buckets:
+                raise self._error("BucketAlreadyOwnedByYou", "Bucket already exists", bucket_name)
+            self.buckets[bucket_name] = {}
+
+    def put_object(self, bucket_name, object_name, data, length, content_type="application/octet-stream",
+                   metadata=None, **kwargs):
+        payload = data.read(length) if length >= 0 else data.read()
+        if self.put_faults.apply(len(payload)):
+            raise self._error("InternalError", "Injected failure", bucket_name, object_name)
+
+        obj = {
+            "data": payload,
+            "content_type": content_type,
+            "metadata": dict(metadata or {}),
+            "etag": hashlib.md5(payload).hexdigest(),
+            "last_modified": datetime.now(timezone.utc),
+        }
+        with self.lock:
+            self._bucket(bucket_name)[object_name] = obj
+        return self._describe(bucket_name, object_name, obj)
+
+    def get_object(self, bucket_name, object_name, offset=0, length=0, **kwargs):
+        with self.lock:
+            obj = self._object(bucket_name, object_name)
+        data = obj["data"][offset:offset + length] if length else obj["data"][offset:]
+        if self.get_faults.apply(len(data)):
+            raise self._error("InternalError", "Injected failure", bucket_name, object_name)
+        return MemoryObjectResponse(data, obj["content_type"], obj["etag"])
+
+    def stat_object(self, bucket_name, object_name, **kwargs):
+        if self.meta_faults.apply():
+            raise self._error("InternalError", "Injected failure", bucket_name, object_name)
+        with self.lock:
+            return self._describe(bucket_name, object_name, self._object(bucket_name, object_name))
+
+    def list_objects(self, bucket_name, prefix=None, recursive=False, start_after=None, **kwargs):
+        if self.meta_faults.apply():
+            raise self._error("InternalError", "Injected failure", bucket_name)
+        with self.lock:
+            items = sorted(self._bucket(bucket_name).items())
+        return iter([self._describe(bucket_name, name, obj) for name, obj in items
+                     if (not prefix or name.startswith(prefix)) and (not start_after or name > start_after)])
+
+    def remove_object(self, bucket_name, object_name, **kwargs):
+        if self.meta_faults.apply():
+            raise self._error("InternalError", "Injected failure", bucket_name, object_name)
+        with self.lock:
+            self._bucket(bucket_name).pop(object_name, None)
+
+    def _presigned_url(self, bucket_name, object_name, expires):
+        """URL under public_url; the signature is not modelled, only the expiry is echoed"""
+        if self.public_url is None:
+            raise ValueError("MemoryStorage.public_url is not set")
+        return (f"{self.public_url}/{quote(bucket_name)}/{quote(object_name)}"
+                f"?X-Amz-Expires={int(expires.total_seconds())}")
+
+    def presigned_put_object(self, bucket_name, object_name, expires=timedelta(days=7), **kwargs):
+        return self._presigned_url(bucket_name, object_name, expires)
+
+    def presigned_get_object(self, bucket_name, object_name, expires=timedelta(days=7), **kwargs):
+        return self._presigned_url(bucket_name, object_name, expires)
+
+    def stats(self):
+        with self.lock:
+            objects = sum(len(bucket) for bucket in self.buckets.values())
+            size = sum(len(obj["data"]) for bucket in self.buckets.values() for obj in bucket.values())
+        return {
+            "objects": objects,
+            "bytes": size,
+            "put": self.put_faults.stats(),
+            "get": self.get_faults.stats(),
+            "meta": self.meta_faults.stats(),
+        }
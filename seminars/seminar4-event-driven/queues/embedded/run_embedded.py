@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Embedded mode - run API, workers and notifier in one process
+
+RabbitMQ and MinIO are replaced by in-memory stand-ins (memory_broker.py,
+memory_storage.py) with configurable latency, jitter, bandwidth and failure
+rates. The services run their own code unchanged: the API's
+get_rabbitmq_connection() and minio_client are swapped for the stand-ins,
+and workers / the notifier run consume() on in-memory connections in
+threads. Presigned upload and download URLs point at /_storage on the
+same server, which plays MinIO's part. Load tests work against it as against
+the docker-compose stack:
+
+    python embedded/run_embedded.py --workers 4 --quiet --profile profiles/
+    python load_test/bulk_upload.py --count 1000 --mode open --rate 50
+
+With --profile every service thread is profiled separately, so the
+pipeline's own overhead can be studied without network noise.
+"""
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from io import BytesIO
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+for service in ("notification", "worker", "api"):
+    sys.path.insert(0, str(ROOT / service))
+
+import uvicorn
+from fastapi import Request, Response
+
+import main as api
+import notifier
+import worker
+
+from faults import FaultModel
+from memory_broker import MemoryBroker
+from memory_storage import MemoryStorage
+
+
+def log(message):
+    """Runner output; stays visible when --quiet silences the services"""
+    print(f"[Embedded] {message}", file=sys.__stdout__, flush=True)
+
+
+class ServiceThread(threading.Thread):
+    """
+    Run a service's consume() loop, reconnecting after failures
+
+    Mirrors the retry loop in the services' main(): an injected publish
+    failure drops the connection and the service reconnects.
+    """
+
+    def __init__(self, name, consume, broker, profile=False):
+        super().__init__(name=name, daemon=True)
+        self.consume = consume
+        self.broker = broker
+        self.profiler = cProfile.Profile() if profile else None
+        self.restarts = 0
+
+    def run(self):
+        if self.profiler:
+            self.profiler.enable()
+        try:
+            while not self.broker.closed:
+                try:
+                    connection = self.broker.connection()
+                    try:
+                        self.consume(connection)
+                    finally:
+                        connection.close()
+                except Exception as e:
+                    if self.broker.closed:
+                        break
+                    self.restarts += 1
+                    log(f"{self.name} reconnecting after error: {e}")
+                    time.sleep(0.1)
+        finally:
+            if self.profiler:
+                self.profiler.disable()
+
+
+def fault_model(latency_ms, jitter_ms, failure_rate, seed, bandwidth_mb=None):
+    return FaultModel(
+        latency=latency_ms / 1000,
+        jitter=jitter_ms / 1000,
+        bandwidth=bandwidth_mb * 1024 * 1024 if bandwidth_mb else None,
+        failure_rate=failure_rate,
+        seed=seed
+    )
+
+
+def report(broker, storage, previous=None):
+    """Print one line of pipeline counters; returns the counters for rate computation"""
+    # Task queue counters summed over every shard
+    shards = [broker.queue_counters(name) for name in api.task_queues]
+    task = {key: sum(shard[key] for shard in shards) for key in shards[0] if key != "timestamp"}
+    task["timestamp"] = shards[0]["timestamp"]
+    dlq = broker.queue_counters(api.settings.dlq_queue)
+    store = storage.stats()
+    memory = worker.memory_budget.stats()
+
+    rates = ""
+    if previous:
+        elapsed = task["timestamp"] - previous["timestamp"]
+        if elapsed > 0:
+            arrival = (task["published"] - previous["published"]) / elapsed
+            completion = (task["acked"] - previous["acked"]) / elapsed
+            rates = f" | in {arrival:.1f}/s out {completion:.1f}/s"
+
+    log(f"tasks ready {task['messages_ready']} unacked {task['messages_unacknowledged']} "
+        f"published {task['published']} acked {task['acked']} | dlq {dlq['messages']} | "
+        f"objects {store['objects']} ({store['bytes'] / 1024 / 1024:.1f} MB) | "
+        f"budget {memory['in_use_mb']:.0f}/{memory['limit_mb']:.0f} MB, {memory['waits']} waits{rates}")
+    return task
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the whole pipeline in one process")
+    parser.add_argument("--host", default="127.0.0.1", help="API bind address")
+    parser.add_argument("--port", type=int, default=8000, help="API port")
+    parser.add_argument("--workers", type=int, default=2, help="Worker threads")
+    parser.add_argument("--worker-mode", choices=["sequential", "staged", "batch"], default=worker.WORKER_MODE,
+                        help="Worker pipeline (default: WORKER_MODE env)")
+    parser.add_argument("--memory-budget", type=float, default=None,
+                        help="Worker memory budget shared by all worker threads (MB, default: MEMORY_BUDGET_MB env)")
+    parser.add_argument("--no-warm-up", action="store_true",
+                        help="Start consuming without the worker warm-up (to measure cold-start cost)")
+    parser.add_argument("--no-notifier", action="store_true", help="Do not run the notification service")
+
+    parser.add_argument("--broker-latency", type=float, default=0.0, help="Publish latency (ms)")
+    parser.add_argument("--broker-jitter", type=float, default=0.0, help="Mean extra publish latency (ms)")
+    parser.add_argument("--broker-failure-rate", type=float, default=0.0,
+                        help="Probability that a publish drops the connection")
+    parser.add_argument("--delivery-latency", type=float, default=0.0,
+                        help="Delay before a published message can be delivered (ms)")
+
+    parser.add_argument("--storage-latency", type=float, default=0.0, help="Per-request storage latency (ms)")
+    parser.add_argument("--storage-jitter", type=float, default=0.0, help="Mean extra storage latency (ms)")
+    parser.add_argument("--storage-bandwidth", type=float, default=None, help="Storage bandwidth (MB/s)")
+    parser.add_argument("--storage-failure-rate", type=float, default=0.0,
+                        help="Probability that a put/get fails with S3Error")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for injected faults")
+
+    parser.add_argument("--stats-interval", type=float, default=5.0, help="Seconds between status lines (0 = off)")
+    parser.add_argument("--profile", default=None, help="Directory for per-thread cProfile dumps")
+    parser.add_argument("--quiet", action="store_true", help="Silence service logs and tracebacks")
+
+    args = parser.parse_args()
+
+    broker = MemoryBroker(
+        publish=fault_model(args.broker_latency, args.broker_jitter, args.broker_failure_rate, args.seed),
+        delivery=fault_model(args.delivery_latency, 0, 0, args.seed)
+    )
+    storage = MemoryStorage(
+        put=fault_model(args.storage_latency, args.storage_jitter, args.storage_failure_rate,
+                        args.seed, args.storage_bandwidth),
+        get=fault_model(args.storage_latency, args.storage_jitter, args.storage_failure_rate,
+                        args.seed, args.storage_bandwidth),
+        meta=fault_model(args.storage_latency, args.storage_jitter, 0, args.seed),
+        public_url=f"http://{args.host}:{args.port}/_storage"
+    )
+
+    # Swap the services' broker and storage clients for the stand-ins
+    api.get_rabbitmq_connection = broker.connection
+    api.minio_client = storage
+    api.presign_client = storage
+    worker.get_rabbitmq_connection = broker.connection
+    worker.minio_client = storage
+    worker.WORKER_MODE = args.worker_mode
+    if args.memory_budget:
+        worker.memory_budget.limit = int(args.memory_budget * worker.MB)
+    notifier.get_rabbitmq_connection = broker.connection
+
+    # Target of presigned URLs, standing in for MinIO's endpoint
+    @api.app.get("/_storage/{bucket}/{object_name:path}")
+    async def storage_get(bucket: str, object_name: str):
+        try:
+            response = storage.get_object(bucket, object_name)
+        except Exception as e:
+            missing = getattr(e, "code", None) in ("NoSuchKey", "NoSuchBucket")
+            return Response(content=str(e), status_code=404 if missing else 500)
+        return Response(content=response.read(), media_type=response.headers["Content-Type"],
+                        headers={"ETag": response.headers["ETag"]})
+
+    @api.app.put("/_storage/{bucket}/{object_name:path}")
+    async def storage_put(bucket: str, object_name: str, request: Request):
+        data = await request.body()
+        try:
+            storage.put_object(bucket, object_name, BytesIO(data), len(data),
+                               content_type=request.headers.get("content-type", "application/octet-stream"))
+        except Exception as e:
+            return Response(content=str(e), status_code=500)
+        return Response(status_code=200)
+
+    threads = [ServiceThread(f"worker-{i + 1}", worker.consume, broker, bool(args.profile))
+               for i in range(args.workers)]
+    if not args.no_notifier:
+        threads.append(ServiceThread("notifier", notifier.consume, broker, bool(args.profile)))
+
+    stop_reporting = threading.Event()
+
+    def reporter():
+        previous = None
+        while not stop_reporting.wait(args.stats_interval):
+            previous = report(broker, storage, previous)
+
+    # Registered after the API's own startup handler, which declares the topology
+    @api.app.on_event("startup")
+    async def start_services():
+        # Once per process, like a worker container, before any worker consumes
+        if args.no_warm_up:
+            worker.startup.mark_ready({})
+        else:
+            worker.warm_up()
+            log("Worker warm-up (ms): " + json.dumps({k: round(v, 1) for k, v in worker.startup.warm_up.items()}))
+        worker.cancellations.start()
+        for thread in threads:
+            thread.start()
+        if args.stats_interval > 0:
+            threading.Thread(target=reporter, name="reporter", daemon=True).start()
+        log(f"API on http://{args.host}:{args.port}, {args.workers} {args.worker_mode} workers"
+            f"{'' if args.no_notifier else ' + notifier'}, in-memory broker and storage")
+
+    if args.quiet:
+        sys.stdout = sys.stderr = open(os.devnull, "w")
+
+    server = uvicorn.Server(uvicorn.Config(
+        api.app, host=args.host, port=args.port,
+        log_level="warning" if args.quiet else "info", access_log=not args.quiet
+    ))
+
+    api_profiler = cProfile.Profile() if args.profile else None
+    if api_profiler:
+        api_profiler.enable()
+    try:
+        server.run()
+    finally:
+        if api_profiler:
+            api_profiler.disable()
+
+    # Shut down: consumers return from start_consuming once the broker closes
+    stop_reporting.set()
+    broker.close()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    report(broker, storage)
+    log("Broker: " + json.dumps(broker.stats()["publish"]))
+    startup = worker.startup.stats()
+    log(f"Worker startup: ready {startup['time_to_ready']:.2f}s, first job "
+        f"{'-' if startup['time_to_first_job'] is None else format(startup['time_to_first_job'], '.2f') + 's'} "
+        f"after process start")
+    cancellations = worker.cancellations.stats()
+    log(f"Skipped jobs: cancelled {json.dumps(cancellations['skipped'])} ({cancellations['tombstones']} tombstones), "
+        f"expired {json.dumps(worker.expired_jobs)}")
+    log("Storage: " + json.dumps({k: v for k, v in storage.stats().items() if k in ("put", "get")}))
+
+    if args.profile:
+        profile_dir = Path(args.profile)
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        files = []
+        for name, profiler in [("api", api_profiler)] + [(t.name, t.profiler) for t in threads]:
+            path = profile_dir / f"{name}.prof"
+            profiler.dump_stats(path)
+            files.append(str(path))
+        log(f"Profiles written to {profile_dir}/ ({', '.join(Path(f).name for f in files)})")
+
+        # Combined view of where the pipeline spends its own time
+        stats = pstats.Stats(*files, stream=sys.__stdout__)
+        stats.sort_stats("tottime").print_stats(15)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,29 @@ Analyze results from load tests
 import argparse
 import json
 import glob
+import sys
 from pathlib import Path
 import statistics
 
+import numpy as np
+
+from result_store import ColumnReader
+
+
+PERCENTILES = [90, 95, 99, 99.9]
+
+# Allowed relative change (%) before a metric counts as a regression.
+# Latencies regress when they grow, throughput when it shrinks.
+DEFAULT_THRESHOLDS = {
+    "p50": 10.0,
+    "p90": 10.0,
+    "p95": 10.0,
+    "p99": 15.0,
+    "p99.9": 25.0,
+    "mean": 10.0,
+    "throughput": 10.0,
+}
+
 
 def load_results(pattern):
     """Load all result files matching pattern"""
@@ -32,6 +52,55 @@ def load_results(pattern):
     return results
 
 
+def request_latencies(result):
+    """
+    Latencies (s) of the successful requests in a result file, as an array
+    
+    Column-backed runs only memory-map the `elapsed` and `success` columns;
+    older runs with an inline `results` list are still supported.
+    """
+    data = result["data"]
+    if "columns" in data:
+        columns = ColumnReader(Path(result["file"]).parent, data["columns"])
+        return np.asarray(columns["elapsed"][columns["success"].astype(bool)], dtype=float)
+    return np.array([r["elapsed"] for r in data.get("results", []) if r["success"]], dtype=float)
+
+
+def latency_stat(values, metric):
+    """Compute a latency metric such as 'mean' or 'p99.9' from raw values"""
+    if metric == "mean":
+        return float(np.mean(values))
+    return float(np.percentile(values, float(metric[1:])))
+
+
+def print_percentiles(result):
+    """Print tail percentiles computed from the raw per-request results"""
+    values = request_latencies(result)
+    if not len(values):
+        return
+    
+    print(f"\nPercentiles ({len(values)} successful requests):")
+    for percentile in PERCENTILES:
+        print(f"  p{percentile:g}: {latency_stat(values, f'p{percentile:g}'):.3f}s")
+
+
+def print_completion(summary):
+    """Print end-to-end job statistics if the run tracked completions"""
+    completion = summary.get("completion")
+    if not completion:
+        return
+    
+    print(f"\nJob Completion:")
+    print(f"  Completed: {completion['completed']}/{completion['tracked']}")
+    print(f"  Throughput: {completion['completed_per_second']:.2f} completed jobs/s")
+    for name, title in [("end_to_end", "End-to-end"), ("queue_wait", "Queue wait"),
+                        ("processing", "Processing")]:
+        stats = completion[name]
+        if stats.get("count"):
+            print(f"  {title}: p50 {stats['p50']:.3f}s, p99 {stats['p99']:.3f}s, "
+                  f"max {stats['max']:.3f}s")
+
+
 def analyze_bulk_uploads(results):
     """Analyze bulk upload results"""
     print("\n" + "="*80)
@@ -62,6 +131,9 @@ def analyze_bulk_uploads(results):
         print(f"  Min: {latency['min']:.3f}s")
         print(f"  Max: {latency['max']:.3f}s")
         print(f"  StdDev: {latency['stdev']:.3f}s")
+        
+        print_percentiles(result)
+        print_completion(summary)
 
 
 def analyze_burst_tests(results):
@@ -85,6 +157,7 @@ def analyze_burst_tests(results):
         print(f"\nResults:")
         print(f"  Total images: {summary['total_images']}")
         print(f"  Successful: {summary['successful']}")
+        print(f"  Rejected (429): {summary.get('rejected', 0)}")
         print(f"  Failed: {summary['failed']}")
         
         burst_timings = summary['burst_timings']
@@ -99,6 +172,105 @@ def analyze_burst_tests(results):
         print(f"  Median: {latency['median']:.3f}s")
         print(f"  Min: {latency['min']:.3f}s")
         print(f"  Max: {latency['max']:.3f}s")
+        
+        print_percentiles(result)
+        print_completion(summary)
+
+
+def analyze_capacity(results, plot_file=None):
+    """Analyze capacity search reports and compare them across worker counts"""
+    print("\n" + "="*80)
+    print("Capacity Search Analysis")
+    print("="*80)
+    
+    def workers_key(result):
+        workers = result["data"]["config"].get("workers")
+        return (workers is None, workers or 0, result["file"])
+    
+    results = sorted(results, key=workers_key)
+    
+    for result in results:
+        data = result["data"]
+        config = data["config"]
+        summary = data["summary"]
+        
+        print(f"\nFile: {result['file']}")
+        print(f"Configuration:")
+        print(f"  Workers: {config.get('workers', 'unknown')}")
+        print(f"  Strategy: {config['strategy']}")
+        print(f"  SLO: p99 {config['slo_metric']} <= {config['slo_p99']}s, "
+              f"errors <= {config['max_error_rate']:.1%}")
+        
+        print(f"\nCurve:")
+        print(f"  {'Offered/s':>10} {'Achieved/s':>11} {'p99 (s)':>9} {'Errors':>8}  Result")
+        for step in data["steps"]:
+            p99 = f"{step['p99']:.3f}" if step["p99"] is not None else "n/a"
+            verdict = "PASS" if step["passed"] else "FAIL " + ",".join(step["failure_reasons"])
+            print(f"  {step['offered_rate']:>10.2f} {step['throughput']:>11.2f} {p99:>9} "
+                  f"{step['error_rate']:>8.1%}  {verdict}")
+        
+        print(f"\nResults:")
+        if summary["sustainable_rate"] is not None:
+            print(f"  Sustainable rate: {summary['sustainable_rate']:.2f} uploads/s")
+            print(f"  Sustainable throughput: {summary['sustainable_throughput']:.2f}/s")
+        else:
+            print(f"  Sustainable rate: none (no step met the SLO)")
+        if summary["knee"]:
+            print(f"  Knee: {summary['knee']['offered_rate']:.2f} uploads/s "
+                  f"(p99 {summary['knee']['p99']:.3f}s)")
+    
+    if len(results) > 1:
+        print("\nSustainable throughput by worker count:")
+        for result in results:
+            summary = result["data"]["summary"]
+            workers = result["data"]["config"].get("workers", "?")
+            throughput = summary["sustainable_throughput"]
+            value = f"{throughput:.2f}/s" if throughput is not None else "n/a"
+            print(f"  workers={workers}: {value} - {Path(result['file']).name}")
+    
+    if plot_file:
+        plot_capacity(results, plot_file)
+
+
+def plot_capacity(results, plot_file):
+    """Plot throughput and p99 against offered load, one line per report"""
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("\nmatplotlib is not installed; skipping plot (pip install matplotlib)")
+        return
+    
+    fig, (ax_throughput, ax_latency) = plt.subplots(1, 2, figsize=(12, 5))
+    
+    for result in results:
+        data = result["data"]
+        workers = data["config"].get("workers")
+        label = f"workers={workers}" if workers is not None else Path(result["file"]).stem
+        steps = [s for s in data["steps"] if s["p99"] is not None]
+        offered = [s["offered_rate"] for s in steps]
+        
+        ax_throughput.plot(offered, [s["throughput"] for s in steps], marker="o", label=label)
+        ax_latency.plot(offered, [s["p99"] for s in steps], marker="o", label=label)
+        
+        knee = data["summary"]["knee"]
+        if knee:
+            ax_latency.axvline(knee["offered_rate"], linestyle=":", alpha=0.5)
+    
+    slo = results[0]["data"]["config"]["slo_p99"]
+    ax_latency.axhline(slo, color="red", linestyle="--", label=f"SLO {slo}s")
+    
+    ax_throughput.set_xlabel("Offered load (uploads/s)")
+    ax_throughput.set_ylabel("Achieved throughput (uploads/s)")
+    ax_latency.set_xlabel("Offered load (uploads/s)")
+    ax_latency.set_ylabel("p99 latency (s)")
+    ax_throughput.legend()
+    ax_latency.legend()
+    
+    fig.tight_layout()
+    fig.savefig(plot_file)
+    print(f"\nPlot saved to: {plot_file}")
 
 
 def compare_results(results):
@@ -113,6 +285,7 @@ def compare_results(results):
     
     throughputs = []
     mean_latencies = []
+    p99_latencies = []
     
     for result in results:
         data = result["data"]
@@ -130,6 +303,13 @@ def compare_results(results):
             "latency": summary["latency"]["mean"],
             "config": data["config"]
         })
+        
+        values = request_latencies(result)
+        if len(values):
+            p99_latencies.append({
+                "file": result["file"],
+                "latency": latency_stat(values, "p99")
+            })
     
     if throughputs:
         print("\nThroughput comparison:")
@@ -143,16 +323,140 @@ def compare_results(results):
     sorted_latencies = sorted(mean_latencies, key=lambda x: x["latency"])
     for i, item in enumerate(sorted_latencies, 1):
         print(f"  {i}. {item['latency']:.3f}s - {Path(item['file']).name}")
+    
+    if p99_latencies:
+        print("\np99 latency comparison:")
+        for i, item in enumerate(sorted(p99_latencies, key=lambda x: x["latency"]), 1):
+            print(f"  {i}. {item['latency']:.3f}s - {Path(item['file']).name}")
+
+
+def bootstrap_change(baseline, candidate, metric, iterations=2000, confidence=0.95,
+                     max_samples=20000, seed=0):
+    """
+    Bootstrap confidence interval of the relative change of a latency metric
+    
+    Both samples are resampled with replacement and the metric recomputed;
+    the interval is taken from the distribution of candidate/baseline - 1.
+    Very large runs are subsampled to max_samples first to bound the cost.
+    Returns (low, high) as fractions.
+    """
+    rng = np.random.default_rng(seed)
+    
+    if len(baseline) > max_samples:
+        baseline = rng.choice(baseline, max_samples, replace=False)
+    if len(candidate) > max_samples:
+        candidate = rng.choice(candidate, max_samples, replace=False)
+    
+    changes = np.empty(iterations)
+    for i in range(iterations):
+        base_stat = latency_stat(rng.choice(baseline, len(baseline)), metric)
+        cand_stat = latency_stat(rng.choice(candidate, len(candidate)), metric)
+        changes[i] = cand_stat / base_stat - 1 if base_stat > 0 else 0.0
+    
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(changes, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def parse_thresholds(overrides):
+    """Merge METRIC=PERCENT overrides into the default thresholds"""
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for item in overrides or []:
+        metric, _, value = item.partition("=")
+        if metric not in DEFAULT_THRESHOLDS or not value:
+            raise ValueError(f"Invalid threshold {item!r}; metrics: {', '.join(DEFAULT_THRESHOLDS)}")
+        thresholds[metric] = float(value)
+    return thresholds
+
+
+def regression_gate(baseline, candidate, thresholds, iterations=2000, confidence=0.95):
+    """
+    Compare a candidate run against a baseline run
+    
+    A latency metric regresses when its relative increase exceeds the
+    threshold AND the bootstrap confidence interval of the change lies
+    entirely above zero, i.e. the slowdown is larger than run-to-run noise.
+    Throughput has one value per run, so it is compared directly.
+    Returns True if any metric regressed.
+    """
+    print("\n" + "="*80)
+    print("Regression Gate")
+    print("="*80)
+    print(f"Baseline:  {baseline['file']}")
+    print(f"Candidate: {candidate['file']}")
+    
+    base_values = request_latencies(baseline)
+    cand_values = request_latencies(candidate)
+    if not len(base_values) or not len(cand_values):
+        print("\nBoth files need raw per-request results with successful requests")
+        return True
+    
+    print(f"\n{'Metric':<11} {'Baseline':>10} {'Candidate':>10} {'Change':>9} "
+          f"{f'{confidence:.0%} CI':>19} {'Limit':>7}  Result")
+    
+    regressed = False
+    for metric, threshold in thresholds.items():
+        if metric == "throughput":
+            continue
+        base_stat = latency_stat(base_values, metric)
+        cand_stat = latency_stat(cand_values, metric)
+        change = cand_stat / base_stat - 1 if base_stat > 0 else 0.0
+        low, high = bootstrap_change(base_values, cand_values, metric, iterations, confidence)
+        
+        if change * 100 > threshold and low > 0:
+            verdict, regressed = "REGRESSION", True
+        elif low > 0 or high < 0:
+            verdict = "changed"
+        else:
+            verdict = "ok (noise)"
+        
+        print(f"{metric:<11} {base_stat:>9.3f}s {cand_stat:>9.3f}s {change:>+9.1%} "
+              f"[{low:>+7.1%}, {high:>+7.1%}] {threshold:>6.1f}%  {verdict}")
+    
+    base_throughput = baseline["data"]["summary"].get("throughput")
+    cand_throughput = candidate["data"]["summary"].get("throughput")
+    if "throughput" in thresholds and base_throughput and cand_throughput:
+        change = cand_throughput / base_throughput - 1
+        verdict = "ok"
+        if -change * 100 > thresholds["throughput"]:
+            verdict, regressed = "REGRESSION", True
+        print(f"{'throughput':<11} {base_throughput:>8.2f}/s {cand_throughput:>8.2f}/s "
+              f"{change:>+9.1%} {'':>19} {thresholds['throughput']:>6.1f}%  {verdict}")
+    
+    print(f"\nResult: {'REGRESSION' if regressed else 'PASS'}")
+    return regressed
 
 
 def main():
     parser = argparse.ArgumentParser(description="Analyze load test results")
     parser.add_argument("--pattern", default="*_results_*.json", help="File pattern to match")
-    parser.add_argument("--type", choices=["bulk", "burst", "all"], default="all", 
+    parser.add_argument("--type", choices=["bulk", "burst", "capacity", "all"], default="all", 
                        help="Type of tests to analyze")
+    parser.add_argument("--plot", default=None, help="Save capacity curves to this image file")
+    parser.add_argument("--baseline", default=None, help="Baseline result file for the regression gate")
+    parser.add_argument("--candidate", default=None, help="Candidate result file for the regression gate")
+    parser.add_argument("--threshold", action="append", metavar="METRIC=PERCENT",
+                        help="Allowed change per metric, e.g. p99=5 (repeatable; "
+                             f"metrics: {', '.join(DEFAULT_THRESHOLDS)})")
+    parser.add_argument("--bootstrap", type=int, default=2000, help="Bootstrap iterations")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level")
     
     args = parser.parse_args()
     
+    if args.baseline or args.candidate:
+        if not (args.baseline and args.candidate):
+            parser.error("--baseline and --candidate must be used together")
+        try:
+            thresholds = parse_thresholds(args.threshold)
+        except ValueError as e:
+            parser.error(str(e))
+        baseline, candidate = load_results(args.baseline), load_results(args.candidate)
+        if not baseline or not candidate:
+            sys.exit(2)
+        regressed = regression_gate(baseline[0], candidate[0], thresholds,
+                                    args.bootstrap, args.confidence)
+        sys.exit(1 if regressed else 0)
+    
     results = load_results(args.pattern)
     
     if not results:
@@ -170,9 +474,15 @@ def main():
         if burst_results:
             analyze_burst_tests(burst_results)
     
+    if args.type in ["capacity", "all"]:
+        capacity_results = [r for r in results if "capacity_search" in r["file"]]
+        if capacity_results:
+            analyze_capacity(capacity_results, args.plot)
+    
     # Compare if multiple results
-    if len(results) > 1:
-        compare_results(results)
+    load_results_only = [r for r in results if "capacity_search" not in r["file"]]
+    if len(load_results_only) > 1:
+        compare_results(load_results_only)
     
     print("\n")
 
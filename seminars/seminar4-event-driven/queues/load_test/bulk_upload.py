@@ -6,12 +6,18 @@ import argparse
 import asyncio
 import time
 from pathlib import Path
-import statistics
 import json
 
 import aiohttp
 from PIL import Image
 import io
+from yarl import URL
+
+from corpus import ImageCorpus, SingleImage
+from completion_tracker import CompletionTracker, collect_completions, print_completion_summary
+from histogram import print_histogram_summary
+from open_loop import ARRIVAL_PROCESSES, arrival_offsets, run_open_loop
+from result_store import ColumnReader, ResultRecorder, latency_summary, results_path
 
 
 async def create_test_image(width=1920, height=1080):
@@ -33,133 +39,298 @@ async def create_test_image(width=1920, height=1080):
     return img_bytes.getvalue()
 
 
-async def upload_image(session, api_url, image_data, image_id, operations="resize,watermark"):
-    """Upload a single image"""
-    start_time = time.time()
+UPLOAD_MODES = ["api", "direct", "batch"]
+
+
+async def send_upload(session, api_url, image_data, filename, content_type, operations, upload_mode="api",
+                      deadline=None):
+    """
+    Send one image; returns (HTTP status, response JSON or None)
     
-    try:
+    deadline (seconds) is sent as deadline_seconds: the API and workers
+    drop the job as "expired" if it has not started processing by then.
+    
+    api:    multipart POST /upload, the bytes pass through the API
+    direct: POST /uploads/initiate, PUT the bytes to the presigned storage
+            URL, POST the finalize URL; the API only sees control requests
+    batch:  multipart POST /upload/batch with one file; concurrent requests
+            share job envelopes inside the API's linger window
+    """
+    if upload_mode in ("api", "batch"):
         data = aiohttp.FormData()
-        data.add_field('file',
-                      image_data,
-                      filename=f'test_image_{image_id}.jpg',
-                      content_type='image/jpeg')
+        data.add_field('files' if upload_mode == "batch" else 'file', image_data,
+                       filename=filename, content_type=content_type)
         data.add_field('operations', operations)
+        if deadline:
+            data.add_field('deadline_seconds', str(deadline))
         
-        async with session.post(f"{api_url}/upload", data=data) as response:
-            if response.status == 200:
-                result = await response.json()
-                elapsed = time.time() - start_time
-                return {
-                    "success": True,
-                    "job_id": result.get("job_id"),
-                    "elapsed": elapsed,
-                    "image_id": image_id
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"HTTP {response.status}",
-                    "elapsed": time.time() - start_time,
-                    "image_id": image_id
-                }
+        path = "/upload/batch" if upload_mode == "batch" else "/upload"
+        async with session.post(f"{api_url}{path}", data=data) as response:
+            if response.status != 200:
+                return response.status, None
+            result = await response.json()
+        if upload_mode == "batch":
+            result = dict(result, job_id=result["jobs"][0]["job_id"])
+        return response.status, result
+    
+    initiate = {"filename": filename, "content_type": content_type, "operations": operations}
+    if deadline:
+        initiate["deadline_seconds"] = deadline
+    async with session.post(f"{api_url}/uploads/initiate", json=initiate) as response:
+        if response.status != 200:
+            return response.status, None
+        ticket = await response.json()
+    
+    # The URL is signed as is; do not let aiohttp re-quote it
+    async with session.put(URL(ticket["upload_url"], encoded=True), data=image_data,
+                           headers=ticket["headers"]) as response:
+        if response.status != 200:
+            return response.status, None
+    
+    async with session.post(f"{api_url}{ticket['finalize_url']}") as response:
+        return response.status, (await response.json() if response.status == 200 else None)
+
+
+async def upload_image(session, api_url, images, image_id, operations="resize,watermark",
+                       scheduled_time=None, upload_mode="api", deadline=None):
+    """
+    Upload a single image picked from `images` (ImageCorpus or SingleImage)
+    
+    In open-loop mode scheduled_time is the planned send time (event loop
+    clock) and latency is measured from it, so client-side queueing counts.
+    """
+    loop = asyncio.get_running_loop()
+    start_time = scheduled_time if scheduled_time is not None else loop.time()
+    # Wall-clock equivalent of start_time, comparable with worker timestamps
+    sent_at = time.time() - (loop.time() - start_time)
+    image_data, content_type, extension, corpus_id = images.pick(image_id)
+    
+    try:
+        status, result = await send_upload(session, api_url, image_data, f'test_image_{image_id}.{extension}',
+                                           content_type, operations, upload_mode, deadline)
+        if status == 200:
+            elapsed = loop.time() - start_time
+            return {
+                "success": True,
+                "job_id": result.get("job_id"),
+                "elapsed": elapsed,
+                "sent_at": sent_at,
+                "image_id": image_id,
+                "corpus_id": corpus_id
+            }
+        elif status == 429:
+            return {
+                "success": False,
+                "rejected": True,
+                "error": "HTTP 429",
+                "elapsed": loop.time() - start_time,
+                "sent_at": sent_at,
+                "image_id": image_id,
+                "corpus_id": corpus_id
+            }
+        else:
+            return {
+                "success": False,
+                "error": f"HTTP {status}",
+                "elapsed": loop.time() - start_time,
+                "sent_at": sent_at,
+                "image_id": image_id,
+                "corpus_id": corpus_id
+            }
     except Exception as e:
         return {
             "success": False,
             "error": str(e),
-            "elapsed": time.time() - start_time,
-            "image_id": image_id
+            "elapsed": loop.time() - start_time,
+            "sent_at": sent_at,
+            "image_id": image_id,
+            "corpus_id": corpus_id
         }
 
 
-async def bulk_upload(api_url, count, operations="resize,watermark", concurrency=10):
-    """Upload multiple images concurrently"""
+async def upload_many(session, api_url, images, count, operations="resize,watermark",
+                      mode="closed", concurrency=10, rate=10.0, arrival="constant", seed=None,
+                      on_result=None, upload_mode="api", deadline=None):
+    """
+    Upload `count` images in closed- or open-loop mode
+    
+    Returns the per-request results, or streams each one to on_result as it
+    completes (and returns None) so that huge runs never hold them all.
+    """
+    if mode == "open":
+        async def send(image_id, scheduled_time):
+            return await upload_image(session, api_url, images, image_id, operations,
+                                      scheduled_time=scheduled_time, upload_mode=upload_mode,
+                                      deadline=deadline)
+        
+        offsets = arrival_offsets(rate, count, arrival, seed)
+        return await run_open_loop(send, offsets, on_result)
+    
+    # A fixed set of `concurrency` senders pulling image ids, so memory does
+    # not grow with `count`
+    results = [] if on_result is None else None
+    image_ids = iter(range(count))
+    
+    async def sender():
+        for image_id in image_ids:
+            result = await upload_image(session, api_url, images, image_id, operations,
+                                        upload_mode=upload_mode, deadline=deadline)
+            if on_result is None:
+                results.append(result)
+            else:
+                on_result(result)
+    
+    await asyncio.gather(*[sender() for _ in range(concurrency)])
+    
+    if results is not None:
+        results.sort(key=lambda r: r["image_id"])
+    return results
+
+
+async def bulk_upload(api_url, count, operations="resize,watermark", concurrency=10,
+                      mode="closed", rate=10.0, arrival="constant", seed=None,
+                      track_completion=False, completion_timeout=300, corpus=None, upload_mode="api",
+                      client_id=None, deadline=None):
+    """
+    Upload multiple images
+    
+    closed: at most `concurrency` uploads in flight, next one starts when
+            a previous one finishes
+    open:   uploads are sent at `rate` per second with constant or Poisson
+            inter-arrival times regardless of how fast the API responds
+    
+    With track_completion, every accepted job is followed until its
+    completion event so end-to-end latency is reported next to upload latency.
+    
+    With corpus, images are sampled from a generated corpus directory instead
+    of sending the same synthetic image every time.
+    
+    upload_mode "direct" PUTs the bytes to presigned storage URLs instead of
+    posting them to the API, "batch" posts to /upload/batch (see send_upload).
+    
+    client_id is sent as X-Client-ID, the identity the API's per-client
+    quotas and fair scheduling use (default: this machine's address).
+    
+    deadline gives every job a deadline in seconds (see send_upload); with
+    track_completion expired jobs are counted as not completed.
+    """
     print(f"\nBulk Upload Test")
     print(f"=" * 60)
     print(f"API URL: {api_url}")
     print(f"Images to upload: {count}")
     print(f"Operations: {operations}")
-    print(f"Concurrency: {concurrency}")
+    print(f"Mode: {mode}")
+    print(f"Upload mode: {upload_mode}")
+    if client_id:
+        print(f"Client ID: {client_id}")
+    if deadline:
+        print(f"Job deadline: {deadline}s")
+    if mode == "open":
+        print(f"Target rate: {rate}/s ({arrival} arrivals)")
+    else:
+        print(f"Concurrency: {concurrency}")
     print(f"=" * 60)
     
-    # Create test image
-    print("\nCreating test image...")
-    image_data = await create_test_image()
-    print(f"Test image size: {len(image_data) / 1024:.2f} KB")
+    # Load corpus or create test image
+    if corpus:
+        images = ImageCorpus(corpus, seed)
+    else:
+        print("\nCreating test image...")
+        images = SingleImage(await create_test_image())
+    print(f"Images: {images.describe()}")
+    
+    # Subscribe before the first upload so no completion is missed
+    tracker = None
+    if track_completion:
+        tracker = CompletionTracker()
+        tracker.start()
     
     # Upload images
     print(f"\nUploading {count} images...")
+    results_file = results_path("bulk_upload")
+    recorder = ResultRecorder(results_file, track_jobs=track_completion)
     start_time = time.time()
     
-    results = []
+    # An open-loop run must not be throttled by the client's own pool
+    connector = aiohttp.TCPConnector(limit=0 if mode == "open" else 100)
     
-    async with aiohttp.ClientSession() as session:
-        # Create semaphore to limit concurrency
-        semaphore = asyncio.Semaphore(concurrency)
-        
-        async def upload_with_semaphore(image_id):
-            async with semaphore:
-                return await upload_image(session, api_url, image_data, image_id, operations)
-        
-        # Upload all images
-        tasks = [upload_with_semaphore(i) for i in range(count)]
-        results = await asyncio.gather(*tasks)
+    headers = {"X-Client-ID": client_id} if client_id else None
+    async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+        await upload_many(session, api_url, images, count, operations,
+                          mode, concurrency, rate, arrival, seed, on_result=recorder,
+                          upload_mode=upload_mode, deadline=deadline)
     
     total_time = time.time() - start_time
+    columns_meta = recorder.close()
     
-    # Analyze results
-    successful = [r for r in results if r["success"]]
-    failed = [r for r in results if not r["success"]]
-    
-    upload_times = [r["elapsed"] for r in results]
+    # Analyze results straight from the column files
+    columns = ColumnReader(Path(results_file).parent, columns_meta)
+    latency = latency_summary(columns["elapsed"])
+    histogram = recorder.histogram
     
     print(f"\n{'=' * 60}")
     print("Results:")
     print(f"{'=' * 60}")
     print(f"Total time: {total_time:.2f}s")
-    print(f"Successful uploads: {len(successful)}/{count}")
-    print(f"Failed uploads: {len(failed)}")
+    print(f"Successful uploads: {recorder.successful}/{count}")
+    print(f"Rejected uploads (429): {recorder.rejected}")
+    print(f"Failed uploads: {recorder.failed}")
     print(f"\nThroughput: {count / total_time:.2f} uploads/second")
     print(f"\nUpload Latency:")
-    print(f"  Mean: {statistics.mean(upload_times):.3f}s")
-    print(f"  Median: {statistics.median(upload_times):.3f}s")
-    print(f"  Min: {min(upload_times):.3f}s")
-    print(f"  Max: {max(upload_times):.3f}s")
+    print(f"  Mean: {latency['mean']:.3f}s")
+    print(f"  Median: {latency['median']:.3f}s")
+    print(f"  Min: {latency['min']:.3f}s")
+    print(f"  Max: {latency['max']:.3f}s")
+    
+    if count > 1:
+        print(f"  StdDev: {latency['stdev']:.3f}s")
+    
+    print_histogram_summary("Upload Latency Percentiles", histogram)
     
-    if len(upload_times) > 1:
-        print(f"  StdDev: {statistics.stdev(upload_times):.3f}s")
+    completion, completion_histograms = None, None
+    if tracker:
+        completion, completion_histograms = await collect_completions(
+            tracker, recorder.submitted, completion_timeout
+        )
+        print_completion_summary(completion, completion_histograms)
     
-    if failed:
+    if recorder.failures:
         print(f"\nFailed uploads:")
-        for f in failed[:10]:  # Show first 10 failures
+        for f in recorder.failures:  # Show first 10 failures
             print(f"  Image {f['image_id']}: {f['error']}")
     
-    # Save results to file
-    results_file = f"bulk_upload_results_{int(time.time())}.json"
+    # Save summary; per-request results are already on disk as columns
     with open(results_file, 'w') as f:
         json.dump({
             "config": {
                 "api_url": api_url,
                 "count": count,
                 "operations": operations,
-                "concurrency": concurrency
+                "concurrency": concurrency,
+                "mode": mode,
+                "rate": rate if mode == "open" else None,
+                "arrival": arrival if mode == "open" else None,
+                "corpus": str(corpus) if corpus else None,
+                "upload_mode": upload_mode,
+                "client_id": client_id,
+                "deadline": deadline
             },
             "summary": {
                 "total_time": total_time,
-                "successful": len(successful),
-                "failed": len(failed),
+                "successful": recorder.successful,
+                "rejected": recorder.rejected,
+                "failed": recorder.failed,
                 "throughput": count / total_time,
-                "latency": {
-                    "mean": statistics.mean(upload_times),
-                    "median": statistics.median(upload_times),
-                    "min": min(upload_times),
-                    "max": max(upload_times),
-                    "stdev": statistics.stdev(upload_times) if len(upload_times) > 1 else 0
-                }
+                "latency": latency,
+                "latency_percentiles": histogram.summary(),
+                "completion": completion
             },
-            "results": results
+            "latency_histogram": histogram.to_dict(),
+            "completion_histograms": completion_histograms,
+            "columns": columns_meta
         }, f, indent=2)
     
-    print(f"\nResults saved to: {results_file}")
+    print(f"\nResults saved to: {results_file} (+ {columns_meta['path']}/)")
     print(f"{'=' * 60}\n")
 
 
@@ -168,11 +339,35 @@ def main():
     parser.add_argument("--count", type=int, default=100, help="Number of images to upload")
     parser.add_argument("--api-url", default="http://localhost:8000", help="API URL")
     parser.add_argument("--operations", default="resize,watermark", help="Operations to perform")
-    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent uploads")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent uploads (closed mode)")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed",
+                        help="closed: fixed concurrency; open: fixed arrival rate")
+    parser.add_argument("--rate", type=float, default=10.0, help="Uploads per second (open mode)")
+    parser.add_argument("--arrival", choices=ARRIVAL_PROCESSES, default="constant",
+                        help="Inter-arrival distribution (open mode)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for Poisson arrivals")
+    parser.add_argument("--track-completion", action="store_true",
+                        help="Follow jobs to completion via the job_events exchange")
+    parser.add_argument("--completion-timeout", type=float, default=300,
+                        help="Seconds to wait for jobs after the last upload")
+    parser.add_argument("--corpus", default=None,
+                        help="Image corpus directory from test_images/generate_corpus.py")
+    parser.add_argument("--upload-mode", choices=UPLOAD_MODES, default="api",
+                        help="api: POST /upload; direct: presigned PUT to storage + finalize; "
+                             "batch: POST /upload/batch (job envelopes)")
+    parser.add_argument("--client-id", default=None,
+                        help="X-Client-ID for per-client quotas and fair scheduling")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="Per-job deadline in seconds; expired jobs are dropped, not processed")
     
     args = parser.parse_args()
+    if args.mode == "open" and args.rate <= 0:
+        parser.error("--rate must be greater than 0 in open mode")
     
-    asyncio.run(bulk_upload(args.api_url, args.count, args.operations, args.concurrency))
+    asyncio.run(bulk_upload(args.api_url, args.count, args.operations, args.concurrency,
+                            args.mode, args.rate, args.arrival, args.seed,
+                            args.track_completion, args.completion_timeout, args.corpus,
+                            args.upload_mode, args.client_id, args.deadline))
 
 
 if __name__ == "__main__":
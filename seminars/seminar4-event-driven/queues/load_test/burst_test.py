@@ -13,6 +13,15 @@ import aiohttp
 from PIL import Image
 import io
 
+from corpus import ImageCorpus, SingleImage
+from completion_tracker import CompletionTracker, collect_completions, print_completion_summary
+from histogram import print_histogram_summary
+from open_loop import arrival_offsets, run_open_loop
+from result_store import REQUEST_SCHEMA, ColumnReader, ResultRecorder, latency_summary, results_path
+
+
+BURST_SCHEMA = dict(REQUEST_SCHEMA, burst_id="<i4")
+
 
 async def create_test_image(width=1920, height=1080):
     """Create a test image"""
@@ -32,150 +41,221 @@ async def create_test_image(width=1920, height=1080):
     return img_bytes.getvalue()
 
 
-async def upload_image(session, api_url, image_data, burst_id, image_id):
-    """Upload a single image"""
-    start_time = time.time()
+async def upload_image(session, api_url, images, burst_id, image_id, burst_size, scheduled_time=None):
+    """Upload a single image; latency counts from scheduled_time when given"""
+    loop = asyncio.get_running_loop()
+    start_time = scheduled_time if scheduled_time is not None else loop.time()
+    # Wall-clock equivalent of start_time, comparable with worker timestamps
+    sent_at = time.time() - (loop.time() - start_time)
+    # Consecutive bursts continue through the corpus instead of repeating it
+    image_data, content_type, extension, corpus_id = images.pick(burst_id * burst_size + image_id)
     
     try:
         data = aiohttp.FormData()
         data.add_field('file',
                       image_data,
-                      filename=f'burst{burst_id}_image_{image_id}.jpg',
-                      content_type='image/jpeg')
+                      filename=f'burst{burst_id}_image_{image_id}.{extension}',
+                      content_type=content_type)
         data.add_field('operations', 'resize,watermark')
         
         async with session.post(f"{api_url}/upload", data=data) as response:
             if response.status == 200:
                 result = await response.json()
-                elapsed = time.time() - start_time
+                elapsed = loop.time() - start_time
                 return {
                     "success": True,
                     "job_id": result.get("job_id"),
                     "elapsed": elapsed,
+                    "sent_at": sent_at,
                     "burst_id": burst_id,
-                    "image_id": image_id
+                    "image_id": image_id,
+                    "corpus_id": corpus_id
+                }
+            elif response.status == 429:
+                # Admission control: the API shed this upload on purpose
+                return {
+                    "success": False,
+                    "rejected": True,
+                    "error": "HTTP 429",
+                    "retry_after": response.headers.get("Retry-After"),
+                    "elapsed": loop.time() - start_time,
+                    "sent_at": sent_at,
+                    "burst_id": burst_id,
+                    "image_id": image_id,
+                    "corpus_id": corpus_id
                 }
             else:
                 return {
                     "success": False,
                     "error": f"HTTP {response.status}",
-                    "elapsed": time.time() - start_time,
+                    "elapsed": loop.time() - start_time,
+                    "sent_at": sent_at,
                     "burst_id": burst_id,
-                    "image_id": image_id
+                    "image_id": image_id,
+                    "corpus_id": corpus_id
                 }
     except Exception as e:
         return {
             "success": False,
             "error": str(e),
-            "elapsed": time.time() - start_time,
+            "elapsed": loop.time() - start_time,
+            "sent_at": sent_at,
             "burst_id": burst_id,
-            "image_id": image_id
+            "image_id": image_id,
+            "corpus_id": corpus_id
         }
 
 
-async def send_burst(session, api_url, image_data, burst_id, burst_size):
+async def send_burst(session, api_url, images, burst_id, burst_size, scheduled_time=None):
     """Send a burst of uploads"""
     print(f"\n[Burst {burst_id}] Sending {burst_size} images...")
-    start_time = time.time()
+    loop = asyncio.get_running_loop()
+    start_time = scheduled_time if scheduled_time is not None else loop.time()
     
-    tasks = [upload_image(session, api_url, image_data, burst_id, i) for i in range(burst_size)]
+    tasks = [upload_image(session, api_url, images, burst_id, i, burst_size, start_time)
+             for i in range(burst_size)]
     results = await asyncio.gather(*tasks)
     
-    elapsed = time.time() - start_time
+    elapsed = loop.time() - start_time
     successful = sum(1 for r in results if r["success"])
+    rejected = sum(1 for r in results if r.get("rejected"))
     
-    print(f"[Burst {burst_id}] Completed in {elapsed:.2f}s - {successful}/{burst_size} successful")
+    print(f"[Burst {burst_id}] Completed in {elapsed:.2f}s - {successful}/{burst_size} successful, "
+          f"{rejected} rejected")
     
-    return results
+    return results, elapsed
 
 
-async def burst_test(api_url, burst_size, burst_count, interval):
-    """Run burst test"""
+async def burst_test(api_url, burst_size, burst_count, interval, open_loop=False,
+                     track_completion=False, completion_timeout=300, corpus=None, seed=None):
+    """
+    Run burst test
+    
+    By default the next burst waits for the previous one to finish plus
+    `interval`. With open_loop, burst k starts at k * interval no matter
+    whether earlier bursts have completed.
+    
+    With track_completion, accepted jobs are followed until they complete.
+    
+    With corpus, images are sampled from a generated corpus directory.
+    """
     print(f"\nBurst Load Test")
     print(f"=" * 60)
     print(f"API URL: {api_url}")
     print(f"Burst size: {burst_size} images")
     print(f"Number of bursts: {burst_count}")
     print(f"Interval between bursts: {interval}s")
+    print(f"Schedule: {'open-loop' if open_loop else 'closed-loop'}")
     print(f"=" * 60)
     
-    # Create test image
-    print("\nCreating test image...")
-    image_data = await create_test_image()
-    print(f"Test image size: {len(image_data) / 1024:.2f} KB")
+    # Load corpus or create test image
+    if corpus:
+        images = ImageCorpus(corpus, seed)
+    else:
+        print("\nCreating test image...")
+        images = SingleImage(await create_test_image())
+    print(f"Images: {images.describe()}")
     
-    all_results = []
+    results_file = results_path("burst_test")
+    recorder = ResultRecorder(results_file, BURST_SCHEMA, track_jobs=track_completion)
     burst_timings = []
     
-    async with aiohttp.ClientSession() as session:
-        for burst_id in range(burst_count):
-            burst_start = time.time()
-            
-            # Send burst
-            results = await send_burst(session, api_url, image_data, burst_id, burst_size)
-            all_results.extend(results)
-            
-            burst_time = time.time() - burst_start
-            burst_timings.append(burst_time)
+    # Subscribe before the first upload so no completion is missed
+    tracker = None
+    if track_completion:
+        tracker = CompletionTracker()
+        tracker.start()
+    
+    connector = aiohttp.TCPConnector(limit=0 if open_loop else 100)
+    
+    def record_burst(burst):
+        results, burst_time = burst
+        for r in results:
+            recorder(r)
+        burst_timings.append(burst_time)
+    
+    async with aiohttp.ClientSession(connector=connector) as session:
+        if open_loop:
+            async def send(burst_id, scheduled_time):
+                return await send_burst(session, api_url, images, burst_id, burst_size,
+                                        scheduled_time)
             
-            # Wait before next burst (except for last one)
-            if burst_id < burst_count - 1:
-                print(f"Waiting {interval}s before next burst...")
-                await asyncio.sleep(interval)
+            offsets = arrival_offsets(1.0 / interval, burst_count)
+            await run_open_loop(send, offsets, on_result=record_burst)
+        else:
+            for burst_id in range(burst_count):
+                # Send burst
+                record_burst(await send_burst(session, api_url, images, burst_id, burst_size))
+                
+                # Wait before next burst (except for last one)
+                if burst_id < burst_count - 1:
+                    print(f"Waiting {interval}s before next burst...")
+                    await asyncio.sleep(interval)
     
-    # Analyze results
-    successful = [r for r in all_results if r["success"]]
-    failed = [r for r in all_results if not r["success"]]
+    columns_meta = recorder.close()
     
-    upload_times = [r["elapsed"] for r in all_results]
+    # Analyze results straight from the column files
+    columns = ColumnReader(Path(results_file).parent, columns_meta)
+    latency = latency_summary(columns["elapsed"])
+    histogram = recorder.histogram
     
     print(f"\n{'=' * 60}")
     print("Overall Results:")
     print(f"{'=' * 60}")
     print(f"Total bursts: {burst_count}")
-    print(f"Total images: {len(all_results)}")
-    print(f"Successful uploads: {len(successful)}")
-    print(f"Failed uploads: {len(failed)}")
+    print(f"Total images: {recorder.total}")
+    print(f"Successful uploads: {recorder.successful}")
+    print(f"Rejected uploads (429): {recorder.rejected}")
+    print(f"Failed uploads: {recorder.failed}")
     print(f"\nBurst Timing:")
     print(f"  Mean burst time: {statistics.mean(burst_timings):.2f}s")
     print(f"  Min burst time: {min(burst_timings):.2f}s")
     print(f"  Max burst time: {max(burst_timings):.2f}s")
     print(f"\nUpload Latency:")
-    print(f"  Mean: {statistics.mean(upload_times):.3f}s")
-    print(f"  Median: {statistics.median(upload_times):.3f}s")
-    print(f"  Min: {min(upload_times):.3f}s")
-    print(f"  Max: {max(upload_times):.3f}s")
+    print(f"  Mean: {latency['mean']:.3f}s")
+    print(f"  Median: {latency['median']:.3f}s")
+    print(f"  Min: {latency['min']:.3f}s")
+    print(f"  Max: {latency['max']:.3f}s")
+    
+    if recorder.total > 1:
+        print(f"  StdDev: {latency['stdev']:.3f}s")
     
-    if len(upload_times) > 1:
-        print(f"  StdDev: {statistics.stdev(upload_times):.3f}s")
+    print_histogram_summary("Upload Latency Percentiles", histogram)
     
-    # Save results
-    results_file = f"burst_test_results_{int(time.time())}.json"
+    completion, completion_histograms = None, None
+    if tracker:
+        completion, completion_histograms = await collect_completions(
+            tracker, recorder.submitted, completion_timeout
+        )
+        print_completion_summary(completion, completion_histograms)
+    
+    # Save summary; per-request results are already on disk as columns
     with open(results_file, 'w') as f:
         json.dump({
             "config": {
                 "api_url": api_url,
                 "burst_size": burst_size,
                 "burst_count": burst_count,
-                "interval": interval
+                "interval": interval,
+                "open_loop": open_loop,
+                "corpus": str(corpus) if corpus else None
             },
             "summary": {
-                "total_images": len(all_results),
-                "successful": len(successful),
-                "failed": len(failed),
+                "total_images": recorder.total,
+                "successful": recorder.successful,
+                "rejected": recorder.rejected,
+                "failed": recorder.failed,
                 "burst_timings": burst_timings,
-                "latency": {
-                    "mean": statistics.mean(upload_times),
-                    "median": statistics.median(upload_times),
-                    "min": min(upload_times),
-                    "max": max(upload_times),
-                    "stdev": statistics.stdev(upload_times) if len(upload_times) > 1 else 0
-                }
+                "latency": latency,
+                "latency_percentiles": histogram.summary(),
+                "completion": completion
             },
-            "results": all_results
+            "latency_histogram": histogram.to_dict(),
+            "completion_histograms": completion_histograms,
+            "columns": columns_meta
         }, f, indent=2)
     
-    print(f"\nResults saved to: {results_file}")
+    print(f"\nResults saved to: {results_file} (+ {columns_meta['path']}/)")
     print(f"{'=' * 60}\n")
 
 
@@ -183,12 +263,26 @@ def main():
     parser = argparse.ArgumentParser(description="Burst load test")
     parser.add_argument("--burst-size", type=int, default=50, help="Images per burst")
     parser.add_argument("--burst-count", type=int, default=3, help="Number of bursts")
-    parser.add_argument("--interval", type=int, default=5, help="Seconds between bursts")
+    parser.add_argument("--interval", type=float, default=5,
+                        help="Seconds between bursts (> 0 with --open-loop)")
     parser.add_argument("--api-url", default="http://localhost:8000", help="API URL")
+    parser.add_argument("--open-loop", action="store_true",
+                        help="Start bursts on a fixed schedule instead of after the previous one")
+    parser.add_argument("--track-completion", action="store_true",
+                        help="Follow jobs to completion via the job_events exchange")
+    parser.add_argument("--completion-timeout", type=float, default=300,
+                        help="Seconds to wait for jobs after the last upload")
+    parser.add_argument("--corpus", default=None,
+                        help="Image corpus directory from test_images/generate_corpus.py")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for corpus sampling")
     
     args = parser.parse_args()
+    if args.open_loop and args.interval <= 0:
+        parser.error("--interval must be greater than 0 with --open-loop")
     
-    asyncio.run(burst_test(args.api_url, args.burst_size, args.burst_count, args.interval))
+    asyncio.run(burst_test(args.api_url, args.burst_size, args.burst_count, args.interval,
+                           args.open_loop, args.track_completion, args.completion_timeout,
+                           args.corpus, args.seed))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Capacity Search - Find the highest sustainable upload rate
+
+Runs open-loop load steps at increasing offered rates until the p99 latency
+SLO or the error-rate threshold breaks:
+
+  step:   start, start + step, start + 2*step, ... until a step fails
+  binary: double the rate until a step fails, then bisect between the last
+          passing and the first failing rate
+
+The report (capacity_search_results_<ts>-<pid>.json) holds every step's curve
+point, the sustainable rate and the knee, and can be plotted and compared
+across worker counts with analyze_results.py --type capacity.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from bulk_upload import create_test_image, upload_many
+from corpus import ImageCorpus, SingleImage
+from completion_tracker import CompletionTracker, collect_completions, submitted_jobs
+from histogram import LatencyHistogram
+from open_loop import ARRIVAL_PROCESSES
+from result_store import results_path
+
+
+async def run_step(session, api_url, images, rate, duration, operations, arrival, seed,
+                   tracker, completion_timeout):
+    """Run one open-loop step and return its curve point"""
+    count = max(int(rate * duration), 1)
+    start_time = time.time()
+    results = await upload_many(session, api_url, images, count, operations,
+                                mode="open", rate=rate, arrival=arrival, seed=seed)
+    total_time = time.time() - start_time
+
+    histogram = LatencyHistogram()
+    for r in results:
+        histogram.record(r["elapsed"])
+
+    successful = sum(1 for r in results if r["success"])
+    rejected = sum(1 for r in results if r.get("rejected"))
+    failed = count - successful - rejected
+
+    point = {
+        "offered_rate": rate,
+        "requests": count,
+        "duration": total_time,
+        "successful": successful,
+        "rejected": rejected,
+        "failed": failed,
+        "error_rate": (rejected + failed) / count,
+        "throughput": successful / total_time,
+        "upload_latency": histogram.summary(),
+        "completion": None,
+    }
+
+    if tracker:
+        completion, _ = await collect_completions(tracker, submitted_jobs(results),
+                                                  completion_timeout, stop=False)
+        point["completion"] = completion
+
+    return point
+
+
+def step_latency(point, slo_metric):
+    """p99 of the SLO metric for a step, or None if nothing was measured"""
+    if slo_metric == "end_to_end":
+        stats = (point["completion"] or {}).get("end_to_end", {})
+    else:
+        stats = point["upload_latency"]
+    return stats.get("p99")
+
+
+def evaluate(point, args):
+    """Mark the step as passing or failing and record why"""
+    p99 = step_latency(point, args.slo_metric)
+    reasons = []
+
+    if p99 is None or p99 > args.slo_p99:
+        reasons.append("p99_slo")
+    if point["error_rate"] > args.max_error_rate:
+        reasons.append("error_rate")
+    if args.slo_metric == "end_to_end" and point["completion"]["pending"]:
+        reasons.append("incomplete_jobs")
+
+    point["p99"] = p99
+    point["passed"] = not reasons
+    point["failure_reasons"] = reasons
+    return point["passed"]
+
+
+def find_knee(steps):
+    """
+    Knee of the throughput/latency curve
+
+    Uses the step with the highest "power" (throughput / p99 latency): past
+    it, extra offered load buys less throughput than it costs in latency.
+    """
+    candidates = [s for s in steps if s["p99"] and s["throughput"] > 0]
+    if not candidates:
+        return None
+
+    knee = max(candidates, key=lambda s: s["throughput"] / s["p99"])
+    return {
+        "offered_rate": knee["offered_rate"],
+        "throughput": knee["throughput"],
+        "p99": knee["p99"],
+    }
+
+
+async def capacity_search(args):
+    """Drive the search and write the capacity report"""
+    print(f"\nCapacity Search")
+    print(f"=" * 60)
+    print(f"API URL: {args.api_url}")
+    print(f"Strategy: {args.strategy}")
+    print(f"SLO: p99 {args.slo_metric} latency <= {args.slo_p99}s, "
+          f"error rate <= {args.max_error_rate:.1%}")
+    print(f"Step duration: {args.step_duration}s")
+    if args.workers is not None:
+        print(f"Workers: {args.workers}")
+    print(f"=" * 60)
+
+    if args.corpus:
+        images = ImageCorpus(args.corpus, args.seed)
+    else:
+        images = SingleImage(await create_test_image())
+    print(f"Images: {images.describe()}")
+
+    tracker = None
+    if args.slo_metric == "end_to_end":
+        tracker = CompletionTracker()
+        tracker.start()
+
+    steps = []
+
+    async def probe(rate):
+        print(f"\n[Step {len(steps) + 1}] Offering {rate:.2f} uploads/s...")
+        point = await run_step(session, args.api_url, images, rate, args.step_duration,
+                               args.operations, args.arrival, args.seed, tracker,
+                               args.completion_timeout)
+        passed = evaluate(point, args)
+        steps.append(point)
+
+        p99 = f"{point['p99']:.3f}s" if point["p99"] is not None else "n/a"
+        verdict = "PASS" if passed else f"FAIL ({', '.join(point['failure_reasons'])})"
+        print(f"[Step {len(steps)}] throughput {point['throughput']:.2f}/s, p99 {p99}, "
+              f"errors {point['error_rate']:.1%} -> {verdict}")
+
+        # Let the backlog of this step drain before measuring the next one
+        if args.step_pause:
+            await asyncio.sleep(args.step_pause)
+        return passed
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        last_pass, first_fail = None, None
+        rate = args.start_rate
+
+        # Phase 1: find a failing rate
+        while rate <= args.max_rate:
+            if await probe(rate):
+                last_pass = rate
+                if rate >= args.max_rate:
+                    break
+                # The last increase lands on max_rate, so it is always probed
+                rate = min(rate * 2 if args.strategy == "binary" else rate + args.step, args.max_rate)
+            else:
+                first_fail = rate
+                break
+
+        # Phase 2 (binary): bisect between the last passing and first failing rate
+        if args.strategy == "binary" and first_fail is not None:
+            low = last_pass or 0.0
+            high = first_fail
+            while high - low > args.resolution:
+                middle = (low + high) / 2
+                if middle <= 0:
+                    break
+                if await probe(middle):
+                    low, last_pass = middle, middle
+                else:
+                    high = middle
+
+    if tracker:
+        tracker.stop()
+
+    steps.sort(key=lambda s: s["offered_rate"])
+    passing = [s for s in steps if s["passed"]]
+    best = max(passing, key=lambda s: s["offered_rate"]) if passing else None
+
+    report = {
+        "config": {
+            "api_url": args.api_url,
+            "strategy": args.strategy,
+            "start_rate": args.start_rate,
+            "step": args.step,
+            "max_rate": args.max_rate,
+            "resolution": args.resolution,
+            "step_duration": args.step_duration,
+            "operations": args.operations,
+            "arrival": args.arrival,
+            "slo_metric": args.slo_metric,
+            "slo_p99": args.slo_p99,
+            "max_error_rate": args.max_error_rate,
+            "workers": args.workers,
+            "corpus": args.corpus
+        },
+        "summary": {
+            "sustainable_rate": best["offered_rate"] if best else None,
+            "sustainable_throughput": best["throughput"] if best else None,
+            "sustainable_p99": best["p99"] if best else None,
+            "breaking_rate": first_fail,
+            "knee": find_knee(steps),
+            "steps": len(steps)
+        },
+        "steps": steps
+    }
+
+    print(f"\n{'=' * 60}")
+    print("Capacity:")
+    print(f"{'=' * 60}")
+    if best:
+        print(f"Sustainable rate: {best['offered_rate']:.2f} uploads/s "
+              f"(throughput {best['throughput']:.2f}/s, p99 {best['p99']:.3f}s)")
+    else:
+        print("No step met the SLO")
+    if first_fail is not None:
+        print(f"SLO breaks at: {first_fail:.2f} uploads/s")
+    knee = report["summary"]["knee"]
+    if knee:
+        print(f"Knee: {knee['offered_rate']:.2f} uploads/s "
+              f"(throughput {knee['throughput']:.2f}/s, p99 {knee['p99']:.3f}s)")
+
+    results_file = results_path("capacity_search")
+    with open(results_file, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\nResults saved to: {results_file}")
+    print(f"{'=' * 60}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search for the pipeline's sustainable throughput")
+    parser.add_argument("--api-url", default="http://localhost:8000", help="API URL")
+    parser.add_argument("--strategy", choices=["step", "binary"], default="binary")
+    parser.add_argument("--start-rate", type=float, default=2.0, help="First offered rate (uploads/s)")
+    parser.add_argument("--step", type=float, default=2.0, help="Rate increment (step strategy)")
+    parser.add_argument("--max-rate", type=float, default=500.0, help="Never offer more than this")
+    parser.add_argument("--resolution", type=float, default=1.0,
+                        help="Stop bisecting when the bracket is this narrow (uploads/s)")
+    parser.add_argument("--step-duration", type=float, default=30.0, help="Seconds of load per step")
+    parser.add_argument("--step-pause", type=float, default=10.0, help="Seconds to rest between steps")
+    parser.add_argument("--operations", default="resize,watermark", help="Operations to perform")
+    parser.add_argument("--arrival", choices=ARRIVAL_PROCESSES, default="poisson")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for Poisson arrivals")
+    parser.add_argument("--slo-metric", choices=["upload", "end_to_end"], default="upload",
+                        help="Latency the p99 SLO applies to")
+    parser.add_argument("--slo-p99", type=float, default=1.0, help="p99 latency SLO in seconds")
+    parser.add_argument("--max-error-rate", type=float, default=0.01,
+                        help="Highest acceptable share of failed or rejected uploads")
+    parser.add_argument("--completion-timeout", type=float, default=120,
+                        help="Seconds to wait for a step's jobs (end_to_end SLO)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker count under test, recorded for comparisons")
+    parser.add_argument("--corpus", default=None,
+                        help="Image corpus directory from test_images/generate_corpus.py")
+
+    args = parser.parse_args()
+    for name in ("start_rate", "step", "resolution"):
+        if getattr(args, name) <= 0:
+            parser.error(f"--{name.replace('_', '-')} must be greater than 0")
+    if args.max_rate < args.start_rate:
+        parser.error("--max-rate must not be below --start-rate")
+
+    asyncio.run(capacity_search(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Track uploaded jobs to completion
+
+Upload latency only covers ingestion. Users wait for the processed image,
+so the tracker listens to the `job_events` fanout exchange (the one the
+notification service's queue is bound to) through its own exclusive queue
+and records when each job completed. That costs one AMQP connection
+instead of a /status poll per job, and never steals notifications from
+the notification service.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+
+import pika
+
+from histogram import LatencyHistogram, print_histogram_summary
+
+
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "localhost")
+RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", "5672"))
+RABBITMQ_USER = os.getenv("RABBITMQ_USER", "guest")
+RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "guest")
+
+JOB_EVENTS_EXCHANGE = "job_events"
+
+
+class CompletionTracker:
+    """Collect job events in a background thread"""
+
+    def __init__(self, host=RABBITMQ_HOST, port=RABBITMQ_PORT,
+                 user=RABBITMQ_USER, password=RABBITMQ_PASS):
+        self.parameters = pika.ConnectionParameters(
+            host=host,
+            port=port,
+            credentials=pika.PlainCredentials(user, password)
+        )
+        self.events = {}
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.stopping = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self, timeout=10):
+        """Start consuming; returns once the observer queue is bound"""
+        self.thread.start()
+        if not self.ready.wait(timeout) or self.error:
+            raise RuntimeError(f"Could not subscribe to job events: {self.error}")
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join(timeout=5)
+
+    def _on_event(self, ch, method, properties, body):
+        received_at = time.time()
+        try:
+            event = json.loads(body)
+        except ValueError:
+            return
+        event["received_at"] = received_at
+        with self.lock:
+            self.events.setdefault(event.get("job_id"), event)
+
+    def _run(self):
+        try:
+            connection = pika.BlockingConnection(self.parameters)
+            channel = connection.channel()
+            channel.exchange_declare(exchange=JOB_EVENTS_EXCHANGE, exchange_type='fanout', durable=True)
+            result = channel.queue_declare(queue='', exclusive=True, auto_delete=True)
+            channel.queue_bind(queue=result.method.queue, exchange=JOB_EVENTS_EXCHANGE)
+            channel.basic_consume(queue=result.method.queue, on_message_callback=self._on_event,
+                                  auto_ack=True)
+        except Exception as e:
+            self.error = e
+            self.ready.set()
+            return
+
+        self.ready.set()
+        try:
+            while not self.stopping.is_set():
+                connection.process_data_events(time_limit=0.2)
+        finally:
+            connection.close()
+
+    def wait_for(self, job_ids, timeout):
+        """Block until every job has an event or the timeout expires"""
+        deadline = time.time() + timeout
+        pending = set(job_ids)
+
+        while pending and time.time() < deadline:
+            with self.lock:
+                pending = {job_id for job_id in pending if job_id not in self.events}
+            if pending:
+                time.sleep(0.2)
+
+        return pending
+
+    def summarize(self, submitted):
+        """
+        Build completion statistics for the jobs of this run
+
+        submitted maps job_id -> wall-clock time the upload was (scheduled
+        to be) sent. Returns (summary, histograms).
+        """
+        end_to_end = LatencyHistogram()
+        queue_wait = LatencyHistogram()
+        processing = LatencyHistogram()
+        completed = 0
+        failed = 0
+        # Dropped unprocessed by the API or a worker, not failures
+        skipped = {"expired": 0, "cancelled": 0}
+        last_completion = None
+
+        with self.lock:
+            events = {job_id: self.events.get(job_id) for job_id in submitted}
+
+        for job_id, sent_at in submitted.items():
+            event = events[job_id]
+            if event is None:
+                continue
+            if event.get("status") in skipped:
+                skipped[event["status"]] += 1
+                continue
+            if event.get("status") != "completed":
+                failed += 1
+                continue
+
+            completed += 1
+            end_to_end.record(event["received_at"] - sent_at)
+            if event.get("started_at") and event.get("enqueued_at"):
+                queue_wait.record(max(event["started_at"] - event["enqueued_at"], 0))
+            if event.get("processing_time") is not None:
+                processing.record(event["processing_time"])
+            last_completion = max(last_completion or 0, event["received_at"])
+
+        first_sent = min(submitted.values()) if submitted else None
+        throughput = 0.0
+        if completed and last_completion > first_sent:
+            throughput = completed / (last_completion - first_sent)
+
+        summary = {
+            "tracked": len(submitted),
+            "completed": completed,
+            "failed": failed,
+            "expired": skipped["expired"],
+            "cancelled": skipped["cancelled"],
+            "pending": len(submitted) - completed - failed - sum(skipped.values()),
+            "completed_per_second": throughput,
+            "end_to_end": end_to_end.summary(),
+            "queue_wait": queue_wait.summary(),
+            "processing": processing.summary(),
+        }
+        histograms = {
+            "end_to_end": end_to_end.to_dict(),
+            "queue_wait": queue_wait.to_dict(),
+            "processing": processing.to_dict(),
+        }
+        return summary, histograms
+
+
+def submitted_jobs(results):
+    """job_id -> sent_at for the accepted uploads in a list of results"""
+    return {r["job_id"]: r["sent_at"] for r in results if r["success"]}
+
+
+async def collect_completions(tracker, submitted, timeout, stop=True):
+    """Wait for the submitted jobs (job_id -> sent_at) of a run and summarize them"""
+
+    print(f"\nWaiting up to {timeout}s for {len(submitted)} jobs to complete...")
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, tracker.wait_for, list(submitted), timeout)
+    if stop:
+        tracker.stop()
+
+    return tracker.summarize(submitted)
+
+
+def print_completion_summary(summary, histograms):
+    """Pretty print completion statistics"""
+    print(f"\nJob Completion:")
+    print(f"  Completed: {summary['completed']}/{summary['tracked']}")
+    print(f"  Failed: {summary['failed']}")
+    if summary.get("expired") or summary.get("cancelled"):
+        print(f"  Expired / cancelled: {summary['expired']} / {summary['cancelled']}")
+    print(f"  Still pending: {summary['pending']}")
+    print(f"  Throughput: {summary['completed_per_second']:.2f} completed jobs/second")
+
+    for name, title in [("end_to_end", "End-to-End Latency"),
+                        ("queue_wait", "Queue Wait"),
+                        ("processing", "Processing Time")]:
+        print_histogram_summary(title, LatencyHistogram.from_dict(histograms[name]))
@@ -0,0 +1,78 @@
+"""
+Image sources for load tests
+
+ImageCorpus serves images from a corpus built by
+test_images/generate_corpus.py. The pack file is memory-mapped and every
+upload gets a zero-copy slice of it, so a corpus of any size costs no
+Python heap and repeated runs read it from the page cache. SingleImage
+keeps the old behaviour of sending one in-memory image for every upload.
+"""
+import json
+import mmap
+from pathlib import Path
+
+import numpy as np
+
+
+PACK_FILE = "images.pack"
+INDEX_FILE = "index.json"
+
+EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+}
+
+
+class SingleImage:
+    """Every upload sends the same image"""
+
+    def __init__(self, data, content_type="image/jpeg"):
+        self.data = data
+        self.content_type = content_type
+
+    def pick(self, image_id):
+        """Return (data, content_type, extension, corpus_id) for an upload"""
+        return self.data, self.content_type, EXTENSIONS[self.content_type], -1
+
+    def describe(self):
+        return f"single image, {len(self.data) / 1024:.2f} KB"
+
+
+class ImageCorpus:
+    """
+    Memory-mapped image corpus
+
+    Uploads walk a seeded permutation of the corpus, so each image is sent
+    equally often, the mix follows the distributions the corpus was
+    generated with, and two runs with the same seed send the same sequence.
+    """
+
+    def __init__(self, directory, seed=None):
+        directory = Path(directory)
+        with open(directory / INDEX_FILE) as f:
+            self.index = json.load(f)
+        if not self.index:
+            raise ValueError(f"Empty corpus: {directory}")
+
+        with open(directory / PACK_FILE, "rb") as f:
+            self.pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.pack)
+        self.order = np.random.default_rng(seed).permutation(len(self.index))
+
+    def pick(self, image_id):
+        """Return (data, content_type, extension, corpus_id) for an upload"""
+        corpus_id = int(self.order[image_id % len(self.order)])
+        entry = self.index[corpus_id]
+        data = self.view[entry["offset"]:entry["offset"] + entry["length"]]
+        return data, entry["content_type"], EXTENSIONS[entry["content_type"]], corpus_id
+
+    def describe(self):
+        total = sum(entry["length"] for entry in self.index)
+        formats = {}
+        for entry in self.index:
+            formats[entry["format"]] = formats.get(entry["format"], 0) + 1
+        mix = ", ".join(f"{name} {count}" for name, count in sorted(formats.items()))
+        return (f"corpus of {len(self.index)} images, {total / 1024 / 1024:.1f} MB "
+                f"(mean {total / len(self.index) / 1024:.1f} KB; {mix})")
+
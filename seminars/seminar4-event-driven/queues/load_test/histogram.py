@@ -0,0 +1,128 @@
+"""
+HDR-style latency histogram
+
+Values are recorded in microseconds into log-linear buckets: exact below
+2**precision_bits, and with a relative error of at most 2**-(precision_bits-1)
+above that (precision_bits=8 keeps every bucket within 0.8%). Memory depends on
+the value range, not on the number of samples, so a run can record millions
+of latencies and still report accurate tail percentiles.
+"""
+import math
+
+
+REPORT_PERCENTILES = [50, 90, 99, 99.9]
+
+
+def _label(percentile):
+    return "p" + f"{percentile:g}".replace(".", "")
+
+
+class LatencyHistogram:
+    """Log-linear bucketed histogram of latencies given in seconds"""
+
+    def __init__(self, precision_bits=8):
+        self.precision_bits = precision_bits
+        self.linear_limit = 1 << precision_bits
+        self.half = 1 << (precision_bits - 1)
+        self.counts = {}
+        self.total = 0
+        self.sum_us = 0
+        self.min_us = None
+        self.max_us = None
+
+    def _index(self, value_us):
+        if value_us < self.linear_limit:
+            return value_us
+        exponent = value_us.bit_length() - self.precision_bits
+        sub_bucket = value_us >> exponent
+        return self.linear_limit + (exponent - 1) * self.half + (sub_bucket - self.half)
+
+    def _bucket_bounds(self, index):
+        """Lowest and highest microsecond value mapped to a bucket"""
+        if index < self.linear_limit:
+            return index, index
+        offset = index - self.linear_limit
+        exponent = offset // self.half + 1
+        sub_bucket = offset % self.half + self.half
+        return sub_bucket << exponent, ((sub_bucket + 1) << exponent) - 1
+
+    def record(self, seconds, count=1):
+        value_us = max(int(round(seconds * 1_000_000)), 0)
+        index = self._index(value_us)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total += count
+        self.sum_us += value_us * count
+        self.min_us = value_us if self.min_us is None else min(self.min_us, value_us)
+        self.max_us = value_us if self.max_us is None else max(self.max_us, value_us)
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum_us += other.sum_us
+        if other.total:
+            self.min_us = other.min_us if self.min_us is None else min(self.min_us, other.min_us)
+            self.max_us = other.max_us if self.max_us is None else max(self.max_us, other.max_us)
+
+    def percentile(self, percentile):
+        """Value in seconds at or below which `percentile` percent of samples fall"""
+        if not self.total:
+            return None
+
+        rank = max(math.ceil(self.total * percentile / 100), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                _, upper = self._bucket_bounds(index)
+                # Never report beyond what was actually observed
+                return min(upper, self.max_us) / 1_000_000
+
+        return self.max_us / 1_000_000
+
+    def summary(self):
+        """Percentiles and basic stats, all in seconds"""
+        if not self.total:
+            return {"count": 0}
+
+        result = {
+            "count": self.total,
+            "mean": self.sum_us / self.total / 1_000_000,
+            "min": self.min_us / 1_000_000,
+            "max": self.max_us / 1_000_000,
+        }
+        for percentile in REPORT_PERCENTILES:
+            result[_label(percentile)] = self.percentile(percentile)
+        return result
+
+    def to_dict(self):
+        return {
+            "precision_bits": self.precision_bits,
+            "counts": {str(index): count for index, count in sorted(self.counts.items())},
+            "total": self.total,
+            "sum_us": self.sum_us,
+            "min_us": self.min_us,
+            "max_us": self.max_us,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(precision_bits=data["precision_bits"])
+        histogram.counts = {int(index): count for index, count in data["counts"].items()}
+        histogram.total = data["total"]
+        histogram.sum_us = data["sum_us"]
+        histogram.min_us = data["min_us"]
+        histogram.max_us = data["max_us"]
+        return histogram
+
+
+def print_histogram_summary(title, histogram):
+    """Pretty print percentiles in the load tests' output format"""
+    summary = histogram.summary()
+    print(f"\n{title}:")
+    if not summary["count"]:
+        print("  (no samples)")
+        return
+    for percentile in REPORT_PERCENTILES:
+        print(f"  p{percentile:g}: {summary[_label(percentile)]:.3f}s")
+    print(f"  Max: {summary['max']:.3f}s")
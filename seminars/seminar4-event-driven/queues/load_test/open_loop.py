@@ -0,0 +1,71 @@
+"""
+Open-loop request scheduling
+
+Closed-loop generators wait for a response before sending the next request,
+so when the system slows down they quietly send less and the slowdown never
+shows up in the latency numbers (coordinated omission). Here every request
+has a scheduled send time fixed up front by the arrival process, requests
+are fired at that time no matter how many are still in flight, and latency
+is measured from the scheduled time rather than from the actual send.
+"""
+import asyncio
+import random
+
+
+ARRIVAL_PROCESSES = ["constant", "poisson"]
+
+
+def arrival_offsets(rate, count, arrival="constant", seed=None):
+    """Yield `count` send offsets in seconds from the start of the run"""
+    if rate <= 0:
+        raise ValueError("rate must be positive")
+    if arrival not in ARRIVAL_PROCESSES:
+        raise ValueError(f"Unknown arrival process: {arrival}")
+
+    rng = random.Random(seed)
+    offset = 0.0
+
+    for _ in range(count):
+        yield offset
+        if arrival == "constant":
+            offset += 1.0 / rate
+        else:
+            # Exponential inter-arrival times give a Poisson process
+            offset += rng.expovariate(rate)
+
+
+async def run_open_loop(send, offsets, on_result=None):
+    """
+    Fire send(index, scheduled_time) at each offset without waiting for replies
+
+    scheduled_time is on the event loop clock (loop.time()); send is expected
+    to measure latency against it. Returns results in schedule order, or,
+    when on_result is given, hands each result to it as soon as it completes
+    and keeps only the in-flight requests in memory.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    tasks = []
+    in_flight = set()
+
+    def finished(task):
+        in_flight.discard(task)
+        on_result(task.result())
+
+    for index, offset in enumerate(offsets):
+        scheduled_time = start + offset
+        delay = scheduled_time - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(send(index, scheduled_time))
+        if on_result is None:
+            tasks.append(task)
+        else:
+            in_flight.add(task)
+            task.add_done_callback(finished)
+
+    if on_result is None:
+        return await asyncio.gather(*tasks)
+
+    while in_flight:
+        await asyncio.wait(set(in_flight))
@@ -0,0 +1,213 @@
+"""
+Streaming, column-oriented storage for per-request load test results
+
+Long runs produce millions of result rows. Instead of keeping them in a
+Python list and dumping one huge JSON document at the end, rows are
+appended to one raw binary file per column while the run is in progress:
+
+    bulk_upload_results_<ts>-<pid>.json    summary + column metadata
+    bulk_upload_results_<ts>-<pid>.columns/
+        elapsed.f8  success.u1  ...        fixed-width little-endian arrays
+        errors.ndjson                      error messages of failed rows only
+
+The pid keeps runs started in the same second (parallel generators,
+back-to-back steps) apart; the columns are created exclusively, so a
+clash fails instead of mixing two runs' rows.
+
+Readers memory-map only the columns they use, so analysis cost grows with
+the number of columns touched rather than with the size of the run.
+"""
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from histogram import LatencyHistogram
+
+
+COLUMNS_SUFFIX = ".columns"
+
+# Columns shared by every load test
+REQUEST_SCHEMA = {
+    "image_id": "<i8",
+    "corpus_id": "<i4",
+    "success": "u1",
+    "rejected": "u1",
+    "status": "<i2",
+    "elapsed": "<f8",
+    "sent_at": "<f8",
+    "job_id": "V16",
+}
+
+
+def results_path(prefix):
+    """Summary file name of a new run: <prefix>_results_<ts>-<pid>.json"""
+    return f"{prefix}_results_{int(time.time())}-{os.getpid()}.json"
+
+
+def columns_dir_for(results_file):
+    """Column directory that belongs to a summary JSON file"""
+    return Path(results_file).with_suffix(COLUMNS_SUFFIX)
+
+
+def request_row(result):
+    """Flatten a load-test result dict into column values"""
+    job_id = result.get("job_id")
+    error = result.get("error", "")
+    status = int(error[5:]) if error.startswith("HTTP ") else (200 if result["success"] else 0)
+    row = {
+        "success": result["success"],
+        "rejected": result.get("rejected", False),
+        "status": status,
+        "elapsed": result["elapsed"],
+        "sent_at": result.get("sent_at", 0.0),
+        "job_id": uuid.UUID(job_id).bytes if job_id else bytes(16),
+    }
+    for key, value in result.items():
+        if key.endswith("_id") and key != "job_id":
+            row[key] = value
+    return row
+
+
+class ColumnWriter:
+    """Write rows to new per-column binary files, flushing every flush_rows rows"""
+
+    def __init__(self, directory, schema, flush_rows=8192):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True)
+        self.schema = {name: np.dtype(dtype) for name, dtype in schema.items()}
+        self.flush_rows = flush_rows
+        self.rows = 0
+        self.buffered = 0
+        self.buffers = {name: [] for name in self.schema}
+        self.files = {
+            name: open(self.directory / f"{name}.{dtype.str.lstrip('<>|')}", "xb")
+            for name, dtype in self.schema.items()
+        }
+        self.errors = open(self.directory / "errors.ndjson", "x")
+
+    def append(self, row, error=None):
+        for name, buffer in self.buffers.items():
+            buffer.append(row.get(name, 0))
+        if error:
+            self.errors.write(json.dumps({"row": self.rows, "error": error}) + "\n")
+        self.rows += 1
+        self.buffered += 1
+
+        if self.buffered >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        for name, buffer in self.buffers.items():
+            if buffer:
+                dtype = self.schema[name]
+                if dtype.kind == "V":
+                    data = b"".join(buffer)
+                else:
+                    data = np.asarray(buffer, dtype=dtype).tobytes()
+                self.files[name].write(data)
+                buffer.clear()
+        self.buffered = 0
+
+    def close(self):
+        """Flush and close all files; returns metadata for the summary JSON"""
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        self.errors.close()
+        return {
+            "path": self.directory.name,
+            "rows": self.rows,
+            "schema": {name: dtype.str for name, dtype in self.schema.items()},
+        }
+
+
+class ColumnReader:
+    """Lazily memory-map the columns described by a summary's metadata"""
+
+    def __init__(self, base_dir, meta):
+        self.directory = Path(base_dir) / meta["path"]
+        self.rows = meta["rows"]
+        self.schema = {name: np.dtype(dtype) for name, dtype in meta["schema"].items()}
+        self._cache = {}
+
+    def __contains__(self, name):
+        return name in self.schema
+
+    def __getitem__(self, name):
+        if name not in self._cache:
+            dtype = self.schema[name]
+            path = self.directory / f"{name}.{dtype.str.lstrip('<>|')}"
+            if self.rows == 0:
+                self._cache[name] = np.empty(0, dtype=dtype)
+            else:
+                self._cache[name] = np.memmap(path, dtype=dtype, mode="r", shape=(self.rows,))
+        return self._cache[name]
+
+    def errors(self):
+        """Iterate (row, error) pairs of failed requests"""
+        path = self.directory / "errors.ndjson"
+        if not path.exists():
+            return
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                yield record["row"], record["error"]
+
+
+def latency_summary(elapsed):
+    """Mean/median/min/max/stdev of a latency column, as stored in run summaries"""
+    if not len(elapsed):
+        return {"mean": 0, "median": 0, "min": 0, "max": 0, "stdev": 0}
+    return {
+        "mean": float(np.mean(elapsed)),
+        "median": float(np.median(elapsed)),
+        "min": float(np.min(elapsed)),
+        "max": float(np.max(elapsed)),
+        "stdev": float(np.std(elapsed, ddof=1)) if len(elapsed) > 1 else 0,
+    }
+
+
+class ResultRecorder:
+    """
+    Result sink for a load test run
+
+    Streams every result to the column files and keeps only what the live
+    report needs: counters, a latency histogram, the first few failures and,
+    when completions are tracked, job_id -> sent_at of accepted uploads.
+    """
+
+    def __init__(self, results_file, schema=REQUEST_SCHEMA, track_jobs=False, keep_failures=10):
+        self.writer = ColumnWriter(columns_dir_for(results_file), schema)
+        self.histogram = LatencyHistogram()
+        self.track_jobs = track_jobs
+        self.keep_failures = keep_failures
+        self.submitted = {}
+        self.failures = []
+        self.total = 0
+        self.successful = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def __call__(self, result):
+        self.total += 1
+        self.histogram.record(result["elapsed"])
+
+        if result["success"]:
+            self.successful += 1
+            if self.track_jobs:
+                self.submitted[result["job_id"]] = result["sent_at"]
+        elif result.get("rejected"):
+            self.rejected += 1
+        else:
+            self.failed += 1
+            if len(self.failures) < self.keep_failures:
+                self.failures.append(result)
+
+        self.writer.append(request_row(result), None if result["success"] else result.get("error"))
+
+    def close(self):
+        return self.writer.close()
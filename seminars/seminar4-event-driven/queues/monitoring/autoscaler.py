@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Queue-depth-driven autoscaler for workers
+
+Samples the task queue (depth, arrival rate, per-worker service rate),
+sizes the worker pool with Little's law and applies the result through a
+pluggable scaler. Every decision is appended to an NDJSON log together with
+its inputs, so a run can be replayed offline with different parameters:
+
+    python autoscaler.py --scaler compose --min-workers 1 --max-workers 10
+    python autoscaler.py --replay autoscaler_decisions.ndjson --target-drain 30
+"""
+import argparse
+import json
+import math
+import os
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from broker_stats import TASK_QUEUE, TASK_QUEUE_SHARDS, ManagementClient, RateTracker, task_queue_names
+
+
+class AutoscaleController:
+    """
+    Pure sizing model: sample in, desired worker count out
+
+    No I/O happens here, which is what makes offline replay possible.
+
+    Sizing (Little's law, L = lambda * W, applied to the service stage):
+        busy workers needed     = arrival_rate / service_rate
+        workers to drain backlog = depth / (service_rate * target_drain)
+        desired = ceil((busy / target_utilization) + drain)
+    """
+
+    def __init__(self, min_workers=1, max_workers=10, target_utilization=0.8,
+                 target_drain=60.0, initial_service_rate=1.0, smoothing=0.3,
+                 scale_up_samples=2, scale_down_samples=6, scale_down_margin=1,
+                 cooldown=30.0):
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.target_utilization = target_utilization
+        self.target_drain = target_drain
+        self.smoothing = smoothing
+        self.scale_up_samples = scale_up_samples
+        self.scale_down_samples = scale_down_samples
+        self.scale_down_margin = scale_down_margin
+        self.cooldown = cooldown
+
+        self.service_rate = initial_service_rate
+        self.arrival_rate = 0.0
+        self.up_streak = 0
+        self.down_streak = 0
+        self.last_change = None
+
+    def _smooth(self, previous, value):
+        return self.smoothing * value + (1 - self.smoothing) * previous
+
+    def observe(self, sample):
+        """Update smoothed arrival and per-worker service rate estimates"""
+        if sample["arrival_rate"] is not None:
+            self.arrival_rate = self._smooth(self.arrival_rate, sample["arrival_rate"])
+
+        # Completions only reflect worker capacity while workers are saturated;
+        # with an empty queue they just mirror the arrival rate.
+        consumers = sample["consumers"]
+        if (sample["completion_rate"] is not None and consumers > 0
+                and sample["messages_ready"] > 0):
+            per_worker = sample["completion_rate"] / consumers
+            if per_worker > 0:
+                self.service_rate = self._smooth(self.service_rate, per_worker)
+
+    def required_workers(self, depth):
+        """Worker count needed for the current arrival rate and backlog"""
+        busy = self.arrival_rate / self.service_rate
+        drain = depth / (self.service_rate * self.target_drain)
+        desired = math.ceil(busy / self.target_utilization + drain)
+        return max(self.min_workers, min(self.max_workers, desired))
+
+    def decide(self, sample, current):
+        """
+        Return a decision dict for this sample
+
+        Scale-ups need a short streak, scale-downs a long streak, a margin
+        and an elapsed cooldown; this keeps the pool from flapping around
+        the boundary.
+        """
+        self.observe(sample)
+        required = self.required_workers(sample["messages"])
+        now = sample["timestamp"]
+        in_cooldown = (self.last_change is not None
+                       and now - self.last_change < self.cooldown)
+
+        if required > current:
+            self.up_streak += 1
+            self.down_streak = 0
+        elif required <= current - self.scale_down_margin:
+            self.down_streak += 1
+            self.up_streak = 0
+        else:
+            self.up_streak = 0
+            self.down_streak = 0
+
+        target = current
+        reason = "steady"
+
+        if self.up_streak >= self.scale_up_samples:
+            target, reason = required, "scale_up"
+        elif self.down_streak >= self.scale_down_samples and not in_cooldown:
+            target, reason = required, "scale_down"
+        elif self.down_streak and in_cooldown:
+            reason = "cooldown"
+        elif self.up_streak:
+            reason = "pending_scale_up"
+        elif self.down_streak:
+            reason = "pending_scale_down"
+
+        if target != current:
+            self.last_change = now
+            self.up_streak = 0
+            self.down_streak = 0
+
+        return {
+            "current": current,
+            "required": required,
+            "target": target,
+            "reason": reason,
+            "arrival_rate_ewma": self.arrival_rate,
+            "service_rate_ewma": self.service_rate,
+        }
+
+
+class DryRunScaler:
+    """Scaler that only records the requested size"""
+
+    def __init__(self, initial=1):
+        self.size = initial
+
+    def current(self):
+        return self.size
+
+    def scale(self, count):
+        self.size = count
+
+
+class ComposeScaler:
+    """Scale the worker service through docker-compose"""
+
+    def __init__(self, service="worker", compose_cmd="docker-compose", cwd=None):
+        self.service = service
+        self.compose_cmd = compose_cmd.split()
+        self.cwd = cwd or str(Path(__file__).resolve().parent.parent)
+
+    def current(self):
+        result = subprocess.run(
+            self.compose_cmd + ["ps", "-q", self.service],
+            capture_output=True, text=True, cwd=self.cwd
+        )
+        return len([line for line in result.stdout.splitlines() if line.strip()])
+
+    def scale(self, count):
+        subprocess.run(
+            self.compose_cmd + ["up", "-d", "--no-recreate", "--scale",
+                                f"{self.service}={count}", self.service],
+            check=True, cwd=self.cwd
+        )
+
+
+class ProcessPoolScaler:
+    """Scale a pool of local worker.py processes"""
+
+    def __init__(self, worker_script=None):
+        default_script = Path(__file__).resolve().parent.parent / "worker" / "worker.py"
+        self.worker_script = Path(worker_script or default_script)
+        self.processes = []
+        self.next_id = 1
+
+    def _reap(self):
+        self.processes = [p for p in self.processes if p.poll() is None]
+
+    def current(self):
+        self._reap()
+        return len(self.processes)
+
+    def scale(self, count):
+        self._reap()
+
+        while len(self.processes) < count:
+            env = dict(os.environ, WORKER_ID=f"local-{self.next_id}")
+            self.next_id += 1
+            self.processes.append(subprocess.Popen(
+                [sys.executable, str(self.worker_script)],
+                cwd=str(self.worker_script.parent), env=env
+            ))
+
+        # SIGINT lets the worker stop consuming; unacked messages are requeued
+        while len(self.processes) > count:
+            process = self.processes.pop()
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def shutdown(self):
+        self.scale(0)
+
+
+def build_controller(args):
+    return AutoscaleController(
+        min_workers=args.min_workers,
+        max_workers=args.max_workers,
+        target_utilization=args.target_utilization,
+        target_drain=args.target_drain,
+        initial_service_rate=args.service_rate,
+        smoothing=args.smoothing,
+        scale_up_samples=args.scale_up_samples,
+        scale_down_samples=args.scale_down_samples,
+        scale_down_margin=args.scale_down_margin,
+        cooldown=args.cooldown,
+    )
+
+
+def build_scaler(args):
+    if args.scaler == "compose":
+        return ComposeScaler(service=args.service, compose_cmd=args.compose_cmd)
+    if args.scaler == "process":
+        return ProcessPoolScaler(worker_script=args.worker_script)
+    return DryRunScaler(initial=args.min_workers)
+
+
+def run(args):
+    """Live control loop"""
+    client = ManagementClient()
+    rates = RateTracker()
+    controller = build_controller(args)
+    scaler = build_scaler(args)
+
+    print("Autoscaler - Starting...")
+    queues = task_queue_names(args.queue, args.shards)
+    print(f"Queue: {args.queue} ({len(queues)} shards) | scaler: {args.scaler} | "
+          f"workers: {args.min_workers}-{args.max_workers}")
+    print(f"Decision log: {args.log}")
+    print("Press Ctrl+C to stop\n")
+
+    if scaler.current() < args.min_workers:
+        scaler.scale(args.min_workers)
+
+    try:
+        with open(args.log, "a") as log:
+            while True:
+                try:
+                    counters = client.total_counters(queues)
+                except Exception as e:
+                    print(f"Error sampling queue: {e}")
+                    time.sleep(args.interval)
+                    continue
+
+                sample = dict(counters, **rates.update(args.queue, counters))
+                current = scaler.current()
+                decision = controller.decide(sample, current)
+
+                if decision["target"] != current:
+                    scaler.scale(decision["target"])
+
+                log.write(json.dumps({"sample": sample, "decision": decision}) + "\n")
+                log.flush()
+
+                timestamp = datetime.now().strftime("%H:%M:%S")
+                print(f"[{timestamp}] depth={sample['messages']} "
+                      f"consumers={sample['consumers']} "
+                      f"lambda={decision['arrival_rate_ewma']:.2f}/s "
+                      f"mu={decision['service_rate_ewma']:.2f}/s "
+                      f"workers {current} -> {decision['target']} ({decision['reason']})")
+
+                time.sleep(args.interval)
+
+    except KeyboardInterrupt:
+        print("\nAutoscaler stopped.")
+    finally:
+        if isinstance(scaler, ProcessPoolScaler):
+            scaler.shutdown()
+
+
+def replay(args):
+    """Re-run the sizing model over a recorded decision log"""
+    controller = build_controller(args)
+    current = None
+    changed = 0
+    total = 0
+
+    print(f"Replaying {args.replay}\n")
+
+    with open(args.replay) as log:
+        for line in log:
+            record = json.loads(line)
+            sample = record["sample"]
+            recorded = record["decision"]
+
+            # The replayed pool follows its own decisions, starting from
+            # the size the live run started with.
+            if current is None:
+                current = recorded["current"]
+
+            decision = controller.decide(sample, current)
+            total += 1
+            if decision["target"] != recorded["target"]:
+                changed += 1
+
+            if decision["target"] != current or recorded["target"] != recorded["current"]:
+                timestamp = datetime.fromtimestamp(sample["timestamp"]).strftime("%H:%M:%S")
+                print(f"[{timestamp}] depth={sample['messages']} "
+                      f"replayed {current} -> {decision['target']} ({decision['reason']}) | "
+                      f"recorded {recorded['current']} -> {recorded['target']} "
+                      f"({recorded['reason']})")
+
+            current = decision["target"]
+
+    print(f"\n{total} samples, {changed} decisions differ from the recording")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue-depth-driven worker autoscaler")
+    parser.add_argument("--queue", default=TASK_QUEUE, help="Task queue to watch")
+    parser.add_argument("--shards", type=int, default=TASK_QUEUE_SHARDS,
+                        help="Task queue shards, summed into one sample (default: TASK_QUEUE_SHARDS env)")
+    parser.add_argument("--interval", type=float, default=5.0, help="Seconds between samples")
+    parser.add_argument("--scaler", choices=["compose", "process", "dry-run"], default="dry-run",
+                        help="How to apply the worker count")
+    parser.add_argument("--service", default="worker", help="docker-compose service to scale")
+    parser.add_argument("--compose-cmd", default="docker-compose", help="docker-compose command")
+    parser.add_argument("--worker-script", default=None, help="worker.py for the process scaler")
+    parser.add_argument("--min-workers", type=int, default=1)
+    parser.add_argument("--max-workers", type=int, default=10)
+    parser.add_argument("--target-utilization", type=float, default=0.8,
+                        help="Fraction of worker capacity to plan for")
+    parser.add_argument("--target-drain", type=float, default=60.0,
+                        help="Seconds in which the current backlog should be drained")
+    parser.add_argument("--service-rate", type=float, default=1.0,
+                        help="Initial per-worker jobs/s estimate")
+    parser.add_argument("--smoothing", type=float, default=0.3, help="EWMA factor for rates")
+    parser.add_argument("--scale-up-samples", type=int, default=2)
+    parser.add_argument("--scale-down-samples", type=int, default=6)
+    parser.add_argument("--scale-down-margin", type=int, default=1)
+    parser.add_argument("--cooldown", type=float, default=30.0,
+                        help="Seconds after a change before scaling down")
+    parser.add_argument("--log", default="autoscaler_decisions.ndjson",
+                        help="NDJSON decision log to append to")
+    parser.add_argument("--replay", default=None, help="Replay a decision log offline")
+
+    args = parser.parse_args()
+
+    if args.replay:
+        replay(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import os
+import time
+
+import requests
+
+
+# Configuration
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "localhost")
+RABBITMQ_MGMT_PORT = int(os.getenv("RABBITMQ_MGMT_PORT", "15672"))
+RABBITMQ_USER = os.getenv("RABBITMQ_USER", "guest")
+RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "guest")
+RABBITMQ_VHOST = os.getenv("RABBITMQ_VHOST", "/")
+
+# Task queue shards, named like api/sharding.py: the base name, then "<base>.<k>"
+TASK_QUEUE = "image_processing"
+TASK_QUEUE_SHARDS = int(os.getenv("TASK_QUEUE_SHARDS", "1"))
+
+
+def task_queue_names(base=TASK_QUEUE, shards=TASK_QUEUE_SHARDS):
+    return [base if index == 0 else f"{base}.{index}" for index in range(max(1, shards))]
+
+
+class ManagementClient:
+    """Read queue counters from the RabbitMQ management HTTP API"""
+
+    def __init__(self, host=RABBITMQ_HOST, port=RABBITMQ_MGMT_PORT,
+                 user=RABBITMQ_USER, password=RABBITMQ_PASS, vhost=RABBITMQ_VHOST):
+        self.base_url = f"http://{host}:{port}/api"
+        self.vhost = requests.utils.quote(vhost, safe="")
+        # One session so every sample reuses the same keep-alive connection
+        self.session = requests.Session()
+        self.session.auth = (user, password)
+
+    def queue_counters(self, queue_name):
+        """
+        Get depth, consumers and cumulative publish/ack counters for a queue
+
+        Counters are monotonic totals; rates are computed from their deltas
+        by RateTracker so that a single sample never depends on the broker's
+        own (coarse) rate window.
+        """
+        response = self.session.get(
+            f"{self.base_url}/queues/{self.vhost}/{queue_name}", timeout=5
+        )
+        response.raise_for_status()
+        data = response.json()
+        stats = data.get("message_stats", {})
+
+        return {
+            "timestamp": time.time(),
+            "messages": data.get("messages", 0),
+            "messages_ready": data.get("messages_ready", 0),
+            "messages_unacknowledged": data.get("messages_unacknowledged", 0),
+            "consumers": data.get("consumers", 0),
+            "published": stats.get("publish", 0),
+            "delivered": stats.get("deliver_get", 0),
+            "acked": stats.get("ack", 0),
+        }
+
+    def total_counters(self, queue_names):
+        """queue_counters() summed over several queues, e.g. all task queue shards"""
+        samples = [self.queue_counters(name) for name in queue_names]
+        total = {key: sum(sample[key] for sample in samples) for key in samples[0]}
+        total["timestamp"] = max(sample["timestamp"] for sample in samples)
+        return total
+
+
+class RateTracker:
+    """Turn cumulative counters into per-second rates between samples"""
+
+    def __init__(self):
+        self.previous = {}
+
+    def update(self, queue_name, counters):
+        """
+        Return ingress/egress rates since the previous sample of queue_name
+
+        The first sample for a queue has no reference point, so its rates
+        are None.
+        """
+        previous = self.previous.get(queue_name)
+        self.previous[queue_name] = counters
+
+        if previous is None:
+            return {"arrival_rate": None, "completion_rate": None}
+
+        elapsed = counters["timestamp"] - previous["timestamp"]
+        if elapsed <= 0:
+            return {"arrival_rate": None, "completion_rate": None}
+
+        # Counters reset when the broker restarts; treat that as zero traffic
+        published = max(counters["published"] - previous["published"], 0)
+        acked = max(counters["acked"] - previous["acked"], 0)
+
+        return {
+            "arrival_rate": published / elapsed,
+            "completion_rate": acked / elapsed,
+        }
@@ -1,40 +1,162 @@
+import argparse
+import math
+import os
 import time
 import statistics
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, deque
 
 import pika
 
+from broker_stats import ManagementClient, RateTracker, task_queue_names
+from tsdb import DEFAULT_PATH, TimeSeriesDB
+
+
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "localhost")
+RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", "5672"))
+RABBITMQ_USER = os.getenv("RABBITMQ_USER", "guest")
+RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "guest")
+
+QUEUES = task_queue_names() + ["notifications", "dead_letter_queue"]
+
+
+class Ewma:
+    """Exponentially weighted moving average; None until the first value"""
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.value = None
+
+    def update(self, value):
+        if value is None:
+            return self.value
+        if self.value is None:
+            self.value = value
+        else:
+            self.value = self.alpha * value + (1 - self.alpha) * self.value
+        return self.value
+
 
 class PerformanceMonitor:
-    """Monitor performance metrics of the system"""
+    """
+    Monitor queue depth, consumers, message rates and time-to-drain
+    
+    Every metric is kept in a fixed-size ring buffer (`history` samples), so
+    memory stays flat however long the monitor runs. Samples come over one
+    persistent AMQP channel. Ingress/egress rates come from the management
+    API's cumulative publish/ack counters when it is reachable; otherwise
+    only the net rate (depth delta) is known, which still gives a drain ETA.
+    """
     
-    def __init__(self, rabbitmq_host="localhost", rabbitmq_port=5672):
+    def __init__(self, rabbitmq_host=RABBITMQ_HOST, rabbitmq_port=RABBITMQ_PORT,
+                 queues=QUEUES, history=720, alpha=0.3, management=True, record=None):
         self.rabbitmq_host = rabbitmq_host
         self.rabbitmq_port = rabbitmq_port
-        self.metrics_history = defaultdict(list)
-        
+        self.queues = queues
+        self.history = history
+        self.alpha = alpha
+        self.metrics_history = defaultdict(lambda: deque(maxlen=self.history))
+        self.ewma = defaultdict(lambda: Ewma(self.alpha))
+        self.previous = {}
+        self.connection = None
+        self.channel = None
+        self.management = ManagementClient(host=rabbitmq_host) if management else None
+        self.rate_tracker = RateTracker()
+        self.db = TimeSeriesDB(record) if record else None
+    
+    def _get_channel(self):
+        """Reuse one channel; reconnect only after it was lost"""
+        if self.channel is None or self.channel.is_closed:
+            if self.connection is None or self.connection.is_closed:
+                credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+                parameters = pika.ConnectionParameters(
+                    host=self.rabbitmq_host,
+                    port=self.rabbitmq_port,
+                    credentials=credentials,
+                    heartbeat=60
+                )
+                self.connection = pika.BlockingConnection(parameters)
+            self.channel = self.connection.channel()
+        return self.channel
+    
+    def close(self):
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
+        self.connection = None
+        self.channel = None
+    
+    def _management_rates(self, queue_name):
+        """Ingress/egress rates from management counters, or None if unavailable"""
+        if self.management is None:
+            return None
+        try:
+            counters = self.management.queue_counters(queue_name)
+        except Exception as e:
+            print(f"Management API unavailable, using depth deltas only: {e}")
+            self.management = None
+            return None
+        return self.rate_tracker.update(queue_name, counters)
+    
     def get_queue_metrics(self):
-        """Get current queue metrics"""
+        """
+        Sample every queue and derive its rates
+        
+        Returns {queue: {depth, consumers, ingress, egress, net, drain_eta}}
+        or None if the broker is unreachable. Rates are per second and EWMA
+        smoothed; drain_eta is seconds until empty at the current net rate
+        (inf while the queue is not shrinking).
+        """
         try:
-            credentials = pika.PlainCredentials("guest", "guest")
-            parameters = pika.ConnectionParameters(
-                host=self.rabbitmq_host,
-                port=self.rabbitmq_port,
-                credentials=credentials
-            )
-            connection = pika.BlockingConnection(parameters)
-            channel = connection.channel()
-            
-            result = channel.queue_declare(queue="image_processing", passive=True)
-            queue_size = result.method.message_count
-            
-            connection.close()
-            return queue_size
-            
+            channel = self._get_channel()
+            raw = {}
+            for queue_name in self.queues:
+                result = channel.queue_declare(queue=queue_name, passive=True)
+                raw[queue_name] = (result.method.message_count, result.method.consumer_count)
         except Exception as e:
             print(f"Error getting metrics: {e}")
+            self.close()
             return None
+        
+        now = time.time()
+        metrics = {}
+        
+        for queue_name, (depth, consumers) in raw.items():
+            previous = self.previous.get(queue_name)
+            self.previous[queue_name] = (now, depth)
+            
+            net = None
+            if previous and now > previous[0]:
+                net = (depth - previous[1]) / (now - previous[0])
+            
+            ingress = egress = None
+            rates = self._management_rates(queue_name)
+            if rates:
+                ingress = rates["arrival_rate"]
+                egress = rates["completion_rate"]
+                if ingress is not None and egress is not None:
+                    net = ingress - egress
+            
+            ingress = self.ewma[(queue_name, "ingress")].update(ingress)
+            egress = self.ewma[(queue_name, "egress")].update(egress)
+            net = self.ewma[(queue_name, "net")].update(net)
+            
+            if depth == 0:
+                drain_eta = 0.0
+            elif net is not None and net < 0:
+                drain_eta = depth / -net
+            else:
+                drain_eta = math.inf
+            
+            metrics[queue_name] = {
+                "depth": depth,
+                "consumers": consumers,
+                "ingress": ingress,
+                "egress": egress,
+                "net": net,
+                "drain_eta": drain_eta
+            }
+        
+        return metrics
     
     def record_metric(self, metric_name, value):
         """Record a metric value"""
@@ -43,12 +165,27 @@ class PerformanceMonitor:
             "value": value
         })
     
+    def record_sample(self, metrics):
+        """Record every known value of a get_queue_metrics() sample"""
+        values = {}
+        for queue_name, queue_metrics in metrics.items():
+            for name, value in queue_metrics.items():
+                if value is not None and not math.isinf(value):
+                    self.record_metric(f"{queue_name}.{name}", value)
+                    values[f"{queue_name}.{name}"] = value
+        
+        # Persist for after-the-fact analysis (python tsdb.py query ...)
+        if self.db is not None:
+            self.db.record(values)
+            self.db.flush()
+    
     def calculate_stats(self, metric_name, window_size=10):
         """Calculate statistics for a metric"""
         if metric_name not in self.metrics_history:
             return None
         
-        values = [m["value"] for m in self.metrics_history[metric_name][-window_size:]]
+        series = self.metrics_history[metric_name]
+        values = [m["value"] for m in list(series)[-window_size:]]
         
         if not values:
             return None
@@ -62,49 +199,99 @@ class PerformanceMonitor:
             "stdev": statistics.stdev(values) if len(values) > 1 else 0
         }
     
-    def print_summary(self):
+    def print_summary(self, metrics=None):
         """Print performance summary"""
         print("\n" + "="*70)
         print(f"Performance Summary - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         print("="*70)
         
-        for metric_name in self.metrics_history:
-            stats = self.calculate_stats(metric_name)
-            if stats:
-                print(f"\n{metric_name}:")
-                print(f"  Current: {stats['current']:.2f}")
-                print(f"  Mean: {stats['mean']:.2f}")
-                print(f"  Median: {stats['median']:.2f}")
-                print(f"  Min: {stats['min']:.2f}")
-                print(f"  Max: {stats['max']:.2f}")
-                print(f"  StdDev: {stats['stdev']:.2f}")
+        for queue_name in self.queues:
+            depth = self.calculate_stats(f"{queue_name}.depth")
+            if not depth:
+                continue
+            
+            print(f"\n{queue_name}:")
+            print(f"  Depth: {depth['current']:.0f} "
+                  f"(mean {depth['mean']:.1f}, min {depth['min']:.0f}, max {depth['max']:.0f})")
+            
+            consumers = self.calculate_stats(f"{queue_name}.consumers")
+            if consumers:
+                print(f"  Consumers: {consumers['current']:.0f}")
+            
+            current = (metrics or {}).get(queue_name, {})
+            for name, label in [("ingress", "Ingress"), ("egress", "Egress"), ("net", "Net")]:
+                value = current.get(name)
+                if value is not None:
+                    print(f"  {label}: {value:+.2f} msg/s" if name == "net" else
+                          f"  {label}: {value:.2f} msg/s")
+            
+            eta = current.get("drain_eta")
+            if eta is not None:
+                if math.isinf(eta):
+                    print("  Drain ETA: not draining")
+                else:
+                    print(f"  Drain ETA: {eta:.0f}s")
         
         print("\n" + "="*70 + "\n")
     
-    def monitor(self, interval=5):
+    def monitor(self, interval=5, summary_every=12):
         """Start monitoring loop"""
         print("Performance Monitor - Starting...")
         print(f"Monitoring interval: {interval} seconds")
+        print(f"History: last {self.history} samples per metric")
+        if self.db is not None:
+            print(f"Recording to {self.db.path}/")
         print("Press Ctrl+C to stop\n")
         
+        metrics = None
+        samples = 0
         try:
             while True:
-                queue_size = self.get_queue_metrics()
+                metrics = self.get_queue_metrics()
                 
-                if queue_size is not None:
-                    self.record_metric("queue_size", queue_size)
+                if metrics is not None:
+                    self.record_sample(metrics)
+                    samples += 1
                     
-                    if len(self.metrics_history["queue_size"]) % 12 == 0:  # Every minute
-                        self.print_summary()
-                
-                time.sleep(interval)
+                    if samples % summary_every == 0:
+                        self.print_summary(metrics)
                 
+                # Sleeping on the connection keeps its heartbeats answered
+                if self.connection is not None and self.connection.is_open:
+                    self.connection.sleep(interval)
+                else:
+                    time.sleep(interval)
+        
         except KeyboardInterrupt:
             print("\n\nFinal Summary:")
-            self.print_summary()
+            self.print_summary(metrics)
+            self.close()
             print("Monitoring stopped.")
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Queue performance monitor")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between samples")
+    parser.add_argument("--history", type=int, default=720, help="Samples kept per metric")
+    parser.add_argument("--alpha", type=float, default=0.3, help="EWMA smoothing factor (0-1]")
+    parser.add_argument("--summary-every", type=int, default=12, help="Print a summary every N samples")
+    parser.add_argument("--queues", default=",".join(QUEUES), help="Comma-separated queues to watch")
+    parser.add_argument("--no-management", action="store_true",
+                        help="Do not use the management API (net rate from depth only)")
+    parser.add_argument("--record", default=DEFAULT_PATH, help="Time series directory (see tsdb.py)")
+    parser.add_argument("--no-record", action="store_true", help="Keep history in memory only")
+
+    args = parser.parse_args()
+
+    monitor = PerformanceMonitor(
+        queues=[q.strip() for q in args.queues.split(",")],
+        history=args.history,
+        alpha=args.alpha,
+        management=not args.no_management,
+        record=None if args.no_record else args.record
+    )
+    monitor.monitor(args.interval, args.summary_every)
+
+
 if __name__ == "__main__":
-    monitor = PerformanceMonitor()
-    monitor.monitor()
+    main()
@@ -1,3 +1,4 @@
+import argparse
 import os
 import sys
 import time
@@ -5,6 +6,9 @@ from datetime import datetime
 
 import pika
 
+from broker_stats import task_queue_names
+from tsdb import DEFAULT_PATH, TimeSeriesDB
+
 
 # Configuration
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "localhost")
@@ -25,7 +29,7 @@ def get_queue_stats():
         connection = pika.BlockingConnection(parameters)
         channel = connection.channel()
         
-        queues = ["image_processing", "notifications", "dead_letter_queue"]
+        queues = task_queue_names() + ["notifications", "dead_letter_queue"]
         stats = {}
         
         for queue_name in queues:
@@ -76,17 +80,44 @@ def print_stats(stats):
     print("\n" + "="*70 + "\n")
 
 
+def record_stats(db, stats):
+    """Append depth and consumer count of every reachable queue to the time series"""
+    if "error" in stats:
+        return
+    
+    values = {}
+    for queue_name, queue_stats in stats.items():
+        if "error" not in queue_stats:
+            values[f"{queue_name}.depth"] = queue_stats["messages"]
+            values[f"{queue_name}.consumers"] = queue_stats["consumers"]
+    
+    db.record(values)
+    db.flush()
+
+
 def main():
     """Main monitoring loop"""
+    parser = argparse.ArgumentParser(description="Queue monitor")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between samples")
+    parser.add_argument("--record", default=DEFAULT_PATH, help="Time series directory (see tsdb.py)")
+    parser.add_argument("--no-record", action="store_true", help="Only print, keep no history")
+    args = parser.parse_args()
+    
+    db = None if args.no_record else TimeSeriesDB(args.record)
+    
     print("Queue Monitor - Starting...")
     print(f"Monitoring RabbitMQ at {RABBITMQ_HOST}:{RABBITMQ_PORT}")
+    if db:
+        print(f"Recording to {db.path}/")
     print("Press Ctrl+C to stop\n")
     
     try:
         while True:
             stats = get_queue_stats()
             print_stats(stats)
-            time.sleep(5)  # Update every 5 seconds
+            if db:
+                record_stats(db, stats)
+            time.sleep(args.interval)
             
     except KeyboardInterrupt:
         print("\nMonitoring stopped.")
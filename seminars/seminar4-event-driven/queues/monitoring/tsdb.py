@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Compact on-disk time series for the monitors
+
+Every series is stored once per rollup resolution (1s, 1m, 1h by default)
+in a fixed-size, memory-mapped ring file. Slot i of a ring holds the bucket
+whose index (timestamp // resolution) is congruent to i modulo the ring
+size, together with that bucket's count, sum, min, max and last value, so:
+
+  - appending is O(1): update one 32-byte slot in each ring, no rewrite
+  - disk use is fixed when the series is created and never grows, the
+    oldest buckets are simply overwritten (retention = resolution * slots)
+  - a query is one vectorized read of the slots covering the range
+
+    monitoring_data/
+        meta.json                        rollups and their slot counts
+        image_processing.depth.1s.ts     one ring file per series and rollup
+        image_processing.depth.1m.ts
+        ...
+
+Query from the command line (times are epoch ms, ISO dates or durations
+ago like 15m; output timestamps are epoch ms):
+
+    python tsdb.py list
+    python tsdb.py query image_processing.depth --start 1h
+    python tsdb.py query image_processing.drain_eta --start 7d --resolution 1h --format csv
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single writer per database assumed
+    fcntl = None
+
+
+DEFAULT_PATH = os.getenv("MONITOR_DATA_DIR", "monitoring_data")
+
+# resolution (seconds) -> number of slots
+DEFAULT_ROLLUPS = {
+    1: 6 * 3600,        # 1s for 6 hours
+    60: 14 * 24 * 60,   # 1m for 14 days
+    3600: 365 * 24,     # 1h for a year
+}
+
+SLOT_DTYPE = np.dtype([
+    ("bucket", "<i8"),   # timestamp // resolution; -1 = empty slot
+    ("count", "<u4"),
+    ("sum", "<f8"),
+    ("min", "<f4"),
+    ("max", "<f4"),
+    ("last", "<f4"),
+])
+
+SERIES_NAME = re.compile(r"^[A-Za-z0-9_.\-]+$")
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def resolution_label(resolution):
+    for unit in ("d", "h", "m"):
+        if resolution % UNITS[unit] == 0:
+            return f"{resolution // UNITS[unit]}{unit}"
+    return f"{resolution}s"
+
+
+def parse_duration(value):
+    """'90s', '15m', '6h', '14d' -> seconds"""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhdw])", value.strip())
+    if not match:
+        raise ValueError(f"Invalid duration: {value}")
+    return float(match.group(1)) * UNITS[match.group(2)]
+
+
+def parse_time_ms(value, now=None):
+    """Epoch ms, 'now', a duration ago ('15m' or '-15m') or ISO 8601 -> epoch ms"""
+    now = time.time() if now is None else now
+    value = value.strip()
+    if value == "now":
+        return int(now * 1000)
+    if re.fullmatch(r"-?\d+(?:\.\d+)?[smhdw]", value):
+        return int((now - parse_duration(value.lstrip("-"))) * 1000)
+    if value.isdigit():
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+
+class TimeSeriesDB:
+    """Directory of ring-buffer series files shared by the monitors"""
+
+    def __init__(self, path=DEFAULT_PATH, rollups=None):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.rings = {}
+
+        meta_file = self.path / "meta.json"
+        if meta_file.exists():
+            # The layout of existing files wins over the constructor arguments
+            with open(meta_file) as f:
+                meta = json.load(f)
+            self.rollups = {int(r): int(slots) for r, slots in meta["rollups"].items()}
+        else:
+            self.rollups = dict(sorted((rollups or DEFAULT_ROLLUPS).items()))
+            with open(meta_file, "w") as f:
+                json.dump({"rollups": self.rollups, "slot_dtype": SLOT_DTYPE.descr}, f, indent=2)
+
+    @contextmanager
+    def _locked(self):
+        """Serialize writers (e.g. queue_monitor and performance_monitor)"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.path / ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _file(self, series, resolution):
+        return self.path / f"{series}.{resolution_label(resolution)}.ts"
+
+    def _ring(self, series, resolution, create=False):
+        key = (series, resolution)
+        if key not in self.rings:
+            path = self._file(series, resolution)
+            slots = self.rollups[resolution]
+            if not path.exists():
+                if not create:
+                    return None
+                empty = np.zeros(slots, dtype=SLOT_DTYPE)
+                empty["bucket"] = -1
+                empty.tofile(path)
+            self.rings[key] = np.memmap(path, dtype=SLOT_DTYPE, mode="r+" if create else "r",
+                                        shape=(slots,))
+        return self.rings[key]
+
+    def series(self):
+        """Names of all recorded series"""
+        finest = resolution_label(min(self.rollups))
+        suffix = f".{finest}.ts"
+        return sorted(p.name[:-len(suffix)] for p in self.path.glob(f"*{suffix}"))
+
+    def record(self, values, timestamp=None):
+        """Append one sample per series: {series: value}; None values are skipped"""
+        timestamp = time.time() if timestamp is None else timestamp
+
+        with self._locked():
+            for series, value in values.items():
+                if value is None:
+                    continue
+                if not SERIES_NAME.match(series):
+                    raise ValueError(f"Invalid series name: {series}")
+
+                for resolution, slots in self.rollups.items():
+                    ring = self._ring(series, resolution, create=True)
+                    bucket = int(timestamp // resolution)
+                    slot = ring[bucket % slots]
+
+                    if slot["bucket"] != bucket:
+                        slot["bucket"] = bucket
+                        slot["count"] = 0
+                        slot["sum"] = 0.0
+                        slot["min"] = value
+                        slot["max"] = value
+
+                    slot["count"] += 1
+                    slot["sum"] += value
+                    slot["min"] = min(slot["min"], value)
+                    slot["max"] = max(slot["max"], value)
+                    slot["last"] = value
+                    ring[bucket % slots] = slot
+
+    def flush(self):
+        for ring in self.rings.values():
+            if ring.mode == "r+":
+                ring.flush()
+
+    def pick_resolution(self, start_ms, now=None):
+        """Finest rollup whose retention still covers start_ms"""
+        now = time.time() if now is None else now
+        for resolution, slots in self.rollups.items():
+            if now - start_ms / 1000 <= resolution * slots:
+                return resolution
+        return max(self.rollups)
+
+    def query(self, series, start_ms, end_ms, resolution=None):
+        """
+        Buckets of `series` in [start_ms, end_ms]
+
+        Returns {"resolution", "time_ms", "count", "avg", "min", "max", "last"}
+        with numpy arrays holding only the buckets that have data.
+        """
+        resolution = resolution or self.pick_resolution(start_ms)
+        if resolution not in self.rollups:
+            raise ValueError(f"No {resolution_label(resolution)} rollup; have "
+                             f"{', '.join(resolution_label(r) for r in self.rollups)}")
+
+        empty = {"resolution": resolution, "time_ms": np.empty(0, dtype=np.int64)}
+        for name in ("count", "avg", "min", "max", "last"):
+            empty[name] = np.empty(0)
+
+        ring = self._ring(series, resolution)
+        if ring is None:
+            return empty
+
+        slots = self.rollups[resolution]
+        first = start_ms // 1000 // resolution
+        last = end_ms // 1000 // resolution
+        # Never read more than one full lap of the ring
+        first = max(first, last - slots + 1)
+        if last < first:
+            return empty
+
+        buckets = np.arange(first, last + 1, dtype=np.int64)
+        rows = ring[buckets % slots]
+        valid = rows["bucket"] == buckets
+        rows = rows[valid]
+
+        return {
+            "resolution": resolution,
+            "time_ms": buckets[valid] * resolution * 1000,
+            "count": rows["count"].astype(np.int64),
+            "avg": rows["sum"] / np.maximum(rows["count"], 1),
+            "min": rows["min"].astype(np.float64),
+            "max": rows["max"].astype(np.float64),
+            "last": rows["last"].astype(np.float64),
+        }
+
+    def disk_usage(self):
+        return sum(p.stat().st_size for p in self.path.glob("*.ts"))
+
+
+def _json_value(value):
+    return None if math.isinf(value) or math.isnan(value) else value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query monitor time series")
+    parser.add_argument("--db", default=DEFAULT_PATH, help="Database directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("list", help="List series, rollups and disk use")
+
+    query = commands.add_parser("query", help="Read a time range of one series")
+    query.add_argument("series", help="Series name, e.g. image_processing.depth")
+    query.add_argument("--start", default="1h", help="Epoch ms, ISO date or duration ago (15m)")
+    query.add_argument("--end", default="now", help="Epoch ms, ISO date, duration ago or 'now'")
+    query.add_argument("--resolution", default=None,
+                       help="Rollup to read (1s, 1m, 1h); default: finest covering --start")
+    query.add_argument("--format", choices=["table", "json", "csv"], default="table")
+
+    args = parser.parse_args()
+
+    if not Path(args.db).exists():
+        print(f"No database at {args.db}", file=sys.stderr)
+        sys.exit(1)
+    db = TimeSeriesDB(args.db)
+
+    if args.command == "list":
+        rollups = ", ".join(f"{resolution_label(r)} x {slots} "
+                            f"({resolution_label(int(r * slots)) if r * slots % 3600 == 0 else r * slots})"
+                            for r, slots in db.rollups.items())
+        print(f"Database: {db.path} ({db.disk_usage() / 1024 / 1024:.1f} MB)")
+        print(f"Rollups: {rollups}")
+        for name in db.series():
+            print(f"  {name}")
+        return
+
+    start_ms = parse_time_ms(args.start)
+    end_ms = parse_time_ms(args.end)
+    resolution = int(parse_duration(args.resolution)) if args.resolution else None
+
+    started = time.perf_counter()
+    result = db.query(args.series, start_ms, end_ms, resolution)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    columns = ["count", "avg", "min", "max", "last"]
+    if args.format == "json":
+        print(json.dumps({
+            "series": args.series,
+            "resolution": resolution_label(result["resolution"]),
+            "start_ms": start_ms,
+            "end_ms": end_ms,
+            "points": [
+                dict({"time_ms": int(t), "count": int(result["count"][i])},
+                     **{c: _json_value(float(result[c][i])) for c in columns[1:]})
+                for i, t in enumerate(result["time_ms"])
+            ]
+        }))
+    elif args.format == "csv":
+        print("time_ms," + ",".join(columns))
+        for i, t in enumerate(result["time_ms"]):
+            print(f"{t}," + ",".join(f"{result[c][i]:g}" for c in columns))
+    else:
+        print(f"{args.series} @ {resolution_label(result['resolution'])}: "
+              f"{len(result['time_ms'])} points ({elapsed_ms:.2f} ms)")
+        print(f"{'time_ms':>14} {'time':>19} {'count':>6} {'avg':>10} {'min':>10} {'max':>10} {'last':>10}")
+        for i, t in enumerate(result["time_ms"]):
+            when = datetime.fromtimestamp(t / 1000).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"{t:>14} {when:>19} {result['count'][i]:>6} {result['avg'][i]:>10.2f} "
+                  f"{result['min'][i]:>10.2f} {result['max'][i]:>10.2f} {result['last'][i]:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,20 @@ RABBITMQ_USER = os.getenv("RABBITMQ_USER", "guest")
 RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "guest")
 
 NOTIFICATION_QUEUE = "notifications"
+JOB_EVENTS_EXCHANGE = "job_events"
+
+
+# RabbitMQ connection
+def get_rabbitmq_connection():
+    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+    parameters = pika.ConnectionParameters(
+        host=RABBITMQ_HOST,
+        port=RABBITMQ_PORT,
+        credentials=credentials,
+        heartbeat=600,
+        blocked_connection_timeout=300
+    )
+    return pika.BlockingConnection(parameters)
 
 
 def callback(ch, method, properties, body):
@@ -30,12 +44,18 @@ def callback(ch, method, properties, body):
         worker_id = notification.get("worker_id", "unknown")
         
         print(f"\n{'='*60}")
-        print(f"[Notification Service] Job Completed!")
+        if status == "completed":
+            print(f"[Notification Service] Job Completed!")
+        else:
+            print(f"[Notification Service] Job {str(status).capitalize()}!")
         print(f"{'='*60}")
         print(f"Job ID: {job_id}")
         print(f"Status: {status}")
-        print(f"Processed File: {processed_file}")
-        print(f"Processing Time: {processing_time:.2f}s")
+        if processed_file:
+            print(f"Processed File: {processed_file}")
+            print(f"Processing Time: {processing_time:.2f}s")
+        if notification.get("error"):
+            print(f"Error: {notification['error']}")
         print(f"Worker: {worker_id}")
         print(f"Timestamp: {notification.get('timestamp')}")
         print(f"{'='*60}\n")
@@ -54,6 +74,27 @@ def callback(ch, method, properties, body):
         ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
 
 
+def consume(connection):
+    """
+    Declare the topology and handle notifications until the connection closes
+    """
+    channel = connection.channel()
+    
+    # Declare queue
+    channel.queue_declare(queue=NOTIFICATION_QUEUE, durable=True)
+    channel.exchange_declare(exchange=JOB_EVENTS_EXCHANGE, exchange_type='fanout', durable=True)
+    channel.queue_bind(queue=NOTIFICATION_QUEUE, exchange=JOB_EVENTS_EXCHANGE)
+    
+    # Set QoS
+    channel.basic_qos(prefetch_count=1)
+    
+    # Start consuming
+    print("[Notification Service] Waiting for notifications...")
+    channel.basic_consume(queue=NOTIFICATION_QUEUE, on_message_callback=callback)
+    
+    channel.start_consuming()
+
+
 def main():
     """
     Main notification service loop
@@ -66,28 +107,7 @@ def main():
     
     while retry_count < max_retries:
         try:
-            credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-            parameters = pika.ConnectionParameters(
-                host=RABBITMQ_HOST,
-                port=RABBITMQ_PORT,
-                credentials=credentials,
-                heartbeat=600,
-                blocked_connection_timeout=300
-            )
-            connection = pika.BlockingConnection(parameters)
-            channel = connection.channel()
-            
-            # Declare queue
-            channel.queue_declare(queue=NOTIFICATION_QUEUE, durable=True)
-            
-            # Set QoS
-            channel.basic_qos(prefetch_count=1)
-            
-            # Start consuming
-            print("[Notification Service] Waiting for notifications...")
-            channel.basic_consume(queue=NOTIFICATION_QUEUE, on_message_callback=callback)
-            
-            channel.start_consuming()
+            consume(get_rabbitmq_connection())
             
         except KeyboardInterrupt:
             print("\n[Notification Service] Shutting down...")
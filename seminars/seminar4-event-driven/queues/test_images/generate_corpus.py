@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Generate a corpus of test images for load tests
+
+Images are drawn from configurable resolution, format and entropy
+distributions, rendered with vectorized NumPy operations and encoded in
+parallel worker processes. The corpus is written as one pack file plus an
+index so load tests can memory-map it and slice images without copying:
+
+    corpus/
+        images.pack    encoded images, back to back
+        index.json     [{offset, length, width, height, format, content_type, entropy}, ...]
+
+Example:
+    python generate_corpus.py --count 500 \
+        --resolutions 640x480:0.4,1920x1080:0.4,4000x3000:0.2 \
+        --formats jpeg:0.7,png:0.2,webp:0.1 --entropy low:0.3,medium:0.5,high:0.2
+"""
+import argparse
+import io
+import json
+import os
+import random
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+
+PACK_FILE = "images.pack"
+INDEX_FILE = "index.json"
+
+CONTENT_TYPES = {
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+}
+
+# Noise amplitude and number of random rectangles per entropy level.
+# Low entropy compresses very well, high entropy is close to incompressible.
+ENTROPY_LEVELS = {
+    "low": {"noise": 0, "shapes": 0},
+    "medium": {"noise": 12, "shapes": 12},
+    "high": {"noise": 96, "shapes": 40},
+}
+
+
+def parse_distribution(spec, parse_value=str):
+    """Parse 'a:0.5,b:0.5' into ([values], [weights])"""
+    values, weights = [], []
+    for item in spec.split(","):
+        value, _, weight = item.partition(":")
+        values.append(parse_value(value.strip()))
+        weights.append(float(weight) if weight else 1.0)
+    return values, weights
+
+
+def parse_resolution(value):
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height)
+
+
+def render_image(width, height, entropy, seed):
+    """Render an RGB image as a uint8 array using only vectorized operations"""
+    rng = np.random.default_rng(seed)
+    level = ENTROPY_LEVELS[entropy]
+
+    # Two-axis gradient with random colors at the corners
+    corners = rng.integers(0, 256, size=(4, 3)).astype(np.float32)
+    ys = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None, None]
+    xs = np.linspace(0.0, 1.0, width, dtype=np.float32)[None, :, None]
+    top = corners[0] * (1 - xs) + corners[1] * xs
+    bottom = corners[2] * (1 - xs) + corners[3] * xs
+    pixels = top * (1 - ys) + bottom * ys
+
+    # Solid rectangles add edges, which is what resize and filters work on
+    for _ in range(level["shapes"]):
+        x1, x2 = np.sort(rng.integers(0, width, size=2))
+        y1, y2 = np.sort(rng.integers(0, height, size=2))
+        pixels[y1:y2, x1:x2] = rng.integers(0, 256, size=3)
+
+    if level["noise"]:
+        noise = rng.normal(0.0, level["noise"], size=(height, width, 3)).astype(np.float32)
+        pixels += noise
+
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+
+def encode_image(task):
+    """Worker process entry point: render and encode one image"""
+    width, height, image_format, entropy, seed = task
+    pixels = render_image(width, height, entropy, seed)
+
+    output = io.BytesIO()
+    img = Image.fromarray(pixels, "RGB")
+    if image_format == "jpeg":
+        img.save(output, format="JPEG", quality=85)
+    elif image_format == "png":
+        img.save(output, format="PNG", compress_level=6)
+    else:
+        img.save(output, format=image_format.upper(), quality=80)
+
+    return {
+        "width": width,
+        "height": height,
+        "format": image_format,
+        "content_type": CONTENT_TYPES[image_format],
+        "entropy": entropy,
+        "data": output.getvalue(),
+    }
+
+
+def build_tasks(count, resolutions, formats, entropy, seed):
+    """Draw the attributes of every image up front so runs are reproducible"""
+    rng = random.Random(seed)
+    resolution_values, resolution_weights = resolutions
+    format_values, format_weights = formats
+    entropy_values, entropy_weights = entropy
+
+    tasks = []
+    for _ in range(count):
+        width, height = rng.choices(resolution_values, resolution_weights)[0]
+        tasks.append((
+            width,
+            height,
+            rng.choices(format_values, format_weights)[0],
+            rng.choices(entropy_values, entropy_weights)[0],
+            rng.getrandbits(32),
+        ))
+    return tasks
+
+
+def generate_corpus(output_dir, count, resolutions, formats, entropy, processes, seed):
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    tasks = build_tasks(count, resolutions, formats, entropy, seed)
+    index = []
+    offset = 0
+    start_time = time.time()
+
+    with open(output_dir / PACK_FILE, "wb") as pack, Pool(processes) as pool:
+        # imap keeps corpus order deterministic while processes work ahead
+        for i, image in enumerate(pool.imap(encode_image, tasks, chunksize=4), 1):
+            data = image.pop("data")
+            pack.write(data)
+            index.append(dict(image, offset=offset, length=len(data)))
+            offset += len(data)
+
+            if i % 50 == 0 or i == count:
+                print(f"  {i}/{count} images, {offset / 1024 / 1024:.1f} MB")
+
+    with open(output_dir / INDEX_FILE, "w") as f:
+        json.dump(index, f)
+
+    elapsed = time.time() - start_time
+    print(f"Created corpus of {count} images ({offset / 1024 / 1024:.1f} MB) "
+          f"in {output_dir} in {elapsed:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a test image corpus")
+    parser.add_argument("--count", type=int, default=200, help="Number of images")
+    parser.add_argument("--output", default="corpus", help="Output directory")
+    parser.add_argument("--resolutions", default="640x480:0.3,1280x720:0.3,1920x1080:0.3,4000x3000:0.1",
+                        help="Weighted WIDTHxHEIGHT:WEIGHT list")
+    parser.add_argument("--formats", default="jpeg:0.8,png:0.15,webp:0.05",
+                        help=f"Weighted FORMAT:WEIGHT list ({', '.join(CONTENT_TYPES)})")
+    parser.add_argument("--entropy", default="low:0.3,medium:0.5,high:0.2",
+                        help=f"Weighted LEVEL:WEIGHT list ({', '.join(ENTROPY_LEVELS)})")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+
+    args = parser.parse_args()
+
+    resolutions = parse_distribution(args.resolutions, parse_resolution)
+    formats = parse_distribution(args.formats)
+    entropy = parse_distribution(args.entropy)
+
+    for value in formats[0]:
+        if value not in CONTENT_TYPES:
+            parser.error(f"Unknown format: {value}")
+    for value in entropy[0]:
+        if value not in ENTROPY_LEVELS:
+            parser.error(f"Unknown entropy level: {value}")
+
+    generate_corpus(args.output, args.count, resolutions, formats, entropy,
+                    args.processes, args.seed)
+
+
+if __name__ == "__main__":
+    main()
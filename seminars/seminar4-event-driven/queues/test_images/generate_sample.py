@@ -2,24 +2,22 @@
 """
 Generate a sample test image
 """
-from PIL import Image, ImageDraw, ImageFont
 import random
 
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
 
 def create_sample_image(width=1920, height=1080, filename="sample.jpg"):
     """Create a colorful sample image"""
     
-    # Create base image
-    img = Image.new('RGB', (width, height))
+    # Vertical gradient background, computed for all rows at once
+    t = np.arange(height, dtype=np.float32)[:, None] / height
+    row_colors = np.hstack([255 * t, 128 + 127 * (1 - t), 200 * t]).astype(np.uint8)
+    pixels = np.broadcast_to(row_colors[:, None, :], (height, width, 3))
+    img = Image.fromarray(np.ascontiguousarray(pixels), 'RGB')
     draw = ImageDraw.Draw(img)
     
-    # Random gradient background
-    for y in range(height):
-        r = int(255 * (y / height))
-        g = int(128 + 127 * (1 - y / height))
-        b = int(200 * (y / height))
-        draw.line([(0, y), (width, y)], fill=(r, g, b))
-    
     # Draw some shapes
     for _ in range(20):
         x1 = random.randint(0, width)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Processor microbenchmarks
+
+Runs resize_image, add_watermark, apply_filter, the full process_image
+pipeline and image decoding (whole buffer vs. StreamingDecoder fed in
+chunks, as the worker does while downloading) on generated images of
+several sizes, modes and formats, fully offline (no RabbitMQ, no MinIO).
+For every case it reports:
+
+  - wall time per call and megapixels of input processed per second
+  - Python allocations (tracemalloc: allocated blocks and peak traced bytes)
+  - peak RSS, which also covers Pillow's native image buffers
+
+Each case runs in a fresh process so peak RSS belongs to that case alone.
+Results are appended to a JSON history file; --compare prints the change
+against the previous run.
+
+Example:
+    python benchmark.py --sizes 640x480,1920x1080,4000x3000 --modes RGB,RGBA,P \
+        --formats jpeg,png --repeat 5 --label "lanczos -> bicubic" --compare
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import PIL
+from PIL import Image
+
+from processors.decode import StreamingDecoder, peak_rss_mb
+from processors.resize import resize_image
+from processors.watermark import add_watermark
+from processors.filter import apply_filter
+
+
+CASES = ["resize", "watermark", "filter", "pipeline", "decode", "stream_decode"]
+FORMATS = {"jpeg": "JPEG", "png": "PNG", "webp": "WEBP"}
+MODES = ["RGB", "RGBA", "P"]
+
+# Formats that cannot store a mode are skipped instead of silently converted
+UNSUPPORTED = {("jpeg", "RGBA"), ("jpeg", "P")}
+
+
+def parse_size(value):
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height)
+
+
+def create_input(width, height, mode, image_format):
+    """Deterministic test image: gradients plus noise, encoded in `image_format`"""
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 48)
+    img = Image.merge("RGB", [gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)])
+
+    if mode == "RGBA":
+        img.putalpha(gradient.transpose(Image.Transpose.FLIP_TOP_BOTTOM))
+    elif mode == "P":
+        img = img.quantize(colors=256)
+
+    output = io.BytesIO()
+    img.save(output, format=FORMATS[image_format])
+    return output.getvalue()
+
+
+def case_function(case, pipeline):
+    if case == "resize":
+        return resize_image
+    if case == "watermark":
+        return add_watermark
+    if case == "filter":
+        return apply_filter
+    if case == "decode":
+        return decode_buffered
+    if case == "stream_decode":
+        return decode_streamed
+
+    # Imported lazily: worker.py pulls in pika and minio, but only builds clients
+    from worker import process_image
+
+    def run_pipeline(image_data):
+        # process_image logs every operation; keep that out of the output
+        with contextlib.redirect_stdout(io.StringIO()):
+            return process_image(image_data, pipeline)
+    return run_pipeline
+
+
+def decode_buffered(image_data):
+    img = Image.open(io.BytesIO(image_data))
+    img.load()
+    return img
+
+
+def decode_streamed(image_data, chunk_size=64 * 1024):
+    decoder = StreamingDecoder()
+    for start in range(0, len(image_data), chunk_size):
+        decoder.feed(image_data[start:start + chunk_size])
+    return decoder.close()
+
+
+def output_size(output):
+    if isinstance(output, Image.Image):
+        return output.width * output.height * len(output.getbands())
+    return len(output)
+
+
+def run_case(case, width, height, mode, image_format, repeat, warmup, pipeline):
+    """Benchmark one case; runs inside a dedicated process"""
+    func = case_function(case, pipeline)
+    image_data = create_input(width, height, mode, image_format)
+    megapixels = width * height / 1e6
+    rss_before = peak_rss_mb()
+
+    for _ in range(warmup):
+        func(image_data)
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func(image_data)
+        timings.append(time.perf_counter() - start)
+
+    # Allocation profile of a single call; tracemalloc slows the call down,
+    # so it is kept out of the timed runs
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    func(image_data)
+    _, peak_traced = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated_blocks = sum(
+        stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0
+    )
+
+    median = statistics.median(timings)
+    peak_rss = peak_rss_mb()
+
+    return {
+        "case": case,
+        "size": f"{width}x{height}",
+        "mode": mode,
+        "format": image_format,
+        "input_bytes": len(image_data),
+        "output_bytes": output_size(output),
+        "megapixels": megapixels,
+        "repeat": repeat,
+        "mean": statistics.mean(timings),
+        "median": median,
+        "min": min(timings),
+        "max": max(timings),
+        "stdev": statistics.stdev(timings) if repeat > 1 else 0,
+        "mp_per_second": megapixels / median if median > 0 else 0,
+        "allocated_blocks": allocated_blocks,
+        "peak_traced_mb": peak_traced / (1024 * 1024),
+        "peak_rss_mb": peak_rss,
+        "rss_growth_mb": peak_rss - rss_before,
+    }
+
+
+def case_key(result):
+    return (result["case"], result["size"], result["mode"], result["format"])
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def print_results(results, previous=None):
+    """Print a table of results, with the median change against `previous`"""
+    baseline = {case_key(r): r for r in (previous or {}).get("results", [])}
+
+    header = (f"{'case':<13} {'size':>10} {'mode':>5} {'fmt':>5} {'median':>9} {'MP/s':>8} "
+              f"{'blocks':>8} {'traced':>8} {'peakRSS':>8}")
+    if baseline:
+        header += f" {'vs prev':>8}"
+    print(header)
+    print("-" * len(header))
+
+    for r in results:
+        line = (f"{r['case']:<13} {r['size']:>10} {r['mode']:>5} {r['format']:>5} "
+                f"{r['median'] * 1000:>7.1f}ms {r['mp_per_second']:>8.2f} "
+                f"{r['allocated_blocks']:>8} {r['peak_traced_mb']:>6.1f}MB {r['peak_rss_mb']:>6.0f}MB")
+        old = baseline.get(case_key(r))
+        if old:
+            change = (r["median"] - old["median"]) / old["median"] * 100
+            line += f" {change:>+7.1f}%"
+        elif baseline:
+            line += f" {'new':>8}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image processors offline")
+    parser.add_argument("--cases", default=",".join(CASES), help=f"Comma-separated: {', '.join(CASES)}")
+    parser.add_argument("--sizes", default="640x480,1920x1080,4000x3000", help="WIDTHxHEIGHT list")
+    parser.add_argument("--modes", default="RGB,RGBA,P", help=f"Comma-separated: {', '.join(MODES)}")
+    parser.add_argument("--formats", default="jpeg,png", help=f"Comma-separated: {', '.join(FORMATS)}")
+    parser.add_argument("--pipeline", default="resize,watermark",
+                        help="Operations of the pipeline case, as sent to the worker")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed calls per case")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed calls per case")
+    parser.add_argument("--history", default="benchmark_history.json", help="JSON history file")
+    parser.add_argument("--label", default=None, help="Description of this run")
+    parser.add_argument("--compare", action="store_true", help="Show change against the previous run")
+    parser.add_argument("--no-save", action="store_true", help="Do not append to the history")
+
+    args = parser.parse_args()
+
+    cases = [c.strip() for c in args.cases.split(",")]
+    modes = [m.strip() for m in args.modes.split(",")]
+    formats = [f.strip().lower() for f in args.formats.split(",")]
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    pipeline = [op.strip() for op in args.pipeline.split(",")]
+
+    for case in cases:
+        if case not in CASES:
+            parser.error(f"Unknown case: {case}")
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"Unknown mode: {mode}")
+    for image_format in formats:
+        if image_format not in FORMATS:
+            parser.error(f"Unknown format: {image_format}")
+
+    print(f"\nProcessor Benchmark")
+    print(f"=" * 60)
+    print(f"Python {platform.python_version()}, Pillow {PIL.__version__}, {platform.machine()}")
+    print(f"Cases: {', '.join(cases)} (pipeline: {', '.join(pipeline)})")
+    print(f"Repeat: {args.repeat} (+{args.warmup} warmup)")
+    print(f"=" * 60)
+
+    results = []
+    spawn = get_context("spawn")
+    for width, height in sizes:
+        for mode in modes:
+            for image_format in formats:
+                if (image_format, mode) in UNSUPPORTED:
+                    continue
+                for case in cases:
+                    print(f"  {case} {width}x{height} {mode} {image_format}...", flush=True)
+                    # A fresh process per case keeps peak RSS attributable
+                    with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                        results.append(executor.submit(
+                            run_case, case, width, height, mode, image_format,
+                            args.repeat, args.warmup, pipeline
+                        ).result())
+
+    history = load_history(args.history)
+    previous = history[-1] if args.compare and history else None
+
+    print()
+    print_results(results, previous)
+
+    if not args.no_save:
+        history.append({
+            "timestamp": time.time(),
+            "label": args.label,
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "results": results,
+        })
+        with open(args.history, "w") as f:
+            json.dump(history, f, indent=2)
+        print(f"\nResults appended to: {args.history} ({len(history)} runs)")
+
+
+if __name__ == "__main__":
+    main()
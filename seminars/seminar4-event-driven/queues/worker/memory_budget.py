@@ -0,0 +1,200 @@
+"""
+Memory-budgeted job admission
+
+A job's decoded working set is estimated from the image header (width,
+height, mode) and its operation list before any pixel buffer is allocated:
+StreamingDecoder calls Reservation.admit() as soon as the header has been
+parsed. A job is admitted into decoding and processing only while the sum
+of admitted estimates stays under the worker's budget, so many small
+images run side by side while a few large ones wait for each other
+instead of OOM-killing the container. Admission is FIFO, so a large job is
+not starved by a stream of small ones, and a job larger than the whole
+budget runs alone instead of never.
+
+The estimate counts Pillow's pixel buffers (4 bytes per pixel for RGB and
+every other multi-band mode) for the decoded image and the copies each
+operation makes; compressed bytes and encoded output are small next to them.
+"""
+import itertools
+import math
+import threading
+import time
+from collections import deque
+
+
+MB = 1024 * 1024
+
+# Output box of processors.resize.resize_to_fit()
+RESIZE_BOX = (800, 600)
+
+# Modes resize_to_fit() flattens onto a white background first
+FLATTENED_MODES = ("RGBA", "LA", "P")
+
+
+def pixel_bytes(mode: str) -> int:
+    """Bytes per pixel of Pillow's in-memory image for a mode"""
+    if mode in ("1", "L", "P"):
+        return 1
+    if mode.startswith("I;16"):
+        return 2
+    return 4
+
+
+def fit_size(width: int, height: int, box=RESIZE_BOX) -> tuple:
+    """Size after Image.thumbnail(box): shrink to fit, never enlarge"""
+    scale = min(box[0] / width, box[1] / height, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def estimate_working_set(width: int, height: int, mode: str, operations: list) -> int:
+    """
+    Peak bytes a job holds while it is decoded and processed
+
+    The decoded input stays alive for the whole job; each operation adds its
+    temporaries at the image size it runs on:
+      resize     - white background and split() bands (+ RGBA copy of a
+                   palette image) when flattening, the reduce() step
+                   (about a quarter of the pixels) and the thumbnail
+      watermark  - RGBA copy, overlay, composite and RGB result
+      filter     - filtered result (+ RGB copy of other modes)
+    """
+    decoded = width * height * pixel_bytes(mode)
+    peak_step = 0
+
+    for operation in operations:
+        pixels = width * height
+        if operation == "resize":
+            step = pixels
+            if mode in FLATTENED_MODES:
+                step += pixels * 4 * (3 if mode == "P" else 2)
+            width, height = fit_size(width, height)
+            step += width * height * 4
+        elif operation == "watermark":
+            step = 4 * pixels * 4
+        elif operation == "filter":
+            step = pixels * 4 * (1 if mode == "RGB" else 2)
+        else:
+            continue
+        mode = "RGB"
+        peak_step = max(peak_step, step)
+
+    # No operation: the decoded image is still converted for encoding
+    if not operations:
+        peak_step = width * height * 4
+    return decoded + peak_step
+
+
+class MemoryBudget:
+    """
+    Admit reservations while their total stays under `limit` bytes
+
+    Shared by every consumer in the process (in embedded mode, by every
+    worker thread), since they all draw on the same memory.
+    """
+
+    def __init__(self, limit: int, smoothing: float = 0.2):
+        self.limit = limit
+        self.smoothing = smoothing
+        self.cond = threading.Condition()
+        self.waiting = deque()
+        self.tickets = itertools.count()
+
+        self.in_use = 0
+        self.active = 0
+        self.peak = 0
+        self.typical = None  # EWMA of admitted estimates
+        self.admitted = 0
+        self.oversized = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.prefetch_count = None  # last prefetch applied from slots()
+
+    def acquire(self, size: int) -> float:
+        """Block until `size` bytes fit; returns the seconds spent waiting"""
+        with self.cond:
+            ticket = next(self.tickets)
+            self.waiting.append(ticket)
+            started = time.monotonic()
+            while self.waiting[0] != ticket or (self.active and self.in_use + size > self.limit):
+                self.cond.wait()
+            self.waiting.popleft()
+            waited = time.monotonic() - started
+
+            self.in_use += size
+            self.active += 1
+            self.peak = max(self.peak, self.in_use)
+            self.admitted += 1
+            if size > self.limit:
+                self.oversized += 1
+            if waited > 0.001:
+                self.waits += 1
+            self.wait_seconds += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.typical = size if self.typical is None else (
+                self.smoothing * size + (1 - self.smoothing) * self.typical)
+
+            # The next in line may fit as well
+            self.cond.notify_all()
+            return waited
+
+    def release(self, size: int):
+        with self.cond:
+            self.in_use -= size
+            self.active -= 1
+            self.cond.notify_all()
+
+    def reservation(self, operations: list) -> "Reservation":
+        return Reservation(self, operations)
+
+    def slots(self) -> int:
+        """How many typical jobs fit in the budget at once (1 before any job was seen)"""
+        if not self.typical:
+            return 1
+        return max(1, math.floor(self.limit / self.typical))
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                "limit_mb": self.limit / MB,
+                "in_use_mb": self.in_use / MB,
+                "peak_mb": self.peak / MB,
+                "utilization": self.in_use / self.limit if self.limit else None,
+                "active_jobs": self.active,
+                "waiting_jobs": len(self.waiting),
+                "typical_job_mb": None if self.typical is None else self.typical / MB,
+                "slots": self.slots(),
+                "prefetch_count": self.prefetch_count,
+                "admitted": self.admitted,
+                "oversized": self.oversized,
+                "waits": self.waits,
+                "wait_seconds_total": self.wait_seconds,
+                "max_wait_seconds": self.max_wait,
+            }
+
+
+class Reservation:
+    """One job's share of the budget: admit() once the header is known, release() when done"""
+
+    def __init__(self, budget: MemoryBudget, operations: list):
+        self.budget = budget
+        self.operations = operations
+        self.size = 0
+        self.waited = 0.0
+        self.held = False
+
+    def admit(self, image):
+        """StreamingDecoder header callback: reserve the estimate before pixels are allocated"""
+        if self.held:
+            return
+        self.size = estimate_working_set(image.width, image.height, image.mode, self.operations)
+        self.waited = self.budget.acquire(self.size)
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.budget.release(self.size)
+
+    def stats(self) -> dict:
+        return {"estimate_mb": self.size / MB, "wait_ms": self.waited * 1000}
@@ -0,0 +1,167 @@
+"""
+Incremental image decoding
+
+StreamingDecoder is fed an object chunk by chunk while it downloads. As
+soon as the header has been parsed, images stored as a single tile (JPEG,
+BMP, TGA, ...) are decoded straight into the image buffer, so decoding
+finishes when the last byte lands and every compressed chunk is dropped
+once the decoder has consumed it. Formats that need the whole file (PNG,
+WebP) are buffered and decoded when the stream ends.
+
+on_header(image) is called once the size and mode are known and before the
+pixel buffer is allocated, so a caller can budget memory (and wait) first.
+"""
+import platform
+import resource
+import time
+from io import BytesIO
+
+from PIL import Image
+
+
+# Give up on incremental decoding if the header has not parsed by then
+HEADER_LIMIT = 4 * 1024 * 1024
+
+
+def open_image(image_data: bytes | Image.Image) -> Image.Image:
+    """Image for encoded bytes; an already decoded Image is returned as-is"""
+    if isinstance(image_data, Image.Image):
+        return image_data
+    return Image.open(BytesIO(image_data))
+
+
+def current_rss_mb():
+    """Resident set size now (Linux), None elsewhere"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return pages * resource.getpagesize() / (1024 * 1024)
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+class StreamingDecoder:
+    """Decode an image from chunks as they arrive: feed() each chunk, then close()"""
+
+    def __init__(self, on_header=None):
+        self.on_header = on_header
+        self.buffer = bytearray()
+        self.image = None
+        self.decoder = None
+        self.offset = 0
+        self.next_open = 0
+        self.finished = False
+        self.incremental = False
+        self.bytes_received = 0
+        self.max_buffered = 0
+        self.started = time.perf_counter()
+        self.first_pixel = None
+        self.last_byte = None
+        self.done = None
+
+    def feed(self, chunk: bytes):
+        self.bytes_received += len(chunk)
+        self.last_byte = time.perf_counter()
+        if self.finished:
+            # Trailing bytes after the end-of-image marker
+            return
+
+        self.buffer += chunk
+        self.max_buffered = max(self.max_buffered, len(self.buffer))
+
+        if self.image is None and self.next_open <= len(self.buffer) <= HEADER_LIMIT:
+            self._open()
+        if self.decoder is not None:
+            self._decode()
+
+    def _open(self):
+        try:
+            image = Image.open(BytesIO(bytes(self.buffer)))
+        except OSError:
+            # Header incomplete (or a format that only opens whole, e.g. WebP):
+            # retry once the buffer has doubled to keep re-parsing linear
+            self.next_open = 2 * len(self.buffer)
+            return
+        self.image = image
+        if self.on_header:
+            self.on_header(image)
+
+        # Same setup as PIL.ImageFile.Parser, which however also refuses
+        # JPEG: its load_read() only pads truncated files with an EOI marker
+        needs_file = hasattr(image, "load_seek") or hasattr(image, "load_read")
+        if len(image.tile) != 1 or (needs_file and image.format != "JPEG"):
+            return
+
+        image.load_prepare()
+        decoder_name, extents, offset, args = image.tile[0]
+        image.tile = []
+        self.decoder = Image._getdecoder(image.mode, decoder_name, args, image.decoderconfig)
+        self.decoder.setimage(image.im, extents)
+        self.offset = offset
+        self.incremental = True
+
+    def _decode(self):
+        if self.offset:
+            skip = min(self.offset, len(self.buffer))
+            del self.buffer[:skip]
+            self.offset -= skip
+            if self.offset or not self.buffer:
+                return
+
+        if self.first_pixel is None:
+            self.first_pixel = time.perf_counter()
+        consumed, error = self.decoder.decode(bytes(self.buffer))
+
+        if consumed < 0:
+            self.finished = True
+            self.buffer.clear()
+            if error < 0:
+                raise OSError(f"Decoder error {error}")
+            return
+        del self.buffer[:consumed]
+
+    def close(self) -> Image.Image:
+        """Finish decoding; returns the loaded image"""
+        if self.decoder is not None:
+            try:
+                if not self.finished and self.buffer:
+                    self._decode()
+                if not self.finished:
+                    raise OSError("Image file is truncated")
+            finally:
+                self.decoder.cleanup()
+                self.decoder = None
+            image = self.image
+        else:
+            # Whole-file format: nothing could be decoded before the last byte
+            self.first_pixel = time.perf_counter()
+            image = Image.open(BytesIO(self.buffer))
+            if self.on_header and self.image is None:
+                self.on_header(image)
+            image.load()
+            self.buffer = bytearray()
+
+        self.done = time.perf_counter()
+        return image
+
+    def stats(self) -> dict:
+        """Timings in ms relative to the decoder's creation (i.e. the request)"""
+        def ms(moment):
+            return None if moment is None else (moment - self.started) * 1000
+
+        return {
+            "bytes": self.bytes_received,
+            "incremental": self.incremental,
+            "time_to_first_pixel_ms": ms(self.first_pixel),
+            "time_to_last_byte_ms": ms(self.last_byte),
+            "decoded_ms": ms(self.done),
+            "max_buffered_bytes": self.max_buffered,
+            "rss_mb": current_rss_mb(),
+            "peak_rss_mb": peak_rss_mb(),
+        }
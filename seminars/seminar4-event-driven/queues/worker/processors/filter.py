@@ -1,19 +1,21 @@
 from PIL import Image, ImageFilter
 from io import BytesIO
 
+from .decode import open_image
 
-def apply_filter(image_data: bytes, filter_type: str = "blur") -> bytes:
+
+def apply_filter(image_data: bytes | Image.Image, filter_type: str = "blur") -> bytes:
     """
     Apply filter to image
     
     Args:
-        image_data: Original image bytes
+        image_data: Original image bytes or an already decoded Image
         filter_type: Type of filter (blur, sharpen, contour, emboss)
         
     Returns:
         Filtered image bytes
     """
-    img = Image.open(BytesIO(image_data))
+    img = open_image(image_data)
     
     # Convert to RGB if needed
     if img.mode in ('RGBA', 'LA', 'P'):
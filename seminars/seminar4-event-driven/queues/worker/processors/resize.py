@@ -1,21 +1,11 @@
 from PIL import Image
 from io import BytesIO
 
+from .decode import open_image
 
-def resize_image(image_data: bytes, width: int = 800, height: int = 600) -> bytes:
-    """
-    Resize image to specified dimensions
-    
-    Args:
-        image_data: Original image bytes
-        width: Target width
-        height: Target height
-        
-    Returns:
-        Resized image bytes
-    """
-    img = Image.open(BytesIO(image_data))
-    
+
+def resize_to_fit(img: Image.Image, width: int = 800, height: int = 600) -> Image.Image:
+    """Flatten transparency onto white and shrink to fit, keeping the aspect ratio"""
     # Convert RGBA to RGB if needed
     if img.mode in ('RGBA', 'LA', 'P'):
         background = Image.new('RGB', img.size, (255, 255, 255))
@@ -26,6 +16,22 @@ def resize_image(image_data: bytes, width: int = 800, height: int = 600) -> byte
     
     # Resize maintaining aspect ratio
     img.thumbnail((width, height), Image.Resampling.LANCZOS)
+    return img
+
+
+def resize_image(image_data: bytes | Image.Image, width: int = 800, height: int = 600) -> bytes:
+    """
+    Resize image to specified dimensions
+    
+    Args:
+        image_data: Original image bytes or an already decoded Image
+        width: Target width
+        height: Target height
+        
+    Returns:
+        Resized image bytes
+    """
+    img = resize_to_fit(open_image(image_data), width, height)
     
     # Save to bytes
     output = BytesIO()
@@ -1,19 +1,33 @@
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
 
+from .decode import open_image
 
-def add_watermark(image_data: bytes, text: str = "PROCESSED") -> bytes:
+
+@lru_cache(maxsize=1)
+def load_font():
+    """Watermark font, loaded once per process"""
+    try:
+        # Try to use a better font
+        return ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 40)
+    except:
+        # Fallback to default font
+        return ImageFont.load_default()
+
+
+def add_watermark(image_data: bytes | Image.Image, text: str = "PROCESSED") -> bytes:
     """
     Add watermark text to image
     
     Args:
-        image_data: Original image bytes
+        image_data: Original image bytes or an already decoded Image
         text: Watermark text
         
     Returns:
         Watermarked image bytes
     """
-    img = Image.open(BytesIO(image_data))
+    img = open_image(image_data)
     
     # Convert to RGBA for transparency
     if img.mode != 'RGBA':
@@ -24,12 +38,7 @@ def add_watermark(image_data: bytes, text: str = "PROCESSED") -> bytes:
     draw = ImageDraw.Draw(overlay)
     
     # Calculate text size and position
-    try:
-        # Try to use a better font
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 40)
-    except:
-        # Fallback to default font
-        font = ImageFont.load_default()
+    font = load_font()
     
     # Get text bounding box
     bbox = draw.textbbox((0, 0), text, font=font)
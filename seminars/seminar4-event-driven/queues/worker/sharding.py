@@ -0,0 +1,88 @@
+"""
+Task queue shards and consistent-hash routing
+
+Jobs are spread over N durable queues, so no single queue process (and
+broker node) carries all of them. Shard 0 keeps the unsharded queue name
+and shard k is "<base>.<k>", so going from 1 to N shards leaves existing
+messages where they are.
+
+A job's shard is found on a hash ring with `replicas` points per shard:
+adding or removing a shard remaps only ~1/N of the keys (job IDs or
+content digests) instead of nearly all of them, as `hash % N` would.
+Workers use a second ring over worker slots to pick the shards they
+consume. This file is kept identical in api/ and worker/ (separate build
+contexts).
+"""
+import bisect
+import hashlib
+import math
+
+
+def shard_queue_name(base: str, index: int) -> str:
+    return base if index == 0 else f"{base}.{index}"
+
+
+def task_queue_names(base: str, shards: int) -> list:
+    return [shard_queue_name(base, index) for index in range(max(1, shards))]
+
+
+def ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of string keys onto `nodes` node indexes"""
+
+    def __init__(self, nodes: int, replicas: int = 160):
+        self.nodes = max(1, nodes)
+        points = sorted(
+            (ring_hash(f"node-{node}-{replica}"), node)
+            for node in range(self.nodes)
+            for replica in range(replicas)
+        )
+        self.hashes = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    def lookup(self, key: str) -> int:
+        position = bisect.bisect(self.hashes, ring_hash(key)) % len(self.hashes)
+        return self.owners[position]
+
+    def candidates(self, key: str):
+        """Distinct nodes clockwise from the key, its owner first"""
+        start = bisect.bisect(self.hashes, ring_hash(key))
+        seen = set()
+        for offset in range(len(self.owners)):
+            node = self.owners[(start + offset) % len(self.owners)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == self.nodes:
+                    return
+
+
+def assign_shards(queue_names: list, worker_index: int, worker_count: int) -> list:
+    """
+    Queues one worker of `worker_count` consumes
+
+    Every queue gets exactly one owner on the worker ring, with loads
+    bounded to ceil(queues / workers): a queue whose owner is full moves on
+    clockwise (consistent hashing with bounded loads), so the split stays
+    even and a change moves few queues. A worker that owns none (more
+    workers than shards) shares the queue its own slot hashes to, so no
+    worker sits idle. worker_count <= 0 means "consume all".
+    """
+    if worker_count <= 0:
+        return list(queue_names)
+
+    workers = HashRing(worker_count)
+    capacity = math.ceil(len(queue_names) / worker_count)
+    load = [0] * worker_count
+    owned = []
+    for name in queue_names:
+        owner = next(node for node in workers.candidates(name) if load[node] < capacity)
+        load[owner] += 1
+        if owner == worker_index % worker_count:
+            owned.append(name)
+    if not owned and queue_names:
+        owned = [queue_names[HashRing(len(queue_names)).lookup(f"worker-{worker_index}")]]
+    return owned
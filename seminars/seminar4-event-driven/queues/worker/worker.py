@@ -1,17 +1,29 @@
 import json
 import os
+import queue
 import sys
+import threading
 import time
 import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from io import BytesIO
 from datetime import datetime
 
 import pika
 from minio import Minio
 from minio.error import S3Error
+from PIL import Image
 
+import envelope
+from memory_budget import MB, MemoryBudget
+from sharding import assign_shards, shard_queue_name, task_queue_names
+from tombstones import TombstoneCache
+from processors.batch import WATERMARK_TEXT, process_batch, text_stamp
+from processors.decode import StreamingDecoder
 from processors.resize import resize_image
-from processors.watermark import add_watermark
+from processors.watermark import add_watermark, load_font
 from processors.filter import apply_filter
 
 
@@ -28,12 +40,63 @@ MINIO_SECURE = os.getenv("MINIO_SECURE", "false").lower() == "true"
 
 WORKER_ID = os.getenv("WORKER_ID", "1")
 
+# "sequential": one job at a time in the consumer callback
+# "staged": fetch / process / store threads overlap I/O with CPU work
+# "batch": up to BATCH_SIZE messages or BATCH_WAIT_MS, processed together
+WORKER_MODE = os.getenv("WORKER_MODE", "sequential")
+STAGE_QUEUE_SIZE = int(os.getenv("STAGE_QUEUE_SIZE", "2"))
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "16"))
+BATCH_WAIT_MS = float(os.getenv("BATCH_WAIT_MS", "50"))
+BATCH_IO_THREADS = int(os.getenv("BATCH_IO_THREADS", "8"))
+
+# Task queue shards (see sharding.py). WORKER_COUNT > 0 makes this worker
+# consume only the shards its slot WORKER_INDEX owns; 0 consumes all
+TASK_QUEUE_SHARDS = int(os.getenv("TASK_QUEUE_SHARDS", "1"))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "0"))
+SHARD_REFRESH_INTERVAL = float(os.getenv("SHARD_REFRESH_INTERVAL", "30"))
+
+# Decode images while they download instead of after response.read()
+STREAM_DECODE = os.getenv("STREAM_DECODE", "true").lower() == "true"
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", str(64 * 1024)))
+
+# Estimated decoded working set of all jobs in flight (see memory_budget.py).
+# In staged mode up to PROCESS_THREADS jobs decode and process at once
+# within it, and prefetch follows how many typical jobs fit
+MEMORY_BUDGET_MB = float(os.getenv("MEMORY_BUDGET_MB", "512"))
+PROCESS_THREADS = int(os.getenv("PROCESS_THREADS", str(os.cpu_count() or 1)))
+
+# GET /metrics (JSON) and /ready on this port; 0 = off
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Warm up (codecs, fonts, storage connections, self-test job) before consuming
+WARM_UP = os.getenv("WARM_UP", "true").lower() == "true"
+IMPORTED_AT = time.time()
+
+# Seconds between refreshes of the cancellation tombstones (see tombstones.py)
+CANCEL_REFRESH_INTERVAL = float(os.getenv("CANCEL_REFRESH_INTERVAL", "2"))
+
 TASK_QUEUE = "image_processing"
+DLQ_QUEUE = "dead_letter_queue"
 NOTIFICATION_QUEUE = "notifications"
+JOB_EVENTS_EXCHANGE = "job_events"
 UPLOAD_BUCKET = "images"
 PROCESSED_BUCKET = "processed"
 
 
+# RabbitMQ connection
+def get_rabbitmq_connection():
+    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+    parameters = pika.ConnectionParameters(
+        host=RABBITMQ_HOST,
+        port=RABBITMQ_PORT,
+        credentials=credentials,
+        heartbeat=600,
+        blocked_connection_timeout=300
+    )
+    return pika.BlockingConnection(parameters)
+
+
 # MinIO client
 minio_client = Minio(
     MINIO_ENDPOINT,
@@ -42,13 +105,83 @@ minio_client = Minio(
     secure=MINIO_SECURE
 )
 
+# One budget per process: every consumer draws on the same memory
+memory_budget = MemoryBudget(int(MEMORY_BUDGET_MB * MB))
+
+# Cancelled job IDs; the lambda looks minio_client up on every refresh
+cancellations = TombstoneCache(lambda: minio_client, interval=CANCEL_REFRESH_INTERVAL)
+
+# Connections Minio's urllib3 pool keeps per host
+STORAGE_POOL_SIZE = 10
+
+
+def process_started_at() -> float:
+    """Wall-clock start of this process (from /proc on Linux), else when this module was imported"""
+    try:
+        with open("/proc/self/stat") as f:
+            # starttime (field 22) in clock ticks since boot; fields counted after "(comm)"
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat") as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+    except (OSError, ValueError, IndexError, StopIteration):
+        return IMPORTED_AT
+    return min(boot_time + start_ticks / os.sysconf("SC_CLK_TCK"), IMPORTED_AT)
+
 
-def process_image(image_data: bytes, operations: list) -> bytes:
+class Startup:
+    """
+    Startup milestones of this process
+    
+    time_to_ready is process start -> warm-up done (/proc's start time has
+    one-second resolution; warm_up_ms is exact), time_to_first_job is
+    process start -> first completed job.
+    """
+    
+    def __init__(self):
+        self.started_at = process_started_at()
+        self.ready_at = None
+        self.first_job_at = None
+        self.warm_up = None
+        self.lock = threading.Lock()
+    
+    def mark_ready(self, timings: dict):
+        self.ready_at = time.time()
+        self.warm_up = timings
+        steps = ", ".join(f"{name} {ms:.0f} ms" for name, ms in timings.items()) or "skipped"
+        print(f"[Worker {WORKER_ID}] Ready {self.ready_at - self.started_at:.2f}s after start "
+              f"(warm-up: {steps})")
+    
+    def job_completed(self):
+        with self.lock:
+            if self.first_job_at is not None:
+                return
+            self.first_job_at = time.time()
+        after_ready = "" if self.ready_at is None else f", {self.first_job_at - self.ready_at:.2f}s after ready"
+        print(f"[Worker {WORKER_ID}] First job completed {self.first_job_at - self.started_at:.2f}s "
+              f"after start{after_ready}")
+    
+    def stats(self) -> dict:
+        def since_start(moment):
+            return None if moment is None else moment - self.started_at
+        
+        return {
+            "started_at": self.started_at,
+            "ready": self.ready_at is not None,
+            "time_to_ready": since_start(self.ready_at),
+            "time_to_first_job": since_start(self.first_job_at),
+            "warm_up_ms": self.warm_up
+        }
+
+
+startup = Startup()
+
+
+def process_image(image_data: bytes | Image.Image, operations: list) -> bytes:
     """
     Process image with specified operations
     
     Args:
-        image_data: Original image bytes
+        image_data: Original image bytes or an already decoded Image
         operations: List of operations to apply
         
     Returns:
@@ -68,83 +201,915 @@ def process_image(image_data: bytes, operations: list) -> bytes:
         else:
             print(f"[Worker {WORKER_ID}] Unknown operation: {operation}")
     
+    if isinstance(result, Image.Image):
+        # No operation applied to a decoded image: encode it like the processors do
+        output = BytesIO()
+        result.convert("RGB").save(output, format="JPEG", quality=85)
+        result = output.getvalue()
+    
     return result
 
 
-def callback(ch, method, properties, body):
+def publish_event(ch, event):
+    """Publish a job event to the fanout exchange (notifications + observers)"""
+    ch.basic_publish(
+        exchange=JOB_EVENTS_EXCHANGE,
+        routing_key='',
+        body=json.dumps(event),
+        properties=pika.BasicProperties(
+            delivery_mode=2,
+            content_type='application/json'
+        )
+    )
+
+
+class JobSkipped(Exception):
+    """A job acked without being processed: not a failure, so never retried"""
+    
+    status = "skipped"
+    
+    def __init__(self, stage: str, detail: str = ""):
+        super().__init__(f"{self.status} {stage.replace('_', ' ')}{detail}")
+        self.stage = stage
+
+
+class JobCancelled(JobSkipped):
+    """The job was cancelled (DELETE /jobs/{job_id})"""
+    status = "cancelled"
+
+
+class JobExpired(JobSkipped):
+    """The job's deadline passed: its client has stopped waiting"""
+    status = "expired"
+
+
+# Jobs dropped past their deadline, by stage
+expired_jobs = {}
+expired_lock = threading.Lock()
+
+
+def check_cancelled(message: dict, stage: str):
+    """Raise JobCancelled if the job has a tombstone"""
+    if message.get("job_id") in cancellations:
+        cancellations.record_skip(stage)
+        raise JobCancelled(stage)
+
+
+def check_deadline(message: dict, stage: str):
     """
-    Process message from queue
+    Raise JobExpired if the job's deadline (epoch seconds, set by the API)
+    has passed; assumes API and worker clocks roughly agree
+    """
+    deadline = message.get("deadline")
+    if deadline and time.time() > deadline:
+        with expired_lock:
+            expired_jobs[stage] = expired_jobs.get(stage, 0) + 1
+        raise JobExpired(stage, f" ({time.time() - deadline:.1f}s late)")
+
+
+def fetch_image(message: dict, reservation=None) -> tuple:
     """
+    Download and decode the job's source image
+    
+    Returns (image, decode stats). With STREAM_DECODE the response chunks
+    go straight into the decoder, so decoding ends with the last byte and
+    the compressed object is never held in memory as a whole. A reservation
+    is admitted against the memory budget once the header is parsed, i.e.
+    before the pixel buffer is allocated; the caller releases it.
+    Expired and cancelled jobs raise before anything is downloaded.
+    """
+    check_deadline(message, "before_download")
+    check_cancelled(message, "before_download")
+    bucket = message.get("bucket", UPLOAD_BUCKET)
+    decoder = StreamingDecoder(on_header=reservation.admit if reservation else None)
+    response = minio_client.get_object(bucket, message["file_name"])
     try:
-        # Parse message
-        message = json.loads(body)
-        job_id = message["job_id"]
-        file_name = message["file_name"]
-        operations = message["operations"]
-        bucket = message.get("bucket", UPLOAD_BUCKET)
-        
-        print(f"\n[Worker {WORKER_ID}] Processing job {job_id}")
-        print(f"[Worker {WORKER_ID}] File: {file_name}")
-        print(f"[Worker {WORKER_ID}] Operations: {operations}")
-        
-        start_time = time.time()
-        
-        # Download image from MinIO
-        print(f"[Worker {WORKER_ID}] Downloading from MinIO...")
-        response = minio_client.get_object(bucket, file_name)
-        image_data = response.read()
+        chunks = response.stream(STREAM_CHUNK_SIZE) if STREAM_DECODE else [response.read()]
+        for chunk in chunks:
+            decoder.feed(chunk)
+    finally:
         response.close()
         response.release_conn()
+    return decoder.close(), decoder.stats()
+
+
+def describe_decode(stats: dict) -> str:
+    rss = f", RSS {stats['rss_mb']:.0f} MB" if stats["rss_mb"] is not None else ""
+    return (f"{stats['bytes'] / 1024:.0f} KB {'streamed' if stats['incremental'] else 'buffered'}, "
+            f"first pixel {stats['time_to_first_pixel_ms']:.0f} ms, "
+            f"last byte {stats['time_to_last_byte_ms']:.0f} ms, "
+            f"decoded {stats['decoded_ms']:.0f} ms{rss}, peak RSS {stats['peak_rss_mb']:.0f} MB")
+
+
+def store_image(message: dict, processed_data: bytes) -> str:
+    """Upload the processed image; returns its object name once MinIO has it"""
+    # A job cancelled while it was processed has no use for its result
+    check_cancelled(message, "before_upload")
+    processed_file_name = f"processed_{message['file_name']}"
+    minio_client.put_object(
+        PROCESSED_BUCKET,
+        processed_file_name,
+        BytesIO(processed_data),
+        length=len(processed_data),
+        content_type="image/jpeg"
+    )
+    return processed_file_name
+
+
+def completed_event(message: dict, processed_file_name: str, processing_time: float, started_at: float,
+                    decode: dict = None, admission: dict = None) -> dict:
+    startup.job_completed()
+    return {
+        "job_id": message["job_id"],
+        "status": "completed",
+        "processed_file": processed_file_name,
+        "processing_time": processing_time,
+        "worker_id": WORKER_ID,
+        "timestamp": datetime.now().isoformat(),
+        "enqueued_at": message.get("enqueued_at"),
+        "started_at": started_at,
+        "completed_at": time.time(),
+        "decode": decode,
+        "admission": admission
+    }
+
+
+def failed_event(message: dict, error: Exception, started_at: float) -> dict:
+    return {
+        "job_id": message["job_id"],
+        "status": "failed",
+        "error": str(error),
+        "worker_id": WORKER_ID,
+        "timestamp": datetime.now().isoformat(),
+        "enqueued_at": message.get("enqueued_at"),
+        "started_at": started_at,
+        "completed_at": time.time()
+    }
+
+
+def skipped_event(message: dict, error: JobSkipped, started_at: float) -> dict:
+    return {
+        "job_id": message["job_id"],
+        "status": error.status,
+        "stage": error.stage,
+        "deadline": message.get("deadline"),
+        "worker_id": WORKER_ID,
+        "timestamp": datetime.now().isoformat(),
+        "enqueued_at": message.get("enqueued_at"),
+        "started_at": started_at,
+        "completed_at": time.time()
+    }
+
+
+def reject(ch, delivery_tag, message: dict, error: Exception, started_at: float):
+    """Publish a failure event (if the job is known) and dead-letter the message"""
+    # Let observers stop waiting for this job
+    if "job_id" in message:
+        try:
+            publish_event(ch, failed_event(message, error, started_at))
+        except Exception:
+            pass
+    
+    # Reject and requeue (will go to DLQ after retries)
+    ch.basic_nack(delivery_tag=delivery_tag, requeue=False)
+
+
+def publish_task(ch, message: dict, queue: str = TASK_QUEUE):
+    """Publish a single-job message to a task queue shard"""
+    ch.basic_publish(
+        exchange='',
+        routing_key=queue,
+        body=json.dumps(message),
+        properties=pika.BasicProperties(
+            delivery_mode=2,
+            content_type='application/json'
+        )
+    )
+
+
+def settle_envelope(ch, delivery_tag, failed: list, queue: str = TASK_QUEUE):
+    """
+    Ack an envelope whose jobs have all finished
+    
+    Failed jobs are first republished as single-job messages, so they are
+    retried (and dead-lettered, if they fail again) on their own instead of
+    redelivering the jobs that already completed. They go back to the
+    envelope's own shard. If republishing fails the envelope stays unacked
+    and the broker redelivers all of it.
+    """
+    for message in failed:
+        publish_task(ch, message, queue)
+    ch.basic_ack(delivery_tag=delivery_tag)
+    if failed:
+        print(f"[Worker {WORKER_ID}] Split {len(failed)} failed jobs out of the envelope")
+
+
+def run_job(message: dict, started_at: float) -> dict:
+    """Fetch, process and store one job; returns its completed event"""
+    job_id = message["job_id"]
+    
+    print(f"\n[Worker {WORKER_ID}] Processing job {job_id}")
+    print(f"[Worker {WORKER_ID}] File: {message['file_name']}")
+    print(f"[Worker {WORKER_ID}] Operations: {message['operations']}")
+    
+    start_time = time.time()
+    
+    reservation = memory_budget.reservation(message["operations"])
+    try:
+        # Download image from MinIO
+        print(f"[Worker {WORKER_ID}] Downloading from MinIO...")
+        image, decode_stats = fetch_image(message, reservation)
+        print(f"[Worker {WORKER_ID}] Decoded {image.width}x{image.height}: {describe_decode(decode_stats)}")
         
         # Process image
         print(f"[Worker {WORKER_ID}] Processing image...")
-        processed_data = process_image(image_data, operations)
-        
-        # Upload processed image
-        processed_file_name = f"processed_{file_name}"
-        print(f"[Worker {WORKER_ID}] Uploading processed image...")
-        
-        minio_client.put_object(
-            PROCESSED_BUCKET,
-            processed_file_name,
-            BytesIO(processed_data),
-            length=len(processed_data),
-            content_type="image/jpeg"
-        )
-        
-        processing_time = time.time() - start_time
+        processed_data = process_image(image, message["operations"])
+        del image
+    finally:
+        reservation.release()
+    
+    # Upload processed image
+    print(f"[Worker {WORKER_ID}] Uploading processed image...")
+    processed_file_name = store_image(message, processed_data)
+    
+    processing_time = time.time() - start_time
+    print(f"[Worker {WORKER_ID}] Job {job_id} completed in {processing_time:.2f}s")
+    
+    return completed_event(message, processed_file_name, processing_time, started_at, decode_stats,
+                           reservation.stats())
+
+
+def envelope_callback(ch, method, body):
+    """Run every job of an envelope, then ack it once (see settle_envelope)"""
+    try:
+        jobs = envelope.decode(body)
+    except ValueError as e:
+        print(f"[Worker {WORKER_ID}] Dropping malformed envelope: {e}")
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        return
+    
+    print(f"\n[Worker {WORKER_ID}] Envelope with {len(jobs)} jobs")
+    failed = []
+    
+    for message in jobs:
+        started_at = time.time()
+        try:
+            # Send notification
+            publish_event(ch, run_job(message, started_at))
+        except JobSkipped as e:
+            print(f"[Worker {WORKER_ID}] Job {message['job_id']} {e}")
+            publish_event(ch, skipped_event(message, e, started_at))
+        except Exception as e:
+            print(f"[Worker {WORKER_ID}] Error processing job {message['job_id']}: {e}")
+            traceback.print_exc()
+            failed.append(message)
+    
+    settle_envelope(ch, method.delivery_tag, failed, method.routing_key)
+
+
+def callback(ch, method, properties, body):
+    """
+    Process message from queue
+    """
+    if envelope.is_envelope(properties):
+        envelope_callback(ch, method, body)
+        return
+    
+    message = {}
+    started_at = time.time()
+    
+    try:
+        # Parse message
+        message = json.loads(body)
         
         # Send notification
-        notification = {
-            "job_id": job_id,
-            "status": "completed",
-            "processed_file": processed_file_name,
-            "processing_time": processing_time,
-            "worker_id": WORKER_ID,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        ch.basic_publish(
-            exchange='',
-            routing_key=NOTIFICATION_QUEUE,
-            body=json.dumps(notification),
-            properties=pika.BasicProperties(
-                delivery_mode=2,
-                content_type='application/json'
-            )
-        )
-        
-        print(f"[Worker {WORKER_ID}] Job {job_id} completed in {processing_time:.2f}s")
+        publish_event(ch, run_job(message, started_at))
         
         # Acknowledge message
         ch.basic_ack(delivery_tag=method.delivery_tag)
         
+    except JobSkipped as e:
+        # Cancelled or expired, not failed: ack it so it is neither retried nor dead-lettered
+        print(f"[Worker {WORKER_ID}] Job {message['job_id']} {e}")
+        publish_event(ch, skipped_event(message, e, started_at))
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        
     except Exception as e:
         print(f"[Worker {WORKER_ID}] Error processing message: {e}")
         traceback.print_exc()
+        reject(ch, method.delivery_tag, message, e, started_at)
+
+
+class StagedPipeline:
+    """
+    Fetch, process and store stages in their own threads
+    
+    The consumer callback only hands deliveries to the fetch stage, so the
+    next job's bytes are downloading while the current one is processed and
+    the previous one uploads. Stages are joined by bounded queues: a slow
+    stage blocks the one before it instead of piling up images in memory,
+    and prefetch_count caps what waits in front of the fetch stage.
+    
+    The fetch and process stages run `threads` threads each. A job is
+    admitted into decoding only when its estimated working set fits in the
+    memory budget, and releases its share once processed, so the number of
+    jobs decoding and processing at once follows image sizes: many small
+    ones side by side, large ones a few at a time. Prefetch is adjusted to
+    the number of typical jobs the budget fits (adjust_prefetch()).
+    
+    pika channels are not thread-safe, so acks and events are handed back
+    to the connection thread with add_callback_threadsafe(). A job is acked
+    only after its upload returned, i.e. once MinIO has stored the result.
+    The jobs of an envelope go through the stages one by one; the shared
+    envelope record is only touched on the connection thread, which acks
+    it when its last job has finished.
+    """
+    
+    def __init__(self, connection, channel, queue_size=STAGE_QUEUE_SIZE, threads=PROCESS_THREADS,
+                 budget=memory_budget):
+        self.connection = connection
+        self.channel = channel
+        self.budget = budget
+        self.fetch_queue = queue.Queue()
+        self.process_queue = queue.Queue(maxsize=queue_size)
+        self.store_queue = queue.Queue(maxsize=queue_size)
+        self.stopping = threading.Event()
+        self.prefetch = None
+        # (inbox, threads) per stage, in pipeline order
+        self.stages = [
+            (self.fetch_queue, self._start("fetch", threads, self.fetch_queue, self._fetch, self.process_queue)),
+            (self.process_queue, self._start("process", threads, self.process_queue, self._process,
+                                             self.store_queue)),
+            (self.store_queue, self._start("store", 1, self.store_queue, self._store, None)),
+        ]
+    
+    def _start(self, name, count, inbox, step, outbox):
+        threads = [threading.Thread(target=self._stage, args=(inbox, step, outbox),
+                                    name=f"{name}-{i + 1}", daemon=True) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+    
+    def prefetch_count(self):
+        """
+        Unacked deliveries to hold: as many jobs as the budget admits at once
+        (at most what the fetch and process stages can hold), plus the store
+        stage and one waiting for admission
+        """
+        fetching, processing = len(self.stages[0][1]), len(self.stages[1][1])
+        admitted = min(self.budget.slots(), fetching + processing + self.process_queue.maxsize)
+        return admitted + self.store_queue.maxsize + 2
+    
+    def adjust_prefetch(self):
+        """Re-issue basic_qos when the budget fits a different number of jobs (connection thread)"""
+        count = self.prefetch_count()
+        if count == self.prefetch:
+            return
+        self.channel.basic_qos(prefetch_count=count, global_qos=True)
+        if self.prefetch is not None:
+            print(f"[Worker {WORKER_ID}] Prefetch {self.prefetch} -> {count} "
+                  f"(typical job {self.budget.stats()['typical_job_mb']:.1f} MB, "
+                  f"budget {self.budget.limit / MB:.0f} MB)")
+        self.prefetch = self.budget.prefetch_count = count
+    
+    def on_message(self, ch, method, properties, body):
+        if not envelope.is_envelope(properties):
+            self.fetch_queue.put({
+                "delivery_tag": method.delivery_tag,
+                "body": body,
+                "message": {},
+                "started_at": time.time()
+            })
+            return
         
-        # Reject and requeue (will go to DLQ after retries)
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        try:
+            jobs = envelope.decode(body)
+        except ValueError as e:
+            print(f"[Worker {WORKER_ID}] Dropping malformed envelope: {e}")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return
+        
+        batch = {"delivery_tag": method.delivery_tag, "queue": method.routing_key,
+                 "remaining": len(jobs), "failed": []}
+        for message in jobs:
+            self.fetch_queue.put({
+                "delivery_tag": method.delivery_tag,
+                "message": message,
+                "envelope": batch,
+                "started_at": time.time()
+            })
+    
+    def _stage(self, inbox, step, outbox):
+        while True:
+            job = inbox.get()
+            if job is None:
+                return
+            if self.stopping.is_set():
+                self._release(job)
+                continue
+            try:
+                step(job)
+            except JobSkipped as e:
+                print(f"[Worker {WORKER_ID}] Job {job['message']['job_id']} {e}")
+                self._release(job)
+                self._settle(lambda job=job, e=e: self._skip(job, e))
+                continue
+            except Exception as e:
+                print(f"[Worker {WORKER_ID}] Error processing message: {e}")
+                traceback.print_exc()
+                self._release(job)
+                if "envelope" in job:
+                    self._settle(lambda job=job: self._finish_envelope_job(job, failed=True))
+                else:
+                    self._settle(lambda job=job, e=e: reject(
+                        self.channel, job["delivery_tag"], job["message"], e, job["started_at"]))
+                continue
+            if outbox is not None:
+                outbox.put(job)
+    
+    def _fetch(self, job):
+        if not job["message"]:
+            job["message"] = json.loads(job["body"])
+        job["start_time"] = time.time()
+        job["reservation"] = self.budget.reservation(job["message"]["operations"])
+        print(f"\n[Worker {WORKER_ID}] Fetching job {job['message']['job_id']}")
+        job["image"], job["decode"] = fetch_image(job["message"], job["reservation"])
+        print(f"[Worker {WORKER_ID}] Decoded {job['image'].width}x{job['image'].height}: "
+              f"{describe_decode(job['decode'])}")
+    
+    def _process(self, job):
+        message = job["message"]
+        print(f"[Worker {WORKER_ID}] Processing job {message['job_id']}: {message['operations']}")
+        try:
+            job["processed_data"] = process_image(job.pop("image"), message["operations"])
+        finally:
+            self._release(job)
+    
+    def _release(self, job):
+        """Return the job's share of the memory budget (once its pixels are gone)"""
+        job.pop("image", None)
+        if "reservation" in job:
+            job["reservation"].release()
+    
+    def _store(self, job):
+        message = job["message"]
+        processed_file_name = store_image(message, job.pop("processed_data"))
+        processing_time = time.time() - job["start_time"]
+        event = completed_event(message, processed_file_name, processing_time, job["started_at"],
+                                job["decode"], job["reservation"].stats())
+        
+        def complete():
+            publish_event(self.channel, event)
+            if "envelope" in job:
+                self._finish_envelope_job(job)
+            else:
+                self.channel.basic_ack(delivery_tag=job["delivery_tag"])
+        
+        self._settle(complete)
+        print(f"[Worker {WORKER_ID}] Job {message['job_id']} completed in {processing_time:.2f}s")
+    
+    def _skip(self, job, error):
+        """Runs on the connection thread: report the skip and ack like a completed job"""
+        publish_event(self.channel, skipped_event(job["message"], error, job["started_at"]))
+        if "envelope" in job:
+            self._finish_envelope_job(job)
+        else:
+            self.channel.basic_ack(delivery_tag=job["delivery_tag"])
+    
+    def _finish_envelope_job(self, job, failed=False):
+        """Runs on the connection thread"""
+        batch = job["envelope"]
+        if failed:
+            batch["failed"].append(job["message"])
+        batch["remaining"] -= 1
+        if batch["remaining"] == 0:
+            settle_envelope(self.channel, batch["delivery_tag"], batch["failed"], batch["queue"])
+    
+    def _settle(self, fn):
+        """Run fn on the connection thread; if the connection is gone the broker redelivers"""
+        try:
+            self.connection.add_callback_threadsafe(fn)
+        except Exception as e:
+            print(f"[Worker {WORKER_ID}] Could not settle job, it will be redelivered: {e}")
+    
+    def stop(self):
+        """Drop pending work and join the stages; unacked jobs are redelivered by the broker"""
+        self.stopping.set()
+        # Stage by stage, so no thread is left blocked on a full queue behind it
+        for inbox, threads in self.stages:
+            for _ in threads:
+                inbox.put(None)
+            for thread in threads:
+                thread.join(timeout=30)
+
+
+def check_job_message(message):
+    """Raise ValueError unless a message has what the batch grouping reads (job_id, operations)"""
+    if not isinstance(message, dict) or "job_id" not in message:
+        raise ValueError("Job message without a job_id")
+    operations = message.get("operations")
+    if not isinstance(operations, list) or not all(isinstance(op, str) for op in operations):
+        raise ValueError(f"Job {message['job_id']} has no list of operations")
+
+
+class BatchConsumer:
+    """
+    Micro-batches of up to `size` deliveries, or whatever arrived within `wait`
+    
+    A batch's inputs are downloaded concurrently, jobs with the same
+    operations are processed together by processors.batch (shared font and
+    text stamp, vectorized blend and blur over same-size images), and the
+    results are uploaded concurrently. Failed plain messages are rejected
+    on their own, failed envelope jobs are split out (see settle_envelope),
+    and everything else is settled with one basic_ack(multiple=True).
+    
+    prefetch_count equals the batch size, so the broker never delivers a
+    message that the multiple ack could settle before it was processed.
+    Batches are bounded by that size rather than by the memory budget: all
+    of a batch's images are decoded before any of them is processed.
+    """
+    
+    def __init__(self, connection, channel, size=BATCH_SIZE, wait=BATCH_WAIT_MS / 1000,
+                 io_threads=BATCH_IO_THREADS):
+        self.connection = connection
+        self.channel = channel
+        self.size = size
+        self.wait = wait
+        self.pool = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="batch-io")
+        self.pending = []
+        self.deadline = None
+    
+    def on_message(self, ch, method, properties, body):
+        if not self.pending:
+            self.deadline = time.monotonic() + self.wait
+        self.pending.append((method.delivery_tag, method.routing_key, properties, body))
+        if len(self.pending) >= self.size:
+            self.flush()
+    
+    def run(self, subscription):
+        """Drive the connection, flushing partial batches when their wait is over"""
+        while self.channel.is_open:
+            timeout = max(0.0, self.deadline - time.monotonic()) if self.pending else 1.0
+            subscription.poll(timeout)
+            if self.pending and time.monotonic() >= self.deadline:
+                self.flush()
+    
+    def _each(self, step, jobs):
+        """Run step(job) concurrently for the jobs that have not failed yet"""
+        def run(job):
+            try:
+                step(job)
+            except Exception as e:
+                job["error"] = e
+        
+        list(self.pool.map(run, [job for job in jobs if job["error"] is None]))
+    
+    def flush(self):
+        pending, self.pending = self.pending, []
+        started_at = time.time()
+        
+        # Malformed deliveries are dead-lettered here and left out of the
+        # batch, so the multiple ack in _settle never names a settled tag
+        deliveries = []
+        jobs = []
+        for delivery_tag, queue, properties, body in pending:
+            is_envelope = envelope.is_envelope(properties)
+            try:
+                messages = envelope.decode(body) if is_envelope else [json.loads(body)]
+                for message in messages:
+                    check_job_message(message)
+            except ValueError as e:
+                print(f"[Worker {WORKER_ID}] Dropping malformed message: {e}")
+                self.channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
+                continue
+            deliveries.append((delivery_tag, queue, properties, body))
+            jobs.extend({"delivery_tag": delivery_tag, "queue": queue, "envelope": is_envelope,
+                         "message": message, "error": None} for message in messages)
+        
+        def fetch(job):
+            job["image"], job["decode"] = fetch_image(job["message"])
+        
+        def store(job):
+            job["processed_file"] = store_image(job["message"], job.pop("processed_data"))
+        
+        self._each(fetch, jobs)
+        
+        groups = {}
+        for job in jobs:
+            if job["error"] is None:
+                groups.setdefault(tuple(job["message"]["operations"]), []).append(job)
+        for operations, group in groups.items():
+            outputs = process_batch([job.pop("image") for job in group], list(operations))
+            for job, output in zip(group, outputs):
+                if isinstance(output, Exception):
+                    job["error"] = output
+                else:
+                    job["processed_data"] = output
+        
+        self._each(store, jobs)
+        if deliveries:
+            self._settle(deliveries, jobs, started_at)
+    
+    def _settle(self, deliveries, jobs, started_at):
+        processing_time = time.time() - started_at
+        failed = {}
+        for job in jobs:
+            if job["error"] is None:
+                publish_event(self.channel, completed_event(job["message"], job["processed_file"],
+                                                            processing_time, started_at, job["decode"]))
+            elif isinstance(job["error"], JobSkipped):
+                # Acked with the rest of the batch
+                publish_event(self.channel, skipped_event(job["message"], job["error"], started_at))
+            else:
+                print(f"[Worker {WORKER_ID}] Job {job['message'].get('job_id')} failed: {job['error']}")
+                failed.setdefault(job["delivery_tag"], []).append(job)
+        
+        # Settle failures individually first; the multiple ack below then
+        # only covers deliveries that are still outstanding
+        rejected = set()
+        for delivery_tag, failed_jobs in failed.items():
+            if failed_jobs[0]["envelope"]:
+                for job in failed_jobs:
+                    publish_task(self.channel, job["message"], job["queue"])
+            else:
+                job = failed_jobs[0]
+                reject(self.channel, delivery_tag, job["message"], job["error"], started_at)
+                rejected.add(delivery_tag)
+        
+        # Every tag up to max(acked) is now either rejected above or done
+        acked = [tag for tag, _, _, _ in deliveries if tag not in rejected]
+        if acked:
+            self.channel.basic_ack(delivery_tag=max(acked), multiple=True)
+        
+        skipped = sum(isinstance(job["error"], JobSkipped) for job in jobs)
+        completed = len(jobs) - skipped - sum(len(failed_jobs) for failed_jobs in failed.values())
+        print(f"[Worker {WORKER_ID}] Batch of {len(deliveries)} messages: {completed}/{len(jobs)} jobs "
+              f"completed{f', {skipped} cancelled or expired' if skipped else ''} in {processing_time:.2f}s "
+              f"({len(jobs) / max(processing_time, 1e-6):.1f} jobs/s)")
+    
+    def stop(self):
+        self.pool.shutdown(wait=False)
+
+
+def warm_codecs():
+    """Load every Pillow plugin and run each codec the jobs use once"""
+    Image.init()
+    sample = Image.new("RGBA", (64, 64), (200, 100, 50, 128))
+    for fmt in ("JPEG", "PNG", "WEBP"):
+        if fmt not in Image.SAVE:
+            continue
+        buffer = BytesIO()
+        (sample.convert("RGB") if fmt == "JPEG" else sample).save(buffer, format=fmt)
+        Image.open(BytesIO(buffer.getvalue())).load()
+
+
+def storage_concurrency() -> int:
+    """Storage requests this worker's mode keeps in flight at once"""
+    if WORKER_MODE == "staged":
+        return PROCESS_THREADS + 1
+    if WORKER_MODE == "batch":
+        return BATCH_IO_THREADS
+    return 1
+
+
+def open_storage_connections(count: int):
+    """Open `count` pooled connections with concurrent requests (sequential ones would reuse one)"""
+    count = max(1, min(count, STORAGE_POOL_SIZE))
+    barrier = threading.Barrier(count)
+    
+    def probe(_):
+        try:
+            barrier.wait(timeout=5)
+        except threading.BrokenBarrierError:
+            pass
+        minio_client.bucket_exists(UPLOAD_BUCKET)
+    
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        list(pool.map(probe, range(count)))
+
+
+def self_test():
+    """Run a tiny job through fetch, process and store like a real one, then delete its objects"""
+    message = {
+        "job_id": "warm-up",
+        "file_name": f"_warmup/{WORKER_ID}-{uuid.uuid4().hex}.png",
+        "bucket": UPLOAD_BUCKET,
+        "operations": ["resize", "watermark", "filter"]
+    }
+    buffer = BytesIO()
+    Image.new("RGBA", (96, 64), (30, 120, 200, 255)).save(buffer, format="PNG")
+    data = buffer.getvalue()
+    minio_client.put_object(UPLOAD_BUCKET, message["file_name"], BytesIO(data), length=len(data),
+                            content_type="image/png")
+    
+    processed_file_name = None
+    try:
+        image, _ = fetch_image(message)
+        if WORKER_MODE == "batch":
+            processed_data = process_batch([image], message["operations"])[0]
+            if isinstance(processed_data, Exception):
+                raise processed_data
+        else:
+            processed_data = process_image(image, message["operations"])
+        if Image.open(BytesIO(processed_data)).size != image.size:
+            raise RuntimeError("Self-test produced an image of the wrong size")
+        processed_file_name = store_image(message, processed_data)
+    finally:
+        minio_client.remove_object(UPLOAD_BUCKET, message["file_name"])
+        if processed_file_name:
+            minio_client.remove_object(PROCESSED_BUCKET, processed_file_name)
+
+
+def warm_up():
+    """
+    Pay the one-off costs of the first jobs before taking any
+    
+    Plugin imports and codec setup, the watermark font, storage connections
+    and the first run through every code path otherwise land on the first
+    jobs, i.e. on freshly autoscaled workers exactly when they are needed.
+    Raises if the self-test fails, so a broken worker never consumes.
+    """
+    timings = {}
+    steps = [
+        ("codecs", warm_codecs),
+        ("fonts", lambda: (load_font(), text_stamp(WATERMARK_TEXT))),
+        ("storage", lambda: open_storage_connections(storage_concurrency())),
+        ("self_test", self_test),
+    ]
+    for name, step in steps:
+        step_started = time.perf_counter()
+        step()
+        timings[name] = (time.perf_counter() - step_started) * 1000
+    startup.mark_ready(timings)
+
+
+def declare_task_queue(channel, queue: str):
+    """Task queue shard dead-lettering into the shared DLQ (same arguments as the API)"""
+    channel.queue_declare(
+        queue=queue,
+        durable=True,
+        arguments={
+            'x-dead-letter-exchange': '',
+            'x-dead-letter-routing-key': DLQ_QUEUE
+        }
+    )
+
+
+class ShardSubscription:
+    """
+    Keep a channel consuming this worker's share of the task queue shards
+    
+    Every refresh_interval the shard set is rediscovered: shards below
+    TASK_QUEUE_SHARDS are declared, and higher-numbered shards that still
+    exist (left behind when the shard count was lowered) are found with
+    passive declares, so they are drained rather than stranded. When the
+    set or this worker's share changes, consumers are moved; pika requeues
+    whatever a cancelled consumer had prefetched but not yet dispatched.
+    """
+    
+    def __init__(self, connection, channel, on_message, shards=TASK_QUEUE_SHARDS,
+                 worker_index=WORKER_INDEX, worker_count=WORKER_COUNT,
+                 refresh_interval=SHARD_REFRESH_INTERVAL):
+        self.connection = connection
+        self.channel = channel
+        self.on_message = on_message
+        self.shards = shards
+        self.worker_index = worker_index
+        self.worker_count = worker_count
+        self.refresh_interval = refresh_interval
+        self.consumers = {}  # queue -> consumer tag
+        self.next_refresh = 0.0
+        
+        self.channel.queue_declare(queue=DLQ_QUEUE, durable=True)
+        self.refresh()
+    
+    def discover(self) -> list:
+        """Names of every existing shard, declaring the configured ones"""
+        names = task_queue_names(TASK_QUEUE, self.shards)
+        for name in names:
+            declare_task_queue(self.channel, name)
+        
+        # A failed passive declare closes its channel, so probe on a spare one
+        probe = self.connection.channel()
+        try:
+            while True:
+                name = shard_queue_name(TASK_QUEUE, len(names))
+                probe.queue_declare(queue=name, passive=True)
+                names.append(name)
+        except pika.exceptions.ChannelClosedByBroker:
+            pass
+        finally:
+            if probe.is_open:
+                probe.close()
+        return names
+    
+    def refresh(self):
+        self.next_refresh = time.monotonic() + self.refresh_interval
+        assigned = assign_shards(self.discover(), self.worker_index, self.worker_count)
+        if set(assigned) == set(self.consumers):
+            return
+        
+        for name in [name for name in self.consumers if name not in assigned]:
+            self.channel.basic_cancel(self.consumers.pop(name))
+        for name in assigned:
+            if name not in self.consumers:
+                self.consumers[name] = self.channel.basic_consume(queue=name, on_message_callback=self.on_message)
+        print(f"[Worker {WORKER_ID}] Consuming {', '.join(assigned)}")
+    
+    def poll(self, time_limit):
+        """Dispatch deliveries for up to time_limit seconds, refreshing shards when due"""
+        self.connection.process_data_events(time_limit=time_limit)
+        if time.monotonic() >= self.next_refresh:
+            self.refresh()
+
+
+def consume(connection):
+    """
+    Declare the topology and process tasks until the connection closes
+    """
+    channel = connection.channel()
+    
+    # Declare queue
+    channel.queue_declare(queue=NOTIFICATION_QUEUE, durable=True)
+    channel.exchange_declare(exchange=JOB_EVENTS_EXCHANGE, exchange_type='fanout', durable=True)
+    channel.queue_bind(queue=NOTIFICATION_QUEUE, exchange=JOB_EVENTS_EXCHANGE)
+    
+    # Prefetch limits are channel-wide: one budget across all shard consumers
+    if WORKER_MODE == "staged":
+        pipeline = StagedPipeline(connection, channel)
+        pipeline.adjust_prefetch()
+        print(f"[Worker {WORKER_ID}] Waiting for messages (staged, {PROCESS_THREADS} threads, "
+              f"memory budget {MEMORY_BUDGET_MB:.0f} MB, prefetch {pipeline.prefetch})...")
+        subscription = ShardSubscription(connection, channel, pipeline.on_message)
+        try:
+            while channel.is_open:
+                subscription.poll(1.0)
+                pipeline.adjust_prefetch()
+        finally:
+            pipeline.stop()
+        return
+    
+    if WORKER_MODE == "batch":
+        batcher = BatchConsumer(connection, channel)
+        channel.basic_qos(prefetch_count=batcher.size, global_qos=True)
+        print(f"[Worker {WORKER_ID}] Waiting for messages (batch of {batcher.size}, "
+              f"wait {BATCH_WAIT_MS:.0f} ms)...")
+        try:
+            batcher.run(ShardSubscription(connection, channel, batcher.on_message))
+        finally:
+            batcher.stop()
+        return
+    
+    # Set QoS - process one message at a time
+    channel.basic_qos(prefetch_count=1, global_qos=True)
+    
+    # Start consuming
+    print(f"[Worker {WORKER_ID}] Waiting for messages...")
+    subscription = ShardSubscription(connection, channel, callback)
+    
+    while channel.is_open:
+        subscription.poll(1.0)
+
+
+def worker_metrics() -> dict:
+    """Memory budget use and admission waits, startup times, cancelled and expired jobs skipped"""
+    return {
+        "worker_id": WORKER_ID,
+        "mode": WORKER_MODE,
+        "timestamp": time.time(),
+        "startup": startup.stats(),
+        "memory_budget": memory_budget.stats(),
+        "cancellations": cancellations.stats(),
+        "expired": dict(expired_jobs)
+    }
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/ready":
+            # Readiness probe: 503 until warm-up has finished
+            ready = startup.ready_at is not None
+            body = json.dumps({"ready": ready}).encode()
+            self.send_response(200 if ready else 503)
+        elif self.path == "/metrics":
+            body = json.dumps(worker_metrics()).encode()
+            self.send_response(200)
+        else:
+            self.send_error(404)
+            return
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port: int):
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"[Worker {WORKER_ID}] Metrics on :{port}/metrics")
 
 
 def main():
@@ -154,6 +1119,10 @@ def main():
     print(f"[Worker {WORKER_ID}] Starting...")
     print(f"[Worker {WORKER_ID}] RabbitMQ: {RABBITMQ_HOST}:{RABBITMQ_PORT}")
     print(f"[Worker {WORKER_ID}] MinIO: {MINIO_ENDPOINT}")
+    print(f"[Worker {WORKER_ID}] Mode: {WORKER_MODE}")
+    
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT)
     
     # Wait for services to be ready
     max_retries = 30
@@ -161,30 +1130,13 @@ def main():
     
     while retry_count < max_retries:
         try:
-            # Test RabbitMQ connection
-            credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-            parameters = pika.ConnectionParameters(
-                host=RABBITMQ_HOST,
-                port=RABBITMQ_PORT,
-                credentials=credentials,
-                heartbeat=600,
-                blocked_connection_timeout=300
-            )
-            connection = pika.BlockingConnection(parameters)
-            channel = connection.channel()
-            
-            # Declare queue
-            channel.queue_declare(queue=TASK_QUEUE, durable=True)
-            channel.queue_declare(queue=NOTIFICATION_QUEUE, durable=True)
-            
-            # Set QoS - process one message at a time
-            channel.basic_qos(prefetch_count=1)
-            
-            # Start consuming
-            print(f"[Worker {WORKER_ID}] Waiting for messages...")
-            channel.basic_consume(queue=TASK_QUEUE, on_message_callback=callback)
-            
-            channel.start_consuming()
+            if startup.ready_at is None:
+                if WARM_UP:
+                    warm_up()
+                else:
+                    startup.mark_ready({})
+            cancellations.start()
+            consume(get_rabbitmq_connection())
             
         except KeyboardInterrupt:
             print(f"\n[Worker {WORKER_ID}] Shutting down...")